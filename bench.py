@@ -0,0 +1,364 @@
+# Benchmark of the blueprint generation pipeline
+#
+# generate synthetic videos and time every stage of BluePrint.get_player:
+#   python bench.py run --sizes 320x180 --frames 100,500 --heights 20,50 --out bench.json
+# compare two result files, exit with 1 if the new one regressed:
+#   python bench.py compare old.json new.json --threshold 0.1
+# compression throughput of zlib and ParallelDeflate on a player json:
+#   python bench.py compress --threads 1,2,4,8 --levels 6,9
+# ticks per second of the circuit simulator on a 100 row player, exit with 1 if it is slower than the limit:
+#   python bench.py simulate --height 100 --ticks 2000 --max-seconds 20
+
+import argparse
+import base64
+import concurrent.futures
+import io
+import json
+import os
+import platform
+import sys
+import time
+import zlib
+
+import cv2
+import numpy as np
+
+from blueprint import BluePrint, EntityStore, Monitor, ParallelDeflate
+
+STAGES = ["build_lamp", "build_decoder", "build_storage", "build_clock", "link", "encode"]
+
+
+def make_video(path, width, height, frames, fps=30):
+    """
+    write a synthetic video, moving gradients with a few static shots,
+    so storage layouts which collapse identical frames have something to do
+    """
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), fps, (width, height))
+    xs = np.linspace(0, 255, width, dtype=np.float32)[None, :]
+    ys = np.linspace(0, 255, height, dtype=np.float32)[:, None]
+    for i in range(frames):
+        if i % 50 >= 40:
+            i -= i % 50 - 40  # hold the frame for 10 frames
+        frame = np.empty((height, width, 3), dtype=np.uint8)
+        frame[..., 0] = (xs + i * 3) % 256
+        frame[..., 1] = (ys + i * 5) % 256
+        frame[..., 2] = (xs + ys + i * 7) % 256
+        writer.write(frame)
+    writer.release()
+
+
+def peak_rss_kb():
+    try:
+        import resource
+    except ImportError:  # windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+class CountingSink(object):
+    """text sink which only counts the written characters"""
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, s):
+        self.size += len(s)
+
+    def flush(self):
+        pass
+
+
+class BatchTotals(Monitor):
+    """sum the frame batch timings reported while build_storage reads the film"""
+
+    def __init__(self):
+        self.totals = {}
+
+    def batch(self, stage, counters):
+        for key, value in counters.items():
+            if key != "cached":
+                self.totals[key] = self.totals.get(key, 0) + value
+
+
+def run_case(video, height, layout, workers):
+    """build 1 player and time its stages, run in a fresh process so peak RSS belongs to this case"""
+    bp = BluePrint(video)
+    bp.set_height(height)
+    bp.STORAGE_LAYOUT = layout
+    bp.WORKERS = workers
+    bp.monitor = BatchTotals()
+    bp.store = EntityStore()
+    stages = {}
+    for name in STAGES:
+        entities = len(bp.store)
+        wires = len(bp.store.wires) // 4
+        start = time.perf_counter()
+        if name == "encode":
+            sink = CountingSink()
+            bp.write(sink)
+        else:
+            getattr(bp, name)()
+        stages[name] = {
+            "seconds": time.perf_counter() - start,
+            "entities": len(bp.store) - entities,
+            "wires": len(bp.store.wires) // 4 - wires,
+        }
+    total = sum(stage["seconds"] for stage in stages.values())
+    return {
+        "width": bp.WIDTH,
+        "height": bp.HEIGHT,
+        "frames": bp.frame_count,
+        "layout": layout,
+        "workers": workers,
+        "stages": stages,
+        "seconds": total,
+        "frame_timings": bp.monitor.totals,
+        "frames_per_second": bp.frame_count / max(stages["build_storage"]["seconds"], 1e-9),
+        "entities_per_second": len(bp.store) / max(total - stages["encode"]["seconds"], 1e-9),
+        "entities": len(bp.store),
+        "wires": len(bp.store.wires) // 4,
+        "peak_rss_kb": peak_rss_kb(),
+        "output_bytes": sink.size,
+    }
+
+
+def run(args):
+    os.makedirs(args.dir, exist_ok=True)
+    cases = []
+    for size in args.sizes.split(","):
+        width, height = (int(v) for v in size.split("x"))
+        for frames in (int(v) for v in args.frames.split(",")):
+            video = os.path.join(args.dir, "synthetic_{}x{}_{}.avi".format(width, height, frames))
+            if not os.path.exists(video):
+                make_video(video, width, height, frames)
+            for display_height in (int(v) for v in args.heights.split(",")):
+                name = "{}x{}_{}f_h{}_{}_w{}".format(width, height, frames, display_height, args.layout, args.workers)
+                with concurrent.futures.ProcessPoolExecutor(1) as pool:
+                    result = pool.submit(run_case, video, display_height, args.layout, args.workers).result()
+                result["name"] = name
+                cases.append(result)
+                print("\n{}: {:.2f}s, {:.1f} frames/s, {:.0f} entities/s, {} bytes".format(
+                    name, result["seconds"], result["frames_per_second"],
+                    result["entities_per_second"], result["output_bytes"]))
+    results = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "numpy": np.__version__,
+            "opencv": cv2.__version__,
+        },
+        "cases": cases,
+    }
+    with open(args.out, "w", encoding="utf8") as f:
+        json.dump(results, f, indent=2)
+    print("results written to", args.out)
+
+
+def compress_case(data, level, threads):
+    """compress data with plain zlib for 1 thread, else ParallelDeflate, check the stream decodes to data"""
+    start = time.perf_counter()
+    if threads > 1:
+        compressor = ParallelDeflate(level, threads)
+        out = compressor.compress(data) + compressor.flush()
+    else:
+        out = zlib.compress(data, level)
+    seconds = time.perf_counter() - start
+    if zlib.decompress(out) != data:
+        raise ValueError("compressed stream of {} threads doesn't decode to the input".format(threads))
+    return {"level": level, "threads": threads, "seconds": seconds, "output_bytes": len(out),
+            "mb_per_second": len(data) / max(seconds, 1e-9) / (1 << 20)}
+
+
+def compress(args):
+    if args.blueprint:
+        with open(args.blueprint, encoding="utf8") as f:
+            data = zlib.decompress(base64.b64decode(f.read().strip()[1:]))
+    else:
+        os.makedirs(args.dir, exist_ok=True)
+        video = os.path.join(args.dir, "synthetic_320x180_{}.avi".format(args.frames))
+        if not os.path.exists(video):
+            make_video(video, 320, 180, args.frames)
+        bp = BluePrint(video)
+        bp.set_height(args.height)
+        bp.monitor = None
+        bp.COMPRESS_LEVEL = 0  # stored blocks, the json is taken back out of the string
+        bp.build()
+        buf = io.StringIO()
+        bp.write(buf)
+        data = zlib.decompress(base64.b64decode(buf.getvalue()[1:]))
+    print("{} bytes of json, {} cpus".format(len(data), os.cpu_count()))
+    print("{:>5} {:>7} {:>9} {:>9} {:>8} {:>12}".format("level", "threads", "seconds", "MB/s", "speedup", "bytes"))
+    cases = []
+    for level in (int(v) for v in args.levels.split(",")):
+        single = None
+        for threads in (int(v) for v in args.threads.split(",")):
+            case = compress_case(data, level, threads)
+            if single is None:
+                single = case["seconds"]
+            case["speedup"] = single / max(case["seconds"], 1e-9)
+            cases.append(case)
+            print("{:>5} {:>7} {:>9.3f} {:>9.1f} {:>7.2f}x {:>12}".format(
+                level, threads, case["seconds"], case["mb_per_second"], case["speedup"], case["output_bytes"]))
+    if args.out:
+        with open(args.out, "w", encoding="utf8") as f:
+            json.dump({"json_bytes": len(data), "cpu_count": os.cpu_count(), "cases": cases}, f, indent=2)
+
+
+def simulate(args):
+    """time Simulator loading and ticks, frames are rendered every --every ticks like simulator.py does"""
+    from simulator import Simulator
+    start = time.perf_counter()
+    if args.blueprint:
+        with open(args.blueprint, encoding="utf8") as f:
+            sim = Simulator.from_string(f.read().strip())
+    else:
+        os.makedirs(args.dir, exist_ok=True)
+        video = os.path.join(args.dir, "synthetic_320x180_{}.avi".format(args.frames))
+        if not os.path.exists(video):
+            make_video(video, 320, 180, args.frames)
+        bp = BluePrint(video)
+        bp.set_height(args.height)
+        bp.monitor = None
+        bp.DECODER = args.decoder
+        bp.build()
+        sim = Simulator.from_player(bp)
+    sim.switch_on()
+    load = time.perf_counter() - start
+    start = time.perf_counter()
+    frames = sim.run(args.ticks, args.every)
+    seconds = time.perf_counter() - start
+    print("{} entities, {} networks, {} frames of {}x{} lamps, loaded in {:.2f}s".format(
+        len(sim.names), sim.net_count, len(frames), frames.shape[2], frames.shape[1], load))
+    print("{} ticks in {:.2f}s, {:.2f} ms/tick, {:.0f} ticks/s".format(
+        args.ticks, seconds, seconds * 1000 / max(args.ticks, 1), args.ticks / max(seconds, 1e-9)))
+    if args.max_seconds and seconds > args.max_seconds:
+        print("ERROR, {} ticks took longer than {}s".format(args.ticks, args.max_seconds))
+        return 1
+    return 0
+
+
+def workers(args):
+    """check that parallel decoding reads the same frames as serial decoding, with film ranges and added films"""
+    import numpy as np
+    os.makedirs(args.dir, exist_ok=True)
+    videos = []
+    for frames in (args.frames, args.frames // 2):
+        video = os.path.join(args.dir, "synthetic_64x36_{}.avi".format(frames))
+        if not os.path.exists(video):
+            make_video(video, 64, 36, frames)
+        videos.append(video)
+    seconds = args.frames / 30
+    cases = [("whole film", None, False),
+             ("film range", (0, seconds / 2, 0), False),
+             ("film range and added film", (0, seconds / 2, 0), True),
+             ("stepped range and added film", (seconds / 4, seconds, 3), True)]
+    failures = 0
+    for name, film_range, added in cases:
+        results = []
+        for count in (1, args.workers):
+            bp = BluePrint(videos[0])
+            bp.set_height(args.height)
+            bp.monitor = None
+            bp.WORKERS = count
+            if film_range is not None:
+                bp.set_film_range(0, *film_range)
+            if added:
+                bp.add_film(videos[1])
+            results.append(np.stack(list(bp.read_film())))
+        serial, parallel = results
+        same = serial.shape == parallel.shape and bool((serial == parallel).all())
+        failures += not same
+        print("{:30} {:>6} {:>6}  {}".format(name, len(serial), len(parallel), "ok" if same else "DIFFERENT"))
+    if failures:
+        print("ERROR, {} case(s) decode different frames with {} workers".format(failures, args.workers))
+        return 1
+    return 0
+
+
+def compare(args):
+    """flag cases and stages of the new result which are slower or bigger than the old one beyond the threshold"""
+    with open(args.old, encoding="utf8") as f:
+        old = {case["name"]: case for case in json.load(f)["cases"]}
+    with open(args.new, encoding="utf8") as f:
+        new = {case["name"]: case for case in json.load(f)["cases"]}
+    regressions = 0
+    for name in sorted(new):
+        if name not in old:
+            print("{}: new case".format(name))
+            continue
+        rows = [("total", old[name]["seconds"], new[name]["seconds"], args.min_seconds)]
+        rows += [(stage, old[name]["stages"][stage]["seconds"], new[name]["stages"][stage]["seconds"], args.min_seconds)
+                 for stage in STAGES if stage in old[name]["stages"] and stage in new[name]["stages"]]
+        rows.append(("output_bytes", old[name]["output_bytes"], new[name]["output_bytes"], 0))
+        if old[name].get("peak_rss_kb") and new[name].get("peak_rss_kb"):
+            rows.append(("peak_rss_kb", old[name]["peak_rss_kb"], new[name]["peak_rss_kb"], 0))
+        for metric, before, after, floor in rows:
+            ratio = after / before if before else float("inf") if after else 1.0
+            # tiny timings are noise, only flag them when they are above the floor
+            regressed = ratio > 1 + args.threshold and after > floor
+            regressions += regressed
+            print("{:40} {:14} {:>14.4f} {:>14.4f} {:>7.2f}x{}".format(
+                name, metric, before, after, ratio, "  REGRESSION" if regressed else ""))
+    for name in sorted(set(old) - set(new)):
+        print("{}: missing in new results".format(name))
+    print("{} regression(s)".format(regressions))
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark of the blueprint generation pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("run", help="run benchmark cases on synthetic videos")
+    p.add_argument("--sizes", default="320x180", help="video sizes, comma separated WIDTHxHEIGHT")
+    p.add_argument("--frames", default="100,500", help="frame counts, comma separated")
+    p.add_argument("--heights", default="20,50", help="display heights, comma separated")
+    p.add_argument("--layout", default="frame", help="storage layout")
+    p.add_argument("--workers", type=int, default=1, help="decoding processes")
+    p.add_argument("--dir", default="bench_videos", help="directory of the synthetic videos")
+    p.add_argument("--out", default="bench.json", help="result file")
+    p = sub.add_parser("compare", help="compare 2 result files")
+    p.add_argument("old")
+    p.add_argument("new")
+    p.add_argument("--threshold", type=float, default=0.1, help="allowed relative slowdown")
+    p.add_argument("--min-seconds", type=float, default=0.05, help="timings below this are not flagged")
+    p = sub.add_parser("compress", help="compression throughput by level and threads")
+    p.add_argument("--blueprint", help="file with a blueprint string to compress, default is a synthetic player")
+    p.add_argument("--frames", type=int, default=500, help="frames of the synthetic player")
+    p.add_argument("--height", type=int, default=50, help="display height of the synthetic player")
+    p.add_argument("--threads", default="1,2,4,8", help="thread counts, comma separated, the first one is the base")
+    p.add_argument("--levels", default="6,9", help="zlib levels, comma separated")
+    p.add_argument("--dir", default="bench_videos", help="directory of the synthetic videos")
+    p.add_argument("--out", help="result file")
+    p = sub.add_parser("simulate", help="ticks per second of the circuit simulator")
+    p.add_argument("--blueprint", help="file with a blueprint string to simulate, default is a synthetic player")
+    p.add_argument("--frames", type=int, default=60, help="frames of the synthetic player")
+    p.add_argument("--height", type=int, default=100, help="display height of the synthetic player")
+    p.add_argument("--decoder", default="component", help="decoder of the synthetic player")
+    p.add_argument("--ticks", type=int, default=2000, help="ticks to simulate")
+    p.add_argument("--every", type=int, default=1, help="render every n ticks")
+    p.add_argument("--max-seconds", type=float, default=0, help="fail if the ticks take longer, 0 is no limit")
+    p.add_argument("--dir", default="bench_videos", help="directory of the synthetic videos")
+    p = sub.add_parser("workers", help="compare parallel decoding with serial decoding")
+    p.add_argument("--frames", type=int, default=120, help="frames of the synthetic video")
+    p.add_argument("--height", type=int, default=12, help="display height")
+    p.add_argument("--workers", type=int, default=3, help="decoding processes")
+    p.add_argument("--dir", default="bench_videos", help="directory of the synthetic videos")
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+        return 0
+    if args.command == "compress":
+        compress(args)
+        return 0
+    if args.command == "simulate":
+        return simulate(args)
+    if args.command == "workers":
+        return workers(args)
+    return compare(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
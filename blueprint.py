@@ -1,10 +1,22 @@
-import cv2
+import numpy as np
 import json
 import base64
 import zlib
 import copy
-import pyperclip
 import math
+import io
+import array
+import collections
+import concurrent.futures
+import os
+import hashlib
+import time
+import pickle
+import argparse
+import contextlib
+import sys
+import tempfile
+import shutil
 
 class BluePrint(object):
     """
@@ -136,27 +148,107 @@ class BluePrint(object):
         }
     }
 
+    # item signals of the base game, used by the indexed storage layout
+    ITEM_SIGNALS = [
+        "wooden-chest", "iron-chest", "steel-chest", "storage-tank", "transport-belt", "fast-transport-belt",
+        "express-transport-belt", "underground-belt", "fast-underground-belt", "express-underground-belt",
+        "splitter", "fast-splitter", "express-splitter", "burner-inserter", "inserter", "long-handed-inserter",
+        "fast-inserter", "bulk-inserter", "small-electric-pole", "medium-electric-pole", "big-electric-pole",
+        "substation", "pipe", "pipe-to-ground", "pump", "rail", "train-stop", "rail-signal", "rail-chain-signal",
+        "locomotive", "cargo-wagon", "fluid-wagon", "artillery-wagon", "car", "tank", "logistic-robot",
+        "construction-robot", "active-provider-chest", "passive-provider-chest", "storage-chest", "buffer-chest",
+        "requester-chest", "roboport", "small-lamp", "arithmetic-combinator", "decider-combinator",
+        "constant-combinator", "selector-combinator", "power-switch", "programmable-speaker", "display-panel",
+        "stone-brick", "concrete", "hazard-concrete", "refined-concrete", "refined-hazard-concrete", "landfill",
+        "cliff-explosives", "repair-pack", "boiler", "steam-engine", "solar-panel", "accumulator", "nuclear-reactor",
+        "heat-pipe", "heat-exchanger", "steam-turbine", "burner-mining-drill", "electric-mining-drill",
+        "offshore-pump", "pumpjack", "stone-furnace", "steel-furnace", "electric-furnace", "assembling-machine-1",
+        "assembling-machine-2", "assembling-machine-3", "oil-refinery", "chemical-plant", "centrifuge", "lab",
+        "beacon", "speed-module", "speed-module-2", "speed-module-3", "efficiency-module", "efficiency-module-2",
+        "efficiency-module-3", "productivity-module", "productivity-module-2", "productivity-module-3", "wood",
+        "coal", "stone", "iron-ore", "copper-ore", "uranium-ore", "raw-fish", "iron-plate", "copper-plate",
+        "steel-plate", "solid-fuel", "plastic-bar", "sulfur", "battery", "explosives", "barrel", "copper-cable",
+        "iron-stick", "iron-gear-wheel", "electronic-circuit", "advanced-circuit", "processing-unit", "engine-unit",
+        "electric-engine-unit", "flying-robot-frame", "low-density-structure", "rocket-fuel", "uranium-235",
+        "uranium-238", "uranium-fuel-cell", "depleted-uranium-fuel-cell", "nuclear-fuel", "automation-science-pack",
+        "logistic-science-pack", "military-science-pack", "chemical-science-pack", "production-science-pack",
+        "utility-science-pack", "space-science-pack", "pistol", "submachine-gun", "shotgun", "combat-shotgun",
+        "rocket-launcher", "flamethrower", "firearm-magazine", "piercing-rounds-magazine", "uranium-rounds-magazine",
+        "shotgun-shell", "piercing-shotgun-shell", "cannon-shell", "explosive-cannon-shell", "uranium-cannon-shell",
+        "explosive-uranium-cannon-shell", "artillery-shell", "rocket", "explosive-rocket", "atomic-bomb",
+        "flamethrower-ammo", "grenade", "cluster-grenade", "poison-capsule", "slowdown-capsule", "defender-capsule",
+        "distractor-capsule", "destroyer-capsule", "light-armor", "heavy-armor", "modular-armor", "power-armor",
+        "power-armor-mk2", "stone-wall", "gate", "gun-turret", "laser-turret", "flamethrower-turret",
+        "artillery-turret", "radar", "rocket-silo", "solar-panel-equipment", "fission-reactor-equipment",
+        "battery-equipment", "battery-mk2-equipment", "belt-immunity-equipment", "exoskeleton-equipment",
+        "personal-roboport-equipment", "personal-roboport-mk2-equipment", "night-vision-equipment",
+        "energy-shield-equipment", "energy-shield-mk2-equipment", "personal-laser-defense-equipment",
+        "discharge-defense-equipment",
+    ]
+
     def __init__(self, film_path):
+        import cv2
         # if you want to change the height, make sure the sig_pool has enough signals
         # all signals type should be virtual in the pool
-        # signals count >= height / 4
+        # signals count >= height / 4, or height / pixels per signal in palette mode
         self.HEIGHT = 100
         self.SIG_POOL = ["A", "B", "C", "D", "E", "F", "G", "H", "I", "J", "K", "L", "M", "N",
                         "O", "P", "Q", "R", "S", "T", "U", "V", "W", "X", "Y"]
         self.MODULE_DISTANCE = 10
         self.DISK_LAYER_SIZE = 500  # frame count for each storage layer
         self.DISK_LAYER_DISTANCE = 5
+        # "frame": 1 storage row per frame, "run": 1 row per run of identical frames
+        # "column": 1 storage entry per distinct column
+        # "indexed": frames stored on ROM_SIGNALS and selected by "each" deciders, see build_storage_indexed
+        self.STORAGE_LAYOUT = "frame"
+        # signals of the indexed layout, a block of frames has 1 frame per signal, items need no mod
+        self.ROM_SIGNALS = (["signal-" + sig for sig in "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"]
+                            + ["signal-" + sig for sig in ("red", "green", "blue", "yellow", "pink", "cyan",
+                                                           "white", "grey", "black", "check", "info", "dot")]
+                            + BluePrint.ITEM_SIGNALS)
+        # "component": 8 combinators per lamp, "packed": 15 combinators per display column and packed RGB lamps
+        self.DECODER = "component"
+        # 16 or 32 to quantize the film to a palette, 8 or 6 pixels per signal, 0 for R3G3B2 colors
+        # a palette lookup decoder is built in palette mode, DECODER is not used
+        self.PALETTE_SIZE = 0
+        self.PALETTE_SAMPLES = 64  # frames sampled to build the palette
+        self.FRAME_DELAY = 300  # make time to close the signal combinator for watch film
+        self.WORKERS = 1  # processes to decode the film, 1 for decoding in the current process
+        self.COMPRESS_LEVEL = 9  # zlib level of the blueprint string, lower levels are faster and larger
+        # strip fields the game fills with the same defaults, compact separators and entities grouped by kind
+        # and row, the blueprint is the same after import, the string is ~10% smaller and its json ~25% smaller
+        self.COMPACT = False
+        self.COMPRESS_THREADS = 1  # threads deflating the blueprint string like pigz, 0 for 1 per cpu, 1 for plain zlib
+        self.monitor = ConsoleMonitor()  # Monitor of the build stages, None to disable monitoring
+        self.frame_cache = None  # FrameCache of packed frames, set it to skip decoding in later builds
+        self.chassis_cache = None  # ChassisCache of lamps and decoder, set it to reuse them for the same geometry
         self.film_path = film_path
         self.cap = cv2.VideoCapture(self.film_path)
         self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
-        width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
-        if self.frame_count < 1 or width < 1 or height < 1:
+        self.film_width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.film_height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        if self.frame_count < 1 or self.film_width < 1 or self.film_height < 1:
             print("ERROR, read video failed!")
             exit(0)
-        self.WIDTH = int(self.HEIGHT * 1.0 / height * width)
+        self.WIDTH = int(self.HEIGHT * 1.0 / self.film_height * self.film_width)
+        self.film_fps = self.cap.get(cv2.CAP_PROP_FPS)
+        self.film_range = None  # (start, stop, step) of the selected source frames, None for the whole film
+        self.crop = None  # (left, top, right, bottom) fractions of the frame to show, None for the whole frame
+        self.ticks_per_frame = 1  # game ticks every frame is shown, the clock is divided by it
+        self.segments = []  # BluePrint of the films played after this one, see add_film
         self.clock_signal = "signal-heart"  # if first_signal_networks is filtered, could equal to signal in sig_pool
-        self.blueprint = None
+        self.store = None  # EntityStore of the player
+        self.palette = None  # (PALETTE_SIZE, 3) uint8 RGB colors of palette mode, palette[0] is black
+        self.palette_lut = None  # palette index of every 5-5-5 bit RGB color
+        self.decoder_inputs = []  # entity numbers of the decoder combinators linked to the storage, 1 per column
+        self.decoder_outputs = []  # (lamp, decoder combinator) entity numbers linked by the green wire
+        self.storage_start = 0  # entity number of the first storage combinator
+        self.storage_heads = []  # entity numbers of the storage deciders linked to the decoder, 1 per column
+        self.storage_stats = None  # dict of storage rows and columns, and distinct columns in column layout
+        self.clock_start = 0  # entity number of the clock constant combinator, entities after it are the clock
+        self.clock_output = 0  # entity number of the clock combinator which outputs the frame index
+        self.chassis = None  # ChassisCache entry of the lamps and decoder, None if they are not from the cache
+        self.link_start = 0  # index of the first wire added by link
         self.cover_frame_before_index = 1
         self.cover_frame_after_index = self.frame_count
         self.show_cover_before = True
@@ -164,6 +256,74 @@ class BluePrint(object):
         self.cover_frame_before = None  # cv.Mat, cover frame
         self.cover_frame_after = None  # cv.Mat, cover frame after the film
     
+    def set_height(self, height):
+        """set display height, the width follows the aspect ratio of the film, or of the crop if it is set"""
+        self.HEIGHT = height
+        if self.crop is None:
+            self.WIDTH = int(self.HEIGHT * 1.0 / self.film_height * self.film_width)
+        else:
+            left, top, right, bottom = self.crop
+            self.WIDTH = int(self.HEIGHT * 1.0 / (self.film_height * (bottom - top))
+                             * (self.film_width * (right - left)))
+
+    def set_film_range(self, fps=0, start=0.0, end=0.0, step=0):
+        """
+        select the frames of the film to play
+        fps: playback frame rate, every frame is shown for round(60 / fps) game ticks,
+             and the film is sampled every round(film fps / fps) frames if step is not set
+        start, end: time range in seconds, end 0 means the end of the film
+        step: play every step-th frame
+        skipped frames are grabbed without converting them to images, cover frame indices count selected frames
+        """
+        import cv2
+        total = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        film_fps = self.film_fps if self.film_fps > 0 else 60
+        if fps > 0:
+            self.ticks_per_frame = max(1, round(60 / fps))
+            if step <= 0:
+                step = max(1, round(film_fps / fps))
+        step = max(1, int(step))
+        first = min(max(0, int(round(start * film_fps))), total)
+        stop = min(int(round(end * film_fps)), total) if end > 0 else total
+        if stop <= first:
+            print("ERROR, film range is empty!")
+            first, stop = 0, total
+        old_count = self.frame_count
+        self.film_range = (first, stop, step)
+        self.frame_count = len(range(first, stop, step))
+        self.cover_frame_before_index = min(self.cover_frame_before_index, self.frame_count)
+        if self.cover_frame_after_index >= old_count:
+            self.cover_frame_after_index = self.frame_count
+        self.cover_frame_after_index = min(self.cover_frame_after_index, self.frame_count)
+
+    def add_film(self, film_path, start=0.0, end=0.0, step=0):
+        """
+        play another film after this one, start, end and step select its frames like set_film_range
+        the film is resized to the display size of this one, and sampled at the playback fps if it is set
+        every film is cached as its own FrameCache entry, so appending a film doesn't decode the others again
+        """
+        segment = BluePrint(film_path)
+        if step <= 0 and self.ticks_per_frame > 1 and segment.film_fps > 0:
+            step = max(1, round(segment.film_fps * self.ticks_per_frame / 60))
+        if start or end or step:
+            segment.set_film_range(0, start, end, step)
+        if self.cover_frame_after_index == self.frame_count:
+            self.cover_frame_after_index += segment.frame_count
+        self.frame_count += segment.frame_count
+        self.segments.append(segment)
+
+    def get_own_frame_count(self):
+        """selected frames of this film, without the films added by add_film"""
+        if self.film_range is not None:
+            return len(range(*self.film_range))
+        return self.frame_count - sum(segment.frame_count for segment in self.segments)
+
+    def get_source_frame(self, idx):
+        """source frame index of the idx-th selected frame, both start from 0"""
+        if self.film_range is None:
+            return idx
+        return self.film_range[0] + idx * self.film_range[2]
+
     def set_film_cover(self, frame_before_index=-1, frame_after_index=-1,
                      picture_before_path="", picture_after_path="",
                      show_before=True, show_after=True):
@@ -175,18 +335,19 @@ class BluePrint(object):
         if both frame index and picture path are set, picture path will be used rather than frame index
         if no valid cover is set but show is True, the default indexed frame will be used as cover
         """
+        import cv2
         if frame_before_index == -1:
             frame_before_index = 1
         if frame_after_index == -1:
-            frame_after_index = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            frame_after_index = self.frame_count
         self.cover_frame_before_index = frame_before_index
         self.cover_frame_after_index = frame_after_index
-        if self.cover_frame_before_index > int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)) or self.cover_frame_before_index < 1:
+        if self.cover_frame_before_index > self.frame_count or self.cover_frame_before_index < 1:
             print("ERROR, cover before frame index out of range!")
             self.cover_frame_before_index = 1
-        if self.cover_frame_after_index > int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT)) or self.cover_frame_after_index < 1:
+        if self.cover_frame_after_index > self.frame_count or self.cover_frame_after_index < 1:
             print("ERROR, cover after frame index out of range!")
-            self.cover_frame_after_index = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+            self.cover_frame_after_index = self.frame_count
         self.show_cover_before = show_before
         self.show_cover_after = show_after
         if picture_before_path:
@@ -202,78 +363,204 @@ class BluePrint(object):
 
     def encode(self, ss):
         """ss is a bytes object of json string, return blueprint used in game"""
-        return '0' + str(base64.b64encode(zlib.compress(ss, 9)), encoding='utf8')
+        if self.COMPRESS_THREADS != 1:
+            compressor = ParallelDeflate(self.COMPRESS_LEVEL, self.COMPRESS_THREADS)
+            return '0' + str(base64.b64encode(compressor.compress(ss) + compressor.flush()), encoding='utf8')
+        return '0' + str(base64.b64encode(zlib.compress(ss, self.COMPRESS_LEVEL)), encoding='utf8')
 
     def build_lamp(self):
-        index = 1
         x_pos = 0
         y_pos = 0
-        entities = self.blueprint["blueprint"]["entities"]
         for col in range(self.WIDTH):
             for row in range(self.HEIGHT):
-                lamp = copy.deepcopy(BluePrint.BP_LAMP)
-                lamp["entity_number"] = index
-                lamp["position"] = {"x": x_pos, "y": y_pos}
-                index += 1
+                if self.PALETTE_SIZE or self.DECODER == "packed":
+                    self.store.add_lamp(x_pos, y_pos, "signal-" + self.SIG_POOL[row // self.get_pixels_per_signal()])
+                else:
+                    self.store.add_lamp(x_pos, y_pos)
                 y_pos += 1
-                entities.append(lamp)
             x_pos += 1
             y_pos = 0
 
+    def build_chassis(self):
+        """
+        lamps and decoder from self.chassis_cache, they are built and added to the cache if it has no entry
+        for the geometry, the writer splices the serialized chassis into the blueprint string
+        """
+        key = ChassisCache.key(self)
+        entry = self.chassis_cache.get(key)
+        cached = entry is not None
+        if not cached:
+            self.build_lamp()
+            counters = self.build_decoder()
+            entry = ChassisCache.serialize(self.store, self.decoder_inputs, self.decoder_outputs, counters)
+            self.chassis_cache.put(key, entry)
+        else:
+            self.store = entry["store"].copy()
+            self.decoder_inputs = list(entry["decoder_inputs"])
+            self.decoder_outputs = list(entry["decoder_outputs"])
+        self.chassis = entry
+        return dict(entry["counters"], chassis_cached=cached)
+
     def build_decoder(self):
-        index = self.HEIGHT * self.WIDTH + 1
+        """
+        build the decoder in the self.DECODER design, record the combinators linked to lamps and storage
+        return the combinator count and latency of both designs
+        """
+        self.decoder_inputs = []
+        self.decoder_outputs = []
+        slots = min(4, self.HEIGHT)
+        ret = {"decoder": self.DECODER,
+               "component_combinators": 8 * self.HEIGHT * self.WIDTH, "component_latency": 4,
+               "packed_combinators": 3 * 5 * slots * self.WIDTH, "packed_latency": 5}
+        if self.PALETTE_SIZE:
+            ret["decoder"] = "palette"
+            ret["palette_combinators"] = self.build_decoder_palette()
+            ret["palette_latency"] = 4
+        elif self.DECODER == "packed":
+            self.build_decoder_packed()
+        else:
+            self.build_decoder_components()
+        return ret
+
+    def build_decoder_packed(self):
+        """
+        shared decoder of every column, the lamp reads its color from its storage signal as packed RGB
+        pixel slot p of all the signals is decoded at once by "each" combinators, 5 stages per color component:
+        shift the component to the high bits of the low byte, AND the bits, * 0xFF, / 0xE0 like the
+        component decoder, then shift it to its byte of the packed RGB value
+        lamps of the same slot are chained, they pick their own signal from the network
+        """
+        index = len(self.store) + 1
+        x_pos = 0
+        components = [(0, 0xE0, 16), (3, 0xE0, 8), (6, 0xC0, 0)]  # bit offset in the byte, mask, packed shift
+        for col in range(self.WIDTH):
+            y_pos = self.HEIGHT + self.MODULE_DISTANCE
+            self.decoder_inputs.append(index)
+            for slot in range(min(4, self.HEIGHT)):
+                for component, (offset, mask, packed_shift) in enumerate(components):
+                    shift = 24 - slot * 8 - offset
+                    stages = [(">>" if shift >= 0 else "<<", abs(shift)), ("AND", mask), ("*", 0xFF),
+                              ("/", 0xE0), ("<<", packed_shift)]
+                    for stage, (op, constant_nu) in enumerate(stages):
+                        self.store.add_arithmetic(x_pos, y_pos, "signal-each", "signal-each", op, constant_nu)
+                        if stage == 0:
+                            if slot != 0 or component != 0:
+                                self.connect(index - 5, 1, index, 1)  # storage signals
+                        else:
+                            self.connect(index - 1, 4, index, 2)
+                        index += 1
+                        y_pos += 2
+                    if component == 0:
+                        self.decoder_outputs.append((col * self.HEIGHT + slot + 1, index - 1))
+                    else:
+                        self.connect(index - 6, 4, index - 1, 4)  # join the packed components
+                self.chain_lamps(col, slot, 4)
+            x_pos += 1
+
+    def build_decoder_palette(self):
+        """
+        palette lookup decoder, pixel slot p of all the signals in a column is decoded at once:
+        shift the palette index to the low bits, AND the index bits, then for every palette color k
+        a decider outputs 1 for each signal equal to k and an arithmetic combinator multiplies it by the color
+        in packed RGB, palette[0] is black and lights no lamp
+        return the combinator count
+        """
+        bits = self.PALETTE_SIZE.bit_length() - 1
+        per = self.get_pixels_per_signal()
+        colors = [(k, (int(r) << 16) | (int(g) << 8) | int(b)) for k, (r, g, b) in enumerate(self.palette)]
+        colors = [(k, color) for k, color in colors if color != 0]
+        index = len(self.store) + 1
+        start = index
+        x_pos = 0
+        for col in range(self.WIDTH):
+            y_pos = self.HEIGHT + self.MODULE_DISTANCE
+            self.decoder_inputs.append(index)
+            for slot in range(min(per, self.HEIGHT)):
+                self.store.add_arithmetic(x_pos, y_pos, "signal-each", "signal-each", ">>", bits * (per - 1 - slot))
+                if slot != 0:
+                    self.connect(index - 2 - 2 * len(colors), 1, index, 1)  # storage signals
+                index += 1
+                y_pos += 2
+                self.store.add_arithmetic(x_pos, y_pos, "signal-each", "signal-each", "AND", (1 << bits) - 1)
+                self.connect(index - 1, 4, index, 2)
+                index += 1
+                y_pos += 2
+                for k, (palette_index, color) in enumerate(colors):
+                    self.store.add_decider(x_pos, y_pos, "signal-each", "=", palette_index,
+                                           sig_out="signal-each", copy_count=False)
+                    if k == 0:
+                        self.connect(index - 1, 4, index, 2)
+                    else:
+                        self.connect(index - 2, 2, index, 2)  # palette indices
+                    index += 1
+                    y_pos += 2
+                    self.store.add_arithmetic(x_pos, y_pos, "signal-each", "signal-each", "*", color)
+                    self.connect(index - 1, 4, index, 2)
+                    if k == 0:
+                        self.decoder_outputs.append((col * self.HEIGHT + slot + 1, index))
+                    else:
+                        self.connect(index - 2, 4, index, 4)  # join the colors
+                    index += 1
+                    y_pos += 2
+                self.chain_lamps(col, slot, per)
+            x_pos += 1
+        return index - start
+
+    def chain_lamps(self, col, slot, per):
+        """chain the lamps of a column showing pixel slot `slot` of their signals, per: pixels per signal"""
+        for lamp in range(col * self.HEIGHT + slot + 1, (col + 1) * self.HEIGHT - per + 1, per):
+            self.connect(lamp, 2, lamp + per, 2)
+
+    def build_decoder_components(self):
+        """8 arithmetic combinators per lamp, the lamp reads red, green and blue signals"""
+        index = len(self.store) + 1
         x_pos = 0
-        entities = self.blueprint["blueprint"]["entities"]
         for col in range(self.WIDTH):
             y_pos = self.HEIGHT + self.MODULE_DISTANCE  # leave some space after lamps
+            self.decoder_inputs.append(index + 3)
             # 4 bytes per signal, 1 lamp per byte => 1 signal can store 4 lamp color
             for i in range(math.ceil(self.HEIGHT / 4)):
                 signal = "signal-" + self.SIG_POOL[i]
                 shift=24
                 for B in range(4):
+                    if i * 4 + B >= self.HEIGHT:
+                        break  # padded pixels have no lamp
+                    self.decoder_outputs.append((col * self.HEIGHT + i * 4 + B + 1, index))
                     right_shift = B < 3
                     op = ">>" if right_shift else "<<"
-                    entities.append(self.get_arithmetic_combinator(index, x_pos, y_pos,
-                        "signal-each", "signal-each", "/", 0xE0))
+                    self.store.add_arithmetic(x_pos, y_pos, "signal-each", "signal-each", "/", 0xE0)
                     index += 1
                     y_pos += 2
-                    entities.append(self.get_arithmetic_combinator(index, x_pos, y_pos,
-                        "signal-each", "signal-each", "*", 0xFF))
+                    self.store.add_arithmetic(x_pos, y_pos, "signal-each", "signal-each", "*", 0xFF)
                     self.connect(index - 1, 2, index, 4)
                     index += 1
                     y_pos += 2
-                    entities.append(self.get_arithmetic_combinator(index, x_pos, y_pos,
-                        "signal-red", "signal-red", "AND", 0xE0))
+                    self.store.add_arithmetic(x_pos, y_pos, "signal-red", "signal-red", "AND", 0xE0)
                     self.connect(index - 1, 2, index, 4)
                     index += 1
                     y_pos += 2
-                    entities.append(self.get_arithmetic_combinator(index, x_pos, y_pos,
-                        signal, "signal-red", op, shift))
+                    self.store.add_arithmetic(x_pos, y_pos, signal, "signal-red", op, shift)
                     if B != 0 or i != 0:
                         self.connect(index - 4, 1, index, 1)
                     self.connect(index - 1, 1, index, 3)
                     index += 1
                     y_pos += 2
                     shift = shift - 3 if right_shift else shift + 3
-                    entities.append(self.get_arithmetic_combinator(index, x_pos, y_pos,
-                        "signal-green", "signal-green", "AND", 0xE0))
+                    self.store.add_arithmetic(x_pos, y_pos, "signal-green", "signal-green", "AND", 0xE0)
                     self.connect(index - 2, 4, index, 4)
                     index += 1
                     y_pos += 2
-                    entities.append(self.get_arithmetic_combinator(index, x_pos, y_pos, signal,
-                        "signal-green", op, shift))
+                    self.store.add_arithmetic(x_pos, y_pos, signal, "signal-green", op, shift)
                     self.connect(index - 2, 1, index, 1)
                     self.connect(index - 1, 1, index, 3)
                     index += 1
                     y_pos += 2
                     shift = shift - 3 if right_shift else shift + 3
-                    entities.append(self.get_arithmetic_combinator(index, x_pos, y_pos,
-                        "signal-blue", "signal-blue", "AND", 0xC0))
+                    self.store.add_arithmetic(x_pos, y_pos, "signal-blue", "signal-blue", "AND", 0xC0)
                     self.connect(index - 2, 4, index, 4)
                     index += 1
                     y_pos += 2
-                    entities.append(self.get_arithmetic_combinator(index, x_pos, y_pos, signal,
-                        "signal-blue", op, shift))
+                    self.store.add_arithmetic(x_pos, y_pos, signal, "signal-blue", op, shift)
                     self.connect(index - 2, 1, index, 1)
                     self.connect(index - 1, 1, index, 3)
                     shift = shift - 2 if right_shift else shift + 2
@@ -283,174 +570,655 @@ class BluePrint(object):
 
     def build_storage(self):
         # 1 lamp, 6 arithmetic combinator for color extraction, 2 arithmetic combinator for lerp
-        index = self.HEIGHT * self.WIDTH * 9 + 1
-        x_pos_start = self.WIDTH + self.MODULE_DISTANCE
-        y_pos_start = self.HEIGHT + self.MODULE_DISTANCE + 2 * 3 + 1
-        entities = self.blueprint["blueprint"]["entities"]
-        frame_idx = 0
-        frame_delay = 300  # make time to close the signal combinator for watch film
-        # processing status, -1 for done
-        # 1 for film content, 2 for cover before, 3 for cover after
-        stage = 1
-        while stage > 0:
-            if stage == 1:  # film content
-                ret, original_frame = self.cap.read()
-                if not ret:
-                    stage = 2  # no more film content, process cover now
-                    if not self.show_cover_before:
-                        continue
-                    if self.cover_frame_before is not None:
-                        original_frame = self.cover_frame_before
-            elif stage == 2:  # cover before has been processed
-                stage = 3  # process cover after now
-                if not self.show_cover_after:
-                    continue
-                if self.cover_frame_after is not None:
-                    original_frame = self.cover_frame_after
-            elif stage == 3:  # cover after has been processed
-                stage = -1  # all process done
-                break
+        index = len(self.store) + 1
+        self.storage_start = index
+        signals = ["signal-" + sig for sig in self.SIG_POOL[:self.get_signal_count()]]
+        if self.STORAGE_LAYOUT == "column":
+            return self.build_storage_columns(signals)
+        if self.STORAGE_LAYOUT == "indexed":
+            return self.build_storage_indexed(signals)
+        self.storage_heads = [index + 2 * col for col in range(self.WIDTH)]
+        row = 0
+        for arr, first_frame, last_frame in self.storage_rows():
+            self.add_storage_row(index, row, arr, self.get_clock_range(first_frame, last_frame), signals)
+            index += self.WIDTH * 2
+            row += 1
+        self.storage_stats = {"rows": row, "columns": row * self.WIDTH, "active_combinators": row * self.WIDTH}
+        return self.storage_stats
 
-            first_line = frame_idx % self.DISK_LAYER_SIZE == 0
-            first_layer = frame_idx < self.DISK_LAYER_SIZE
-            if first_line:
-                x_pos_start = (self.WIDTH + self.MODULE_DISTANCE
-                    + (self.WIDTH + self.DISK_LAYER_DISTANCE) * (frame_idx // self.DISK_LAYER_SIZE))
-                x_pos = x_pos_start
-                y_pos = y_pos_start
-            if stage == 1:
-                frame_idx += 1
-            frame = cv2.resize(original_frame, (self.WIDTH, self.HEIGHT))
-            if frame_idx == self.cover_frame_before_index and self.cover_frame_before is None:
-                self.cover_frame_before = frame
-            if frame_idx == self.cover_frame_after_index and self.cover_frame_after is None:
-                self.cover_frame_after = frame
-            arr = self.frame_to_array(frame)
+    def build_storage_columns(self, signals):
+        """
+        column layout of the storage, every distinct packed column is stored once per display column,
+        its decider fires for all the clock ranges which use it, ranges are joined with "or"
+        entries of a column are stacked below each other and wrap to a new layer every DISK_LAYER_SIZE entries
+        """
+        entries = [{} for _ in range(self.WIDTH)]  # per column, column bytes -> [packed column, frame ranges]
+        rows = 0
+        for arr, first_frame, last_frame in self.storage_rows():
+            rows += 1
             for col in range(self.WIDTH):
-                if stage == 2:
-                    dc = self.get_decider_combinator(index, x_pos, y_pos, self.clock_signal, "<", 1 + frame_delay)
-                elif stage == 3:
-                    dc = self.get_decider_combinator(index, x_pos, y_pos, self.clock_signal, ">", frame_idx + frame_delay)
+                key = arr[col].tobytes()
+                entry = entries[col].get(key)
+                if entry is None:
+                    entry = entries[col][key] = [arr[col], []]
+                ranges = entry[1]
+                if ranges and first_frame is not None and ranges[-1][1] == first_frame - 1:
+                    ranges[-1][1] = last_frame  # same column as the previous row, extend its range
                 else:
-                    dc = self.get_decider_combinator(index, x_pos, y_pos, self.clock_signal, "=", frame_idx + frame_delay)     
-                entities.append(dc)
-                if first_line:
-                    if not first_layer:
-                        self.connect(index - self.WIDTH * 2 * self.DISK_LAYER_SIZE, 3, index, 3)  # storage output
+                    ranges.append([first_frame, last_frame])
+
+        index = self.storage_start
+        y_pos_start = self.HEIGHT + self.MODULE_DISTANCE + 2 * 3 + 1
+        self.storage_heads = []
+        for col in range(self.WIDTH):
+            self.storage_heads.append(index)
+            for k, (column, ranges) in enumerate(entries[col].values()):
+                conditions = []
+                for first_frame, last_frame in ranges:
+                    group = self.get_clock_range(first_frame, last_frame)
+                    conditions.append(("or",) + group[0])
+                    conditions.extend(("and",) + cond for cond in group[1:])
+                x_pos = (self.WIDTH + self.MODULE_DISTANCE + col
+                    + (self.WIDTH + self.DISK_LAYER_DISTANCE) * (k // self.DISK_LAYER_SIZE))
+                y_pos = y_pos_start + 3 * (k % self.DISK_LAYER_SIZE)
+                self.store.add_decider(x_pos, y_pos, self.clock_signal, conditions[0][1], conditions[0][2],
+                                       conditions[1:])
+                if k == 0:
                     if col != 0:
-                        self.connect(index - 2, 2, index, 2)  # clock signal
-                    elif frame_idx != 1:
-                        self.connect(index - self.WIDTH * 2 * self.DISK_LAYER_SIZE, 2, index, 2)
+                        self.connect(self.storage_heads[col - 1], 2, index, 2)  # clock signal
+                else:
+                    self.connect(index - 2, 2, index, 2)  # clock signal
+                    self.connect(index - 2, 3, index, 3)  # storage output
+                index += 1
+                self.store.add_constant(x_pos, y_pos + 1.5, signals, column)
+                self.connect(index - 1, 1, index, 1)
+                index += 1
+        distinct = sum(len(columns) for columns in entries)
+        total = rows * self.WIDTH
+        self.storage_stats = {"rows": rows, "columns": total, "distinct_columns": distinct,
+                              "active_combinators": distinct}
+        return self.storage_stats
+
+    def build_storage_indexed(self, signals):
+        """
+        indexed layout, frames are grouped in blocks of len(rom) frames, frame j of a block is stored on signal rom[j]
+        a block has 1 address constant combinator with the clock value of every frame on its signal, and 1 data
+        constant combinator per column and storage signal with that storage signal of every frame,
+        the selector decider of a data combinator outputs the signal whose address equals the clock,
+        and per column and storage signal an "each + 0" combinator renames the selected signal to the storage signal
+        the block reads the clock through a repeater, so the addresses of the blocks are on separate networks
+        covers are classic rows, their clock is delayed by 2 ticks like the repeater and the renamers
+        a tick updates columns * signals selectors per block of len(rom) frames instead of columns per frame
+        """
+        rom = [signal for signal in self.ROM_SIGNALS if signal != self.clock_signal]
+        count = len(signals)
+        index = self.storage_start
+        x_pos, y_pos = self.get_storage_position(self.WIDTH, 0)
+        self.store.add_arithmetic(x_pos, y_pos, self.clock_signal, self.clock_signal, "+", 0)
+        x_pos, y_pos = self.get_storage_position(self.WIDTH, 1)
+        self.store.add_arithmetic(x_pos, y_pos, self.clock_signal, self.clock_signal, "+", 0)
+        self.connect(index, 4, index + 1, 2)
+        cover_clock = index + 1
+        index += 2
+        self.storage_heads = []
+        for col in range(self.WIDTH):
+            self.storage_heads.append(index)
+            for k in range(count):
+                x_pos, y_pos = self.get_storage_position(col, k)
+                self.store.add_arithmetic(x_pos, y_pos, "signal-each", signals[k], "+", 0)
+                if k != 0:
+                    self.connect(index - 1, 3, index, 3)  # storage output
+                index += 1
+
+        frames = []
+        covers = []
+        blocks = 0
+        stored = 0
+        for arr, first_frame, last_frame in self.storage_rows():
+            if first_frame is None or last_frame is None:
+                covers.append((arr, self.get_clock_range(first_frame, last_frame)))
+                continue
+            frames.append((arr, first_frame))
+            stored += 1
+            if len(frames) == len(rom):
+                index = self.add_storage_block(index, blocks, frames, rom)
+                blocks += 1
+                frames = []
+        if frames:
+            index = self.add_storage_block(index, blocks, frames, rom)
+            blocks += 1
+
+        for row, (arr, conditions) in enumerate(covers):
+            (op, constant_nu), more = conditions[0], [("and", op, nu) for op, nu in conditions[1:]]
+            for col in range(self.WIDTH):
+                x_pos, y_pos = self.get_storage_position(col, count + row)
+                self.store.add_decider(x_pos, y_pos, self.clock_signal, op, constant_nu, more)
+                if col == 0:
+                    self.connect(cover_clock, 4, index, 2)  # delayed clock signal
                 else:
-                    self.connect(index - self.WIDTH * 2, 2, index, 2)  # clock signal
-                    self.connect(index - self.WIDTH * 2, 3, index, 3)  # storage output
+                    self.connect(index - 2, 2, index, 2)
+                self.connect(index, 3, self.storage_heads[col], 3)  # storage output
                 index += 1
-                y_pos += 1.5
-                entities.append(self.get_constant_combinator(index, x_pos, y_pos, arr[col]))
+                self.store.add_constant(x_pos, y_pos + 1.5, signals, arr[col])
                 self.connect(index - 1, 1, index, 1)
                 index += 1
-                x_pos += 1
-                y_pos -= 1.5
-            x_pos = x_pos_start
-            y_pos += 3
-            print("\rloading frame {:04}/{:04}".format(frame_idx, self.frame_count), end="")
-        print("\n", end="")
+        rows = stored + len(covers)
+        self.storage_stats = {"rows": rows, "columns": rows * self.WIDTH, "blocks": blocks,
+                              "active_combinators": 2 + blocks + (1 + blocks) * self.WIDTH * count
+                                                    + len(covers) * self.WIDTH}
+        return self.storage_stats
+
+    def add_storage_block(self, index, block, frames, rom):
+        """
+        add a block of the indexed layout: the clock repeater and address constant combinator, then per column
+        and storage signal a selector decider and its data constant combinator
+        index: entity number of the repeater, block: block index, frames: (packed frame, frame) of the block
+        return the entity number after the block
+        """
+        count = self.get_signal_count()
+        stride = 2 + 2 * self.WIDTH * count  # entities of a block
+        header = count + 2  # renamer and cover rows
+        x_pos, y_pos = self.get_storage_position(self.WIDTH, header + block * count)
+        self.store.add_arithmetic(x_pos, y_pos, self.clock_signal, self.clock_signal, "+", 0)
+        self.connect(self.storage_start if block == 0 else index - stride, 2, index, 2)  # clock signal
+        index += 1
+        addresses = [self.get_clock_range(frame, frame)[0][1] for _, frame in frames]
+        self.store.add_constant(x_pos, y_pos + 1.5, rom, addresses)
+        self.connect(index - 1, 4, index, 2)
+        address = index
+        index += 1
+        words = np.stack([arr for arr, _ in frames])  # (frames, columns, signals)
+        for col in range(self.WIDTH):
+            for k in range(count):
+                x_pos, y_pos = self.get_storage_position(col, header + block * count + k)
+                self.store.add_decider(x_pos, y_pos, "signal-each", "=", 0, sig_out="signal-each",
+                                       second_signal=self.clock_signal)
+                if k != 0:
+                    self.connect(index - 2, 2, index, 2)  # clock and addresses
+                else:
+                    self.connect(address if col == 0 else index - 2 * count, 2, index, 2)
+                if block == 0:
+                    self.connect(index, 3, self.storage_heads[col] + k, 1)  # selected signal
+                else:
+                    self.connect(index - stride, 3, index, 3)
+                index += 1
+                values = words[:, col, k]
+                used = np.flatnonzero(values)  # a signal of 0 is not stored
+                self.store.add_constant(x_pos, y_pos + 1.5, [rom[j] for j in used], values[used])
+                self.connect(index - 1, 1, index, 1)
+                index += 1
+        return index
+
+    def get_storage_position(self, col, row):
+        """position of the decider of storage row `row` in column col, rows wrap to a new layer like add_storage_row"""
+        layer = row // self.DISK_LAYER_SIZE
+        return (self.WIDTH + self.MODULE_DISTANCE + col + (self.WIDTH + self.DISK_LAYER_DISTANCE) * layer,
+                self.HEIGHT + self.MODULE_DISTANCE + 2 * 3 + 1 + 3 * (row % self.DISK_LAYER_SIZE))
+
+    def storage_rows(self):
+        """
+        yield (packed frame, first frame, last frame) for every storage row in order: film, cover before, cover after
+        frames start from 1, first frame is None for the cover before, last frame is None for the cover after
+        in run and column layout, identical consecutive frames are collapsed into 1 row
+        """
+        # packed cover frames, picture covers are used rather than indexed frames
+        cover_before = self.read_cover(self.cover_frame_before)
+        cover_after = self.read_cover(self.cover_frame_after)
+        collapse = self.STORAGE_LAYOUT in ("run", "column")
+        frame_idx = 0
+        run_start = 0
+        last_arr = None
+        for arr in self.read_film():
+            frame_idx += 1
+            if frame_idx == self.cover_frame_before_index and cover_before is None:
+                cover_before = arr
+            if frame_idx == self.cover_frame_after_index and cover_after is None:
+                cover_after = arr
+            if self.monitor is not None:
+                self.monitor.progress("build_storage", frame_idx, self.frame_count)
+            if collapse and last_arr is not None and np.array_equal(arr, last_arr):
+                continue
+            if last_arr is not None:
+                yield last_arr, run_start, frame_idx - 1
+            run_start = frame_idx
+            last_arr = arr
+        if last_arr is not None:
+            yield last_arr, run_start, frame_idx
+        if self.show_cover_before:
+            yield (cover_before if cover_before is not None else last_arr), None, 0
+        if self.show_cover_after:
+            yield (cover_after if cover_after is not None else last_arr), frame_idx + 1, None
+
+    def get_clock_range(self, first_frame, last_frame):
+        """
+        clock conditions to show frames [first_frame, last_frame], joined with "and"
+        None for first frame means from the beginning, None for last frame means until the end
+        the clock counts frames, FRAME_DELAY ticks are converted to frames
+        """
+        delay = math.ceil(self.FRAME_DELAY / self.ticks_per_frame)
+        if first_frame is None:
+            return [("<", last_frame + 1 + delay)]
+        if last_frame is None:
+            return [(">", first_frame - 1 + delay)]
+        if first_frame == last_frame:
+            return [("=", first_frame + delay)]
+        return [(">=", first_frame + delay), ("<", last_frame + 1 + delay)]
+
+    def add_storage_row(self, index, row, arr, conditions, signals):
+        """
+        add 1 row of decider and constant combinator pairs to the storage, 1 pair for 1 column
+        index: entity number of the first decider, row: row index in the storage
+        """
+        first_line = row % self.DISK_LAYER_SIZE == 0
+        first_layer = row < self.DISK_LAYER_SIZE
+        x_pos = (self.WIDTH + self.MODULE_DISTANCE
+            + (self.WIDTH + self.DISK_LAYER_DISTANCE) * (row // self.DISK_LAYER_SIZE))
+        y_pos = self.HEIGHT + self.MODULE_DISTANCE + 2 * 3 + 1 + 3 * (row % self.DISK_LAYER_SIZE)
+        (op, constant_nu), more = conditions[0], [("and", op, nu) for op, nu in conditions[1:]]
+        for col in range(self.WIDTH):
+            # the positions are written like the original loop, which moved y by 1.5 to the constant and back
+            self.store.add_decider(x_pos, y_pos if first_line and col == 0 else float(y_pos), self.clock_signal, op,
+                                   constant_nu, more)
+            if first_line:
+                if not first_layer:
+                    self.connect(index - self.WIDTH * 2 * self.DISK_LAYER_SIZE, 3, index, 3)  # storage output
+                if col != 0:
+                    self.connect(index - 2, 2, index, 2)  # clock signal
+                elif row != 0:
+                    self.connect(index - self.WIDTH * 2 * self.DISK_LAYER_SIZE, 2, index, 2)
+            else:
+                self.connect(index - self.WIDTH * 2, 2, index, 2)  # clock signal
+                self.connect(index - self.WIDTH * 2, 3, index, 3)  # storage output
+            index += 1
+            self.store.add_constant(x_pos, y_pos + 1.5, signals, arr[col])
+            self.connect(index - 1, 1, index, 1)
+            index += 1
+            x_pos += 1
+
+    def read_film(self):
+        """
+        yield packed frames of the film and the films added by add_film in order,
+        each one is an int32 array in frame_to_array layout
+        frames are decoded by self.WORKERS processes when it is greater than 1
+        if self.frame_cache is set, cached frames are mapped instead of decoding the film,
+        and decoded frames are saved to the cache
+        """
+        yield from self.read_source()
+        for segment in self.segments:
+            for key in ("HEIGHT", "WIDTH", "DISK_LAYER_SIZE", "WORKERS", "PALETTE_SIZE", "palette", "palette_lut",
+                        "monitor", "frame_cache"):
+                setattr(segment, key, getattr(self, key))
+            yield from segment.read_source()
+
+    def read_source(self):
+        """packed frames of this film only"""
+        if self.frame_cache is None:
+            yield from self.decode_film()
+            return
+        frames = self.frame_cache.load(self.film_path, self.WIDTH, self.HEIGHT, self.palette, self.film_range,
+                                       self.crop)
+        if frames is not None:
+            print("map cached frames of", self.film_path)
+            if self.monitor is not None:
+                self.monitor.batch("build_storage", {"frames": len(frames), "cached": True})
+            yield from frames
+            return
+        entry = self.frame_cache.create(self.film_path, self.WIDTH, self.HEIGHT, self.palette, self.film_range,
+                                        self.crop)
+        try:
+            for arr in self.decode_film():
+                entry.append(arr)
+                yield arr
+            entry.commit()
+        finally:
+            entry.close()
+
+    def decode_film(self):
+        """
+        packed frames of this film decoded without the cache, from a capture of its own,
+        so copies of the player which share self.cap can decode the film again
+        """
+        import cv2
+        if self.WORKERS > 1:
+            yield from self.read_film_parallel()
+            return
+        first, stop, step = self.film_range or (0, None, 1)
+        cap = cv2.VideoCapture(self.film_path)
+        try:
+            if first:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+            yield from self.pack_source(read_frames(cap, first, stop, step))
+        finally:
+            cap.release()
+
+    def pack_source(self, source):
+        """resize and pack decoded source frames"""
+        if self.monitor is None:
+            for frame in source:
+                yield self.pack(fit_frame(frame, self.WIDTH, self.HEIGHT, self.crop))
+            return
+        # same as above, with timings reported to the monitor every Monitor.BATCH_FRAMES frames
+        timings = dict.fromkeys(("decode_seconds", "resize_seconds", "pack_seconds"), 0.0)
+        frames = 0
+        while True:
+            tick = time.perf_counter()
+            frame = next(source, None)
+            tock = time.perf_counter()
+            timings["decode_seconds"] += tock - tick
+            if frame is None:
+                break
+            frame = fit_frame(frame, self.WIDTH, self.HEIGHT, self.crop)
+            tick = time.perf_counter()
+            arr = self.pack(frame)
+            timings["resize_seconds"] += tick - tock
+            timings["pack_seconds"] += time.perf_counter() - tick
+            frames += 1
+            if frames == Monitor.BATCH_FRAMES:
+                self.monitor.batch("build_storage", dict(timings, frames=frames))
+                timings = dict.fromkeys(timings, 0.0)
+                frames = 0
+            yield arr
+        if frames:
+            self.monitor.batch("build_storage", dict(timings, frames=frames))
+
+    def read_film_parallel(self):
+        """
+        split the film into frame ranges, every worker process opens its own cv2.VideoCapture,
+        seeks to its range, decodes, resizes and packs the frames, results are yielded in frame order
+        the ranges follow the frame count of this film without the films added by add_film,
+        the last one reads until the end like decode_film, so the frames are the same when the metadata is wrong
+        no range reads past the end of the film range
+        """
+        count = self.get_own_frame_count()
+        chunk = max(1, min(self.DISK_LAYER_SIZE, math.ceil(count / (self.WORKERS * 4))))
+        ranges = [(start, min(start + chunk, count)) for start in range(0, count, chunk)]
+        step = self.film_range[2] if self.film_range else 1
+        end = self.film_range[1] if self.film_range else None
+        pending = collections.deque()
+        with concurrent.futures.ProcessPoolExecutor(self.WORKERS) as pool:
+            for start, stop in ranges:
+                # keep a few ranges in flight, finished ranges wait in memory until they are consumed
+                if len(pending) >= self.WORKERS * 2:
+                    yield from self.take_range(pending.popleft())
+                source_stop = end if stop == count else self.get_source_frame(stop - 1) + 1
+                if end is not None:
+                    source_stop = min(source_stop, end)
+                pending.append(pool.submit(read_film_range, self.film_path, self.get_source_frame(start),
+                                           source_stop, self.WIDTH, self.HEIGHT,
+                                           self.palette_lut, self.PALETTE_SIZE, step, self.crop))
+            while pending:
+                yield from self.take_range(pending.popleft())
+
+    def take_range(self, future):
+        packed, timings = future.result()
+        if self.monitor is not None:
+            self.monitor.batch("build_storage", timings)
+        return packed
+
+    def read_cover(self, picture):
+        """return packed cover picture, or None if the picture is not set"""
+        if picture is None:
+            return None
+        return self.pack(fit_frame(picture, self.WIDTH, self.HEIGHT, self.crop))
+
+    def build_palette(self):
+        """
+        quantize the colors of the film to PALETTE_SIZE colors, the histogram of PALETTE_SAMPLES frames
+        spread over the film and the cover pictures is clustered by quantize_palette
+        """
+        import cv2
+        if self.PALETTE_SIZE not in (16, 32):
+            print("ERROR, palette size should be 16 or 32!")
+            self.PALETTE_SIZE = 16
+        hist = np.zeros(1 << 15, dtype=np.int64)
+        cap = cv2.VideoCapture(self.film_path)
+        count = self.get_own_frame_count()
+        samples = min(self.PALETTE_SAMPLES, count)
+        for k in range(samples):
+            cap.set(cv2.CAP_PROP_POS_FRAMES, self.get_source_frame(k * count // samples))
+            ret, frame = cap.read()
+            if not ret:
+                break
+            hist += np.bincount(self.to_rgb555(fit_frame(frame, self.WIDTH, self.HEIGHT, self.crop)).ravel(),
+                                minlength=1 << 15)
+        cap.release()
+        for picture in (self.cover_frame_before, self.cover_frame_after):
+            if picture is not None:
+                hist += np.bincount(self.to_rgb555(fit_frame(picture, self.WIDTH, self.HEIGHT, self.crop)).ravel(),
+                                    minlength=1 << 15)
+        self.palette, self.palette_lut = self.quantize_palette(hist, self.PALETTE_SIZE)
+        return {"palette_colors": int(np.count_nonzero(self.palette.any(axis=1))) + 1}
+
+    def get_pixels_per_signal(self):
+        return 32 // (self.PALETTE_SIZE.bit_length() - 1) if self.PALETTE_SIZE else 4
+
+    def get_signal_count(self):
+        """signals of a column in storage"""
+        return math.ceil(self.HEIGHT / self.get_pixels_per_signal())
+
+    def get_memory_estimate(self):
+        """
+        rough peak memory of a build in bytes, entities and wires of the storage and the packed frames
+        decoded by the workers, frames mapped from FrameCache are not counted
+        """
+        frames = self.frame_count + 2
+        per_column = 200 + 6 * self.get_signal_count()  # entity arrays, wires and constant values
+        in_flight = self.WORKERS * 2 * min(self.DISK_LAYER_SIZE, frames) if self.WORKERS > 1 else 1
+        return (96 << 20) + frames * self.WIDTH * per_column + in_flight * self.WIDTH * self.get_signal_count() * 4
+
+    def pack(self, frames):
+        """pack_frames, or pack_palette_frames in palette mode"""
+        if self.PALETTE_SIZE:
+            return self.pack_palette_frames(frames, self.palette_lut, self.PALETTE_SIZE)
+        return self.pack_frames(frames)
 
     def build_clock(self):
-        index = (self.HEIGHT * self.WIDTH * 9
-            + self.WIDTH * 2 * (self.frame_count + int(self.show_cover_before) + int(self.show_cover_after))
-            + 1)
+        index = len(self.store) + 1
+        self.clock_start = index
         x_pos = self.WIDTH + self.MODULE_DISTANCE
         y_pos = self.HEIGHT + self.MODULE_DISTANCE - 10
-        entities = self.blueprint["blueprint"]["entities"]
-        cc = {
-            "entity_number": index,
-            "name": "constant-combinator",
-            "position": {"x": x_pos, "y": y_pos},
-            "direction": 8,
-            "control_behavior": {
-                "sections": {
-                    "sections": [
-                        {
-                            "index": 1,
-                            "filters": [
-                                {
-                                    "index": 1,
-                                    "type": "virtual",
-                                    "name": self.clock_signal,
-                                    "quality": "normal",
-                                    "comparator": "=",
-                                    "count": 1
-                                }
-                            ]
-                        }
-                    ]
-                },
-                "is_on": False
-            }
-        }
-        entities.append(cc)
+        self.store.add_constant(x_pos, y_pos, [self.clock_signal], [1], direction=8, is_on=False)
         index += 1
         y_pos += 1.5
-        ac = self.get_arithmetic_combinator(index, x_pos, y_pos,
-            self.clock_signal, self.clock_signal, "+", 0)
-        ac["direction"] = 8
-        entities.append(ac)
+        self.store.add_arithmetic(x_pos, y_pos, self.clock_signal, self.clock_signal, "+", 0, direction=8)
         self.connect(index - 1, 2, index, 2)
         self.connect(index, 1, index, 3)
         index += 1
         y_pos += 2
-        ac = self.get_arithmetic_combinator(index, x_pos, y_pos,
-            self.clock_signal, self.clock_signal, "/", 1)
-        ac["direction"] = 8
-        entities.append(ac)
+        self.store.add_arithmetic(x_pos, y_pos, self.clock_signal, self.clock_signal, "/", self.ticks_per_frame,
+                                  direction=8)
         self.connect(index - 1, 4, index, 2)
+        self.clock_output = index
 
     def link(self):
         """
         add wires between modules
         """
+        self.link_start = len(self.store.wires) // 4
         # link lamp and decoder
-        idx_decoder_start = self.HEIGHT * self.WIDTH + 1
-        idx_decoder = idx_decoder_start
-        for idx_lamp in range(1, idx_decoder_start):
+        for idx_lamp, idx_decoder in self.decoder_outputs:
             self.connect(idx_lamp, 2, idx_decoder, 4)
-            idx_decoder += 8  # 8 decider combinator light a lamp
 
         # link decoder and storage
-        idx_decoder = idx_decoder_start + 3
-        idx_storage = self.HEIGHT * self.WIDTH * 9 + 1
-        for i in range(self.WIDTH):
+        for idx_decoder, idx_storage in zip(self.decoder_inputs, self.storage_heads):
             self.connect(idx_decoder, 1, idx_storage, 3)
-            idx_decoder += self.HEIGHT * 8
-            idx_storage += 2
 
         # link storage and clock
-        idx_storage = self.HEIGHT * self.WIDTH * 9 + 1
-        idx_clock = (idx_storage
-            + self.WIDTH * 2 * (self.frame_count + int(self.show_cover_before) + int(self.show_cover_after))
-            + 2)
-        self.connect(idx_storage, 2, idx_clock, 4)
+        self.connect(self.storage_start, 2, self.clock_output, 4)
 
     # interface
-    def get_player(self):
-        print("generate player")
-        self.blueprint = copy.deepcopy(BluePrint.BP_MAIN)
-        self.build_lamp()
-        self.build_decoder()
-        self.build_storage()
-        self.build_clock()
-        self.link()
+    def get_player(self, output=None):
+        """
+        output: None to return the blueprint string and copy it to clipboard
+                file path or text file object to stream the blueprint string into, nothing is returned
+        streaming keeps the memory usage flat, the written string is the same as the returned one
+        """
+        self.build()
+        return self.write_output(output)
+
+    def write_output(self, output):
+        """write the built player, output and return value like get_player"""
+        if output is not None:
+            print("write blueprint string")
+            self.run_stage("write", self.write, output)
+            print("blueprint has written to file")
+            return None
+        import pyperclip
         print("generate blueprint string")
-        s = self.encode(json.dumps(self.blueprint).encode())
-        # s = json.dumps(self.blueprint)
+        buf = io.StringIO()
+        self.run_stage("write", self.write, buf)
+        s = buf.getvalue()
         pyperclip.copy(s)
         print("blueprint has copied to clipboard")
         return s
 
+    def get_book(self, output_dir, book=True):
+        """
+        write the player as blueprint shards into output_dir, for films too long for 1 blueprint
+        shard_000.txt holds lamps, decoder and clock, shard_k.txt holds storage layer k
+        every shard can be imported and built on its own, entities of other shards it is wired to are
+        repeated in it as anchors, building a shard over its anchors connects the wires to the built entities
+        all shards use the same absolute snapping grid, place them in the same grid cell
+        book: also write book.txt, a blueprint book with all the shards
+        shards are compressed by self.WORKERS processes
+        """
+        self.build()
+        print("write blueprint shards")
+        self.run_stage("write", self.write_shards, output_dir, book)
+        print("blueprint shards have written to", output_dir)
+
+    def build(self):
+        print("generate player")
+        self.store = EntityStore()
+        self.chassis = None
+        if self.PALETTE_SIZE and self.palette is None:  # a palette set before is kept, see VideoWall
+            self.run_stage("build_palette", self.build_palette)
+        if self.chassis_cache is not None:
+            self.run_stage("build_chassis", self.build_chassis)
+        else:
+            self.run_stage("build_lamp", self.build_lamp)
+            self.run_stage("build_decoder", self.build_decoder)
+        self.run_stage("build_storage", self.build_storage)
+        self.run_stage("build_clock", self.build_clock)
+        self.run_stage("link", self.link)
+
+    def split_shards(self):
+        """
+        yield (store, label) of every shard, see get_book
+        a wire between 2 shards is kept in the later shard, with an anchor of the entity in the earlier shard
+        """
+        numbers = np.arange(1, len(self.store) + 1)
+        storage = (numbers >= self.storage_start) & (numbers < self.clock_start)
+        x_pos = np.frombuffer(self.store.x, dtype=np.float64)
+        shard = np.zeros(len(self.store), dtype=np.int64)
+        shard[storage] = 1 + (x_pos[storage] - self.WIDTH - self.MODULE_DISTANCE) // (
+            self.WIDTH + self.DISK_LAYER_DISTANCE)
+        labels = ["player"] + ["storage layer {}".format(k) for k in range(1, shard.max() + 1)]
+        yield from split_store(self.store, shard, labels)
+
+    def write_shards(self, output_dir, book, shards=None, label=None):
+        """shards: (store, label) of every shard, default is split_shards, label: label of the book"""
+        os.makedirs(output_dir, exist_ok=True)
+        frame = copy.deepcopy(BluePrint.BP_MAIN)
+        frame["blueprint"]["snap-to-grid"] = {"x": int(max(self.store.x)) + 1, "y": int(max(self.store.y)) + 2}
+        frame["blueprint"]["absolute-snapping"] = True
+        paths = []
+        counters = {"shards": 0, "json_bytes": 0, "output_bytes": 0, "compress_seconds": 0.0}
+
+        def take(result):
+            for key, value in result.items():
+                counters[key] += value
+            counters["shards"] += 1
+
+        def jobs():
+            for store, shard_label in shards or self.split_shards():
+                frame["blueprint"]["label"] = shard_label
+                paths.append(os.path.join(output_dir, "shard_{:03}.txt".format(len(paths))))
+                yield (store, paths[-1], copy.deepcopy(frame), self.monitor is not None, self.COMPRESS_LEVEL,
+                       1, self.COMPACT)
+
+        if self.WORKERS > 1:
+            pending = collections.deque()
+            with concurrent.futures.ProcessPoolExecutor(self.WORKERS) as pool:
+                for job in jobs():
+                    if len(pending) >= self.WORKERS * 2:
+                        take(pending.popleft().result())
+                    pending.append(pool.submit(write_shard, *job))
+                while pending:
+                    take(pending.popleft().result())
+        else:
+            for job in jobs():
+                take(write_shard(*job[:5], self.COMPRESS_THREADS, self.COMPACT))
+        if book:
+            label = label or os.path.splitext(os.path.basename(self.film_path))[0]
+            result = write_book(paths, os.path.join(output_dir, "book.txt"), label, self.monitor is not None,
+                                self.COMPRESS_LEVEL, self.COMPRESS_THREADS, self.COMPACT)
+            counters["book_bytes"] = result["output_bytes"]
+            counters["compress_seconds"] += result["compress_seconds"]
+        return counters
+
+    def run_stage(self, name, stage, *args):
+        """run a stage of get_player and report its timing and counters to the monitor"""
+        if self.monitor is None:
+            return stage(*args)
+        entities = len(self.store)
+        wires = len(self.store.wires) // 4
+        start = time.perf_counter()
+        ret = stage(*args)
+        counters = {"entities": len(self.store) - entities, "wires": len(self.store.wires) // 4 - wires}
+        if isinstance(ret, dict):
+            counters.update(ret)
+        self.monitor.stage(name, time.perf_counter() - start, counters)
+        return ret
+
+    def write(self, output):
+        """
+        serialize the built entities and wires, output is a file path or text file object
+        return counters of the written blueprint
+        """
+        writer = BlueprintWriter(output, timed=self.monitor is not None, level=self.COMPRESS_LEVEL,
+                                 threads=self.COMPRESS_THREADS, compact=self.COMPACT)
+        entity_spans = wire_spans = ()
+        if self.chassis is not None and not self.COMPACT:
+            chassis = self.chassis
+            entity_spans = [(0, chassis["entities"], chassis["entities_json"])]
+            wire_spans = [(0, chassis["wires"], chassis["wires_json"]),
+                          (self.link_start, self.link_start + len(self.decoder_outputs), chassis["links_json"])]
+        writer.write_store(self.store, entity_spans, wire_spans)
+        writer.close()
+        return {"json_bytes": writer.json_size, "output_bytes": writer.output_size,
+                "compress_seconds": writer.compress_seconds}
+
     @staticmethod
-    def get_arithmetic_combinator(index, x_pos, y_pos, sig_in, sig_out, op, constant_nu):
-        return {
+    def get_lamp(index, x_pos, y_pos, rgb_signal=None):
+        """rgb_signal: read the color from 1 signal in packed RGB mode, default is the red/green/blue components"""
+        lamp = {
+            "entity_number": index,
+            "name": "small-lamp",
+            "position": {
+                "x": x_pos,
+                "y": y_pos
+            },
+            "control_behavior": {
+                "use_colors": True,
+                "color_mode": 1
+            },
+            "color": {
+                "r": 0,
+                "g": 0,
+                "b": 0,
+                "a": 1
+            },
+            "always_on": True
+        }
+        if rgb_signal:
+            lamp["control_behavior"]["color_mode"] = 2
+            lamp["control_behavior"]["rgb_signal"] = {"type": "virtual", "name": rgb_signal}
+        return lamp
+
+    @staticmethod
+    def get_arithmetic_combinator(index, x_pos, y_pos, sig_in, sig_out, op, constant_nu, direction=0):
+        combinator = {
             "entity_number": index, # 1,
             "name": "arithmetic-combinator",
             "position": {
@@ -472,10 +1240,20 @@ class BluePrint(object):
                 }
             }
         }
+        if direction:
+            combinator["direction"] = direction
+        return combinator
     
     @staticmethod
-    def get_decider_combinator(index, x_pos, y_pos, sig_in, op, constant_nu):
-        return {
+    def get_decider_combinator(index, x_pos, y_pos, sig_in, op, constant_nu, more_conditions=(),
+                               sig_out="signal-everything", copy_count=True, second_signal=None):
+        """
+        more_conditions: (compare_type, op, constant_nu) joined after the first condition on the same signal
+        compare_type is "and" or "or", "and" is evaluated before "or"
+        sig_out: output signal, copy_count: output the red input count, or 1 if False
+        second_signal: compare the first condition with this green signal instead of constant_nu
+        """
+        combinator = {
             "entity_number": index,
             "name": "decider-combinator",
             "position": {
@@ -502,7 +1280,7 @@ class BluePrint(object):
                         {
                             "signal": {
                                 "type": "virtual",
-                                "name": "signal-everything"
+                                "name": sig_out
                             },
                             "networks": {
                                 "red": True,
@@ -513,42 +1291,89 @@ class BluePrint(object):
                 }
             }
         }
+        if not copy_count:
+            output = combinator["control_behavior"]["decider_conditions"]["outputs"][0]
+            del output["networks"]
+            output["copy_count_from_input"] = False
+        conditions = combinator["control_behavior"]["decider_conditions"]["conditions"]
+        if second_signal is not None:
+            del conditions[0]["constant"]
+            conditions[0]["second_signal"] = {"type": "virtual", "name": second_signal}
+            conditions[0]["second_signal_networks"] = {"red": False, "green": True}
+        for compare_type, op, constant_nu in more_conditions:
+            conditions.append({
+                "first_signal": {
+                    "type": "virtual",
+                    "name": sig_in
+                },
+                "constant": constant_nu,
+                "comparator": op,
+                "first_signal_networks": {
+                    "red": False,
+                    "green": True
+                },
+                "compare_type": compare_type
+            })
+        return combinator
 
-    def get_constant_combinator(self, index, x_pos, y_pos, sig_values):
+    @staticmethod
+    def get_constant_combinator(index, x_pos, y_pos, signals, sig_values, direction=0, is_on=True):
         combinator = {
             "entity_number": index,
             "name": "constant-combinator",
             "position": {
                 "x": x_pos,
                 "y": y_pos
-            },
-            "control_behavior": {
-                "sections": {
-                    "sections": [
-                        {
-                            "index": 1,
-                            "filters": []
-                        }
-                    ]
-                }
+            }
+        }
+        if direction:
+            combinator["direction"] = direction  # before control_behavior, like the clock of the original blueprint
+        combinator["control_behavior"] = {
+            "sections": {
+                "sections": [
+                    {
+                        "index": 1,
+                        "filters": []
+                    }
+                ]
             }
         }
 
-        for i in range(len(self.SIG_POOL)):
-            if i >= len(sig_values):
-                break
-            combinator["control_behavior"]["sections"]["sections"][0]["filters"].append({
+        filters = combinator["control_behavior"]["sections"]["sections"][0]["filters"]
+        for i in range(min(len(signals), len(sig_values))):
+            filters.append({
                 "index": i + 1,
-                "type": "virtual",
-                "name": "signal-" + self.SIG_POOL[i],
+                "type": "virtual" if signals[i].startswith("signal-") else "item",
+                "name": signals[i],
                 "quality": "normal",
                 "comparator": "=",
                 "count": sig_values[i]
             })
+        if not is_on:
+            combinator["control_behavior"]["is_on"] = False
         return combinator
 
+    @staticmethod
+    def strip_defaults(entity):
+        """
+        remove the fields of an entity the game fills with the same value on import, return the entity
+        filters: quality "normal" and comparator "=", color: alpha 1
+        signal type "virtual" is kept, the default type is item
+        """
+        sections = entity.get("control_behavior", {}).get("sections")
+        if sections is not None:
+            for section in sections["sections"]:
+                for signal_filter in section["filters"]:
+                    if signal_filter.get("quality") == "normal":
+                        del signal_filter["quality"]
+                    if signal_filter.get("comparator") == "=":
+                        del signal_filter["comparator"]
+        if entity.get("color", {}).get("a") == 1:
+            del entity["color"]["a"]
+        return entity
+
     def connect(self, entity_a, pole_a, entitiy_b, pole_b):
-        self.blueprint["blueprint"]["wires"].append([entity_a, pole_a, entitiy_b, pole_b])
+        self.store.connect(entity_a, pole_a, entitiy_b, pole_b)
 
     @staticmethod
     def R8G8B8_to_R3G3B2(R, G, B):
@@ -571,28 +1396,1848 @@ class BluePrint(object):
         px0 px1 px2 px3  px4 px5 px6 px7  px8 px9 ...
         return format: [[col0],[col1],[col2]]
         """
+        return self.pack(frame[:self.HEIGHT, :self.WIDTH]).tolist()
+
+    @staticmethod
+    def pack_frames(frames):
+        """
+        vectorized version of frame_to_array, same layout and same values
+        frames: BGR frame with shape (height, width, 3) or a batch with shape (n, height, width, 3)
+        return int32 array with shape (width, ceil(height / 4)) or (n, width, ceil(height / 4))
+        if height is not a multiple of 4, the last signal is padded with black pixels
+        """
+        frames = np.asarray(frames, dtype=np.uint8)
+        px = BluePrint.R8G8B8_to_R3G3B2(frames[..., 2], frames[..., 1], frames[..., 0])
+        pad = -px.shape[-2] % 4
+        if pad:
+            px = np.pad(px, [(0, 0)] * (px.ndim - 2) + [(0, pad), (0, 0)])
+        px = px.reshape(px.shape[:-2] + (-1, 4, px.shape[-1])).astype(np.uint32)
+        value = (px[..., 0, :] << 24) | (px[..., 1, :] << 16) | (px[..., 2, :] << 8) | px[..., 3, :]
+        return np.ascontiguousarray(np.swapaxes(value.view(np.int32), -1, -2))
+
+    @staticmethod
+    def unpack_array(arr, height=None):
+        """
+        reverse of pack_frames, use it to check the packed data or view the effect of color compression
+        arr: int32 array with shape (width, signals) or (n, width, signals)
+        height: crop the padded rows, default is signals * 4
+        return BGR frame with shape (height, width, 3) or (n, height, width, 3)
+        """
+        arr = np.asarray(arr, dtype=np.int32).view(np.uint32)
+        px = ((arr[..., None] >> np.array([24, 16, 8, 0], dtype=np.uint32)) & 0xFF).astype(np.uint8)
+        px = np.swapaxes(px.reshape(px.shape[:-2] + (-1,)), -1, -2)
+        if height is not None:
+            px = px[..., :height, :]
+        r, g, b = BluePrint.R3G3B2_to_R8G8B8(px, seperated=True)
+        return np.stack((b, g, r), axis=-1)
+
+    @staticmethod
+    def to_rgb555(frames):
+        """BGR frames -> int array of 5 bit per component RGB colors, index of the palette lookup table"""
+        frames = np.asarray(frames, dtype=np.uint8)
+        return ((frames[..., 2].astype(np.int64) >> 3) << 10) | ((frames[..., 1] >> 3) << 5) | (frames[..., 0] >> 3)
+
+    @staticmethod
+    def quantize_palette(hist, size, iterations=16):
+        """
+        weighted k-means of the 5-5-5 bit RGB histogram, palette[0] is fixed to black
+        initial colors are the most frequent colors which are not close to the chosen ones
+        return (palette, lut), palette: (size, 3) uint8 RGB, lut: palette index of every 5-5-5 bit color
+        if the film has less colors than size, palette is padded with black
+        """
+        grid = np.arange(1 << 15)
+        centers = np.stack([(grid >> 10) & 31, (grid >> 5) & 31, grid & 31], axis=1) * 8.0 + 4
+        bins = np.flatnonzero(hist)
+        colors = centers[bins]
+        weights = hist[bins].astype(np.float64)
+        palette = np.zeros((size, 3))
+        chosen = 1
+        for i in np.argsort(-weights, kind="stable"):
+            if chosen == size:
+                break
+            if np.abs(palette[:chosen] - colors[i]).max(axis=1).min() > 32:
+                palette[chosen] = colors[i]
+                chosen += 1
+        for _ in range(iterations):
+            label = ((colors[:, None, :] - palette[None, :chosen]) ** 2).sum(axis=2).argmin(axis=1)
+            count = np.bincount(label, weights, minlength=chosen)
+            moved = count > 0
+            moved[0] = False
+            for c in range(3):
+                total = np.bincount(label, weights * colors[:, c], minlength=chosen)
+                palette[:chosen, c][moved] = total[moved] / count[moved]
+        palette = np.clip(np.round(palette), 0, 255).astype(np.uint8)
+        lut = ((centers[:, None, :] - palette[None, :chosen]) ** 2).sum(axis=2).argmin(axis=1).astype(np.uint8)
+        return palette, lut
+
+    @staticmethod
+    def pack_palette_frames(frames, lut, palette_size):
+        """
+        palette version of pack_frames, pixels are replaced by their palette index from lut
+        4 or 5 bits per pixel, 8 or 6 pixels per int from the high bits, palette_size is 16 or 32
+        return int32 array with shape (width, signals) or (n, width, signals)
+        """
+        bits = palette_size.bit_length() - 1
+        per = 32 // bits
+        idx = lut[BluePrint.to_rgb555(frames)].astype(np.uint32)
+        pad = -idx.shape[-2] % per
+        if pad:
+            idx = np.pad(idx, [(0, 0)] * (idx.ndim - 2) + [(0, pad), (0, 0)])
+        idx = idx.reshape(idx.shape[:-2] + (-1, per, idx.shape[-1]))
+        shifts = (bits * np.arange(per - 1, -1, -1)).astype(np.uint32)
+        value = np.bitwise_or.reduce(idx << shifts[:, None], axis=-2)
+        return np.ascontiguousarray(np.swapaxes(value.view(np.int32), -1, -2))
+
+    @staticmethod
+    def unpack_palette_array(arr, palette, height=None):
+        """reverse of pack_palette_frames, return BGR frames with palette colors"""
+        bits = len(palette).bit_length() - 1
+        per = 32 // bits
+        arr = np.asarray(arr, dtype=np.int32).view(np.uint32)
+        shifts = (bits * np.arange(per - 1, -1, -1)).astype(np.uint32)
+        idx = (arr[..., None] >> shifts) & ((1 << bits) - 1)
+        idx = np.swapaxes(idx.reshape(idx.shape[:-2] + (-1,)), -1, -2)
+        if height is not None:
+            idx = idx[..., :height, :]
+        return np.asarray(palette)[idx][..., ::-1]
+
+def read_frames(cap, start, stop, step):
+    """
+    yield frames start, start + step, ... before stop (None for the end) from cap which is at frame start
+    skipped frames are only grabbed, they are not converted to images
+    """
+    idx = start
+    while stop is None or idx < stop:
+        if idx != start:
+            for _ in range(step - 1):
+                if not cap.grab():
+                    return
+        ret, frame = cap.read()
+        if not ret:
+            return
+        yield frame
+        idx += step
+
+
+def fit_frame(frame, width, height, crop=None):
+    """resize a frame or picture to the display size, crop: (left, top, right, bottom) fractions to keep first"""
+    import cv2
+    if crop is not None:
+        rows, cols = frame.shape[:2]
+        frame = frame[round(crop[1] * rows):round(crop[3] * rows), round(crop[0] * cols):round(crop[2] * cols)]
+    return cv2.resize(frame, (width, height))
+
+
+def read_film_range(film_path, start, stop, width, height, palette_lut=None, palette_size=0, step=1, crop=None):
+    """
+    worker of BluePrint.read_film_parallel, decode frames start, start + step, ... before stop of the film
+    return packed frames with shape (frames, width, signals) and the timings of the range
+    frames are packed with the palette lookup table in palette mode
+    """
+    import cv2
+    timings = {"frames": 0, "decode_seconds": 0.0, "resize_seconds": 0.0, "pack_seconds": 0.0}
+    tick = time.perf_counter()
+    cap = cv2.VideoCapture(film_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    frames = []
+    for frame in read_frames(cap, start, stop, step):
+        tock = time.perf_counter()
+        timings["decode_seconds"] += tock - tick
+        frames.append(fit_frame(frame, width, height, crop))
+        tick = time.perf_counter()
+        timings["resize_seconds"] += tick - tock
+    cap.release()
+    timings["frames"] = len(frames)
+    if not frames:
+        per = 32 // (palette_size.bit_length() - 1) if palette_size else 4
+        return np.zeros((0, width, math.ceil(height / per)), dtype=np.int32), timings
+    tick = time.perf_counter()
+    if palette_size:
+        packed = BluePrint.pack_palette_frames(np.stack(frames), palette_lut, palette_size)
+    else:
+        packed = BluePrint.pack_frames(np.stack(frames))
+    timings["pack_seconds"] = time.perf_counter() - tick
+    return packed, timings
+
+def split_store(store, shard, labels):
+    """
+    yield (store, label) of every shard, shard: shard index of every entity, labels: label of every shard
+    a wire between 2 shards is kept in the later shard, with an anchor of the entity in the earlier shard
+    """
+    wires = store.wire_table()
+    owner = np.maximum(shard[wires[:, 0] - 1], shard[wires[:, 2] - 1])
+    order = np.argsort(owner, kind="stable")
+    bounds = np.searchsorted(owner[order], np.arange(len(labels) + 1))
+    for k, label in enumerate(labels):
+        shard_wires = wires[order[bounds[k]:bounds[k + 1]]]
+        indices = np.union1d(np.flatnonzero(shard == k), shard_wires[:, [0, 2]].ravel() - 1)
+        yield store.subset(indices, shard_wires), label
+
+
+def write_shard(store, path, blueprint, timed=False, level=9, threads=1, compact=False):
+    """
+    worker of BluePrint.write_shards, write the blueprint string of a store into path
+    shards written by worker processes are compressed by 1 thread each
+    """
+    writer = BlueprintWriter(path, blueprint, timed, level=level, threads=threads, compact=compact)
+    writer.write_store(store)
+    writer.close()
+    return {"json_bytes": writer.json_size, "output_bytes": writer.output_size,
+            "compress_seconds": writer.compress_seconds}
+
+
+def write_book(paths, output, label, timed=False, level=9, threads=1, compact=False):
+    """
+    write a blueprint book with the blueprint strings in paths as its blueprints
+    shards are decompressed chunk by chunk and copied into the book, they are not parsed
+    """
+    frame = {"blueprint_book": {"item": "blueprint-book", "label": label, "blueprints": ["@"],
+                                "active_index": 0, "version": BluePrint.BP_MAIN["blueprint"]["version"]}}
+    separators = BlueprintWriter.COMPACT_SEPARATORS if compact else None
+    head, tail = json.dumps(frame, separators=separators).split('"@"')
+    writer = BlueprintWriter(output, timed=timed, head=head, level=level, threads=threads, compact=compact)
+    for index, path in enumerate(paths):
+        if index:
+            writer.write(writer.comma)
+        # '{"blueprint": {...}}' of the shard becomes '{"index": k, "blueprint": {...}}'
+        writer.write(('{"index":%d,' if compact else '{"index": %d, ') % index)
+        decompressor = zlib.decompressobj()
+        skip = 1
+        with open(path, encoding="utf8") as f:
+            f.read(1)  # version byte
+            while True:
+                chunk = f.read(BlueprintWriter.CHUNK_SIZE * 4)
+                data = decompressor.decompress(base64.b64decode(chunk)) if chunk else decompressor.flush()
+                text = data.decode()[skip:] if data else ""
+                skip -= min(skip, len(data))
+                writer.write(text)
+                if not chunk:
+                    break
+    writer.close(tail)
+    return {"output_bytes": writer.output_size, "compress_seconds": writer.compress_seconds}
+
+
+class Monitor(object):
+    """
+    receive timings and counters while a player is built, override the methods you need
+    set BluePrint.monitor to None to disable monitoring, then no timing is measured at all
+    """
+
+    BATCH_FRAMES = 100  # frames of a batch reported by serial decoding
+
+    def stage(self, name, seconds, counters):
+        """
+        a stage of get_player finished, name is the method name, e.g. "build_storage", "write"
+        counters: entities and wires emitted, build_storage also has rows and columns of the storage,
+        write stage also has json_bytes, output_bytes, compress_seconds
+        """
+        pass
+
+    def batch(self, stage, counters):
+        """
+        a batch of frames is read, counters: frames, decode_seconds, resize_seconds, pack_seconds
+        or frames and cached for frames mapped from FrameCache
+        """
+        pass
+
+    def progress(self, stage, done, total):
+        pass
+
+
+class ConsoleMonitor(Monitor):
+    """print the loading progress of the film"""
+
+    def __init__(self):
+        self.in_progress = False
+
+    def stage(self, name, seconds, counters):
+        if self.in_progress:
+            print("\n", end="")
+            self.in_progress = False
+        if "distinct_columns" in counters:
+            print("storage columns: {} distinct of {}, dedup ratio {:.2f}".format(counters["distinct_columns"],
+                counters["columns"], counters["columns"] / max(counters["distinct_columns"], 1)))
+        elif "rows" in counters:
+            print("storage rows: {}".format(counters["rows"]))
+        elif "decoder" in counters:
+            for design in ("component", "packed", "palette"):
+                if design + "_combinators" not in counters:
+                    continue
+                print("{} decoder: {} combinators, {} ticks latency{}".format(design,
+                    counters[design + "_combinators"], counters[design + "_latency"],
+                    " (built)" if design == counters["decoder"] else ""))
+
+    def progress(self, stage, done, total):
+        print("\rloading frame {:04}/{:04}".format(done, total), end="")
+        self.in_progress = True
+
+
+class JsonLogMonitor(Monitor):
+    """write every stage and batch as 1 json line, sink is a file path or text file object"""
+
+    def __init__(self, sink):
+        self.own_sink = isinstance(sink, str)
+        self.sink = open(sink, "a", encoding="utf8") if self.own_sink else sink
+
+    def log(self, record):
+        record["time"] = time.time()
+        self.sink.write(json.dumps(record) + "\n")
+        self.sink.flush()
+
+    def stage(self, name, seconds, counters):
+        self.log(dict(counters, event="stage", stage=name, seconds=seconds))
+
+    def batch(self, stage, counters):
+        self.log(dict(counters, event="batch", stage=stage))
+
+    def close(self):
+        if self.own_sink:
+            self.sink.close()
+
+
+class SummaryMonitor(Monitor):
+    """sum the counters of all stages, used for the summary of a job of the build command"""
+
+    def __init__(self):
+        self.counters = collections.Counter()
+        self.seconds = 0.0
+
+    def stage(self, name, seconds, counters):
+        self.seconds += seconds
+        for key, value in counters.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                self.counters[key] += value
+
+
+class FrameCache(object):
+    """
+    on disk cache of packed frames, entries are mapped with numpy.memmap without copying
+    1 entry per film and display size, keyed by the absolute film path, file size, mtime and WIDTH x HEIGHT
+    least recently used entries are removed when the cache is larger than max_bytes
+    """
+
+    def __init__(self, path, max_bytes=16 << 30):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.pinned = collections.Counter()  # entry path -> pins, pinned entries are not evicted
+        os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def describe(film_path, width, height, palette=None, film_range=None, crop=None):
+        """
+        palette: colors of palette mode, frames packed with different palettes are different entries
+        film_range: (start, stop, step) of the selected source frames, None for the whole film
+        crop: BluePrint.crop of the frames, None for the whole frame
+        """
+        stat = os.stat(film_path)
+        per = 32 // (len(palette).bit_length() - 1) if palette is not None else 4
+        meta = {"film": os.path.abspath(film_path), "size": stat.st_size, "mtime": stat.st_mtime_ns,
+                "width": width, "height": height, "signals": math.ceil(height / per)}
+        if palette is not None:
+            meta["palette"] = np.asarray(palette).tolist()
+        if film_range is not None:
+            meta["range"] = list(film_range)
+        if crop is not None:
+            meta["crop"] = list(crop)
+        return meta
+
+    def entry_path(self, meta):
+        key = [meta["film"], meta["size"], meta["mtime"], meta["width"], meta["height"]]
+        key = json.dumps(key + [meta.get(extra) for extra in ("palette", "range", "crop") if extra in meta])
+        return os.path.join(self.path, hashlib.sha1(key.encode()).hexdigest())
+
+    def load(self, film_path, width, height, palette=None, film_range=None, crop=None):
+        """return cached frames with shape (frames, width, signals), or None if not cached"""
+        path = self.entry_path(self.describe(film_path, width, height, palette, film_range, crop))
+        try:
+            with open(path + ".json", encoding="utf8") as f:
+                meta = json.load(f)
+            os.utime(path + ".bin")  # mark as recently used
+        except (OSError, ValueError):
+            return None
+        if meta["frames"] == 0:
+            return np.zeros((0, meta["width"], meta["signals"]), dtype=np.int32)
+        return np.memmap(path + ".bin", dtype=np.int32, mode="r",
+                         shape=(meta["frames"], meta["width"], meta["signals"]))
+
+    def create(self, film_path, width, height, palette=None, film_range=None, crop=None):
+        """return a FrameCacheEntry to append frames to, the entry is visible after it is committed"""
+        meta = self.describe(film_path, width, height, palette, film_range, crop)
+        return FrameCacheEntry(self, self.entry_path(meta), meta)
+
+    def pin(self, film_path, width, height, palette=None, film_range=None, crop=None):
+        """keep the entry in the cache until it is unpinned, return the key for unpin"""
+        path = self.entry_path(self.describe(film_path, width, height, palette, film_range, crop))
+        self.pinned[path] += 1
+        return path
+
+    def unpin(self, path):
+        """release a pin of pin, the cache is evicted again when the last pin of the entry is released"""
+        self.pinned[path] -= 1
+        if self.pinned[path] <= 0:
+            del self.pinned[path]
+            self.evict()
+
+    def entries(self):
+        """list of (meta, path without extension) of all committed entries"""
         ret = []
-        for col in range(self.WIDTH):
-            arr = []
-            row = 0
-            while row < self.HEIGHT:
-                value = 0
-                for idx in range(4):
-                    value <<= 8
-                    b, g, r = frame[row, col]
-                    value |= self.R8G8B8_to_R3G3B2(int(r), int(g), int(b))
-                    row += 1
-                if value > 0x7FFFFFFF:  # python cannot overflow, make sure value is 32 bit signed int
-                    value = int.from_bytes(value.to_bytes(4, signed=False), signed=True)
-                arr.append(value)
-            ret.append(arr)
+        for name in os.listdir(self.path):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.path, name[:-5])
+            try:
+                with open(path + ".json", encoding="utf8") as f:
+                    ret.append((json.load(f), path))
+            except (OSError, ValueError):
+                continue
+        return ret
+
+    def invalidate(self, film_path=None):
+        """remove entries of the film at any display size, remove all entries if film path is None"""
+        film = None if film_path is None else os.path.abspath(film_path)
+        for meta, path in self.entries():
+            if film is None or meta["film"] == film:
+                self.remove(path)
+
+    def evict(self):
+        """remove least recently used entries until the cache is not larger than max_bytes, pinned entries are kept"""
+        files = []
+        for meta, path in self.entries():
+            try:
+                stat = os.stat(path + ".bin")
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            if path not in self.pinned and self.remove(path):
+                total -= size
+
+    @staticmethod
+    def remove(path):
+        try:
+            os.remove(path + ".json")  # remove meta first, so a half removed entry is never loaded
+            os.remove(path + ".bin")
+        except OSError:
+            print("ERROR, remove cache entry failed!", path)
+            return False
+        return True
+
+
+class FrameCacheEntry(object):
+    """
+    frames written to a temporary file, renamed to the cache entry on commit
+    jobs of the build command may decode the same film at once, every writer has its own temporary file and
+    the first commit wins, the frames of the others are the same
+    """
+
+    def __init__(self, cache, path, meta):
+        self.cache = cache
+        self.path = path
+        self.meta = meta
+        self.frames = 0
+        self.temp = "{}.{}.tmp".format(path, os.getpid())
+        self.file = open(self.temp, "wb")
+
+    def append(self, arr):
+        self.file.write(np.ascontiguousarray(arr, dtype=np.int32).tobytes())
+        self.frames += 1
+
+    def commit(self):
+        self.file.close()
+        if os.path.exists(self.path + ".json"):  # committed by another job meanwhile
+            os.remove(self.temp)
+            return
+        self.meta["frames"] = self.frames
+        os.replace(self.temp, self.path + ".bin")
+        with open(self.temp, "w", encoding="utf8") as f:
+            json.dump(self.meta, f)
+        os.replace(self.temp, self.path + ".json")
+        self.cache.evict()
+
+    def close(self):
+        """discard the entry if it is not committed, only the temporary file of this writer is removed"""
+        if not self.file.closed:
+            self.file.close()
+            os.remove(self.temp)
+
+
+class EntityStore(object):
+    """
+    entities and wires of a blueprint kept in typed arrays, json dicts are only made when it is serialized
+    entity numbers start from 1 in the order entities are added
+    """
+
+    LAMP = 0
+    ARITHMETIC = 1
+    DECIDER = 2
+    CONSTANT = 3
+
+    # arithmetic operations and decider comparators
+    OPERATIONS = ["*", "/", "+", "-", "%", "^", "<<", ">>", "AND", "OR", "XOR",
+                  "=", "!=", "<", ">", "<=", ">="]
+
+    def __init__(self):
+        self.number = array.array("i")
+        self.kind = array.array("b")
+        self.x = array.array("d")
+        self.y = array.array("d")
+        self.floats = array.array("b")  # 1 if x is written as float, 2 if y is, like json.dumps of the positions
+        self.direction = array.array("b")  # 1 for decider which outputs 1 instead of the input count
+        # index of OPERATIONS, 1 for enabled constant combinator and packed RGB lamp, 0 for disabled and components
+        self.op = array.array("b")
+        self.sig_in = array.array("h")  # index of self.signals, rgb signal of packed RGB lamp
+        self.sig_out = array.array("h")
+        self.sig_second = array.array("h")  # index of self.signals compared by a decider instead of constant, or -1
+        self.constant = array.array("i")
+        self.offset = array.array("q")  # start of the constant combinator values in self.values
+        self.values = array.array("i")  # signal values of all constant combinators
+        self.value_signals = array.array("h")
+        self.cond_offset = array.array("q")  # start of the extra decider conditions in self.conditions
+        self.conditions = array.array("i")  # 3 integers per condition, 1 for "and" 0 for "or", op, constant
+        self.wires = array.array("i")  # 4 integers per wire, entity_a, pole_a, entity_b, pole_b
+        self.signals = []  # signal names
+        self.signal_index = {}
+
+    def __len__(self):
+        return len(self.number)
+
+    def signal_id(self, name):
+        idx = self.signal_index.get(name)
+        if idx is None:
+            idx = len(self.signals)
+            self.signals.append(name)
+            self.signal_index[name] = idx
+        return idx
+
+    def add(self, kind, x_pos, y_pos, direction=0, op=0, sig_in=0, sig_out=0, constant=0, sig_second=-1,
+            floats=None):
+        """
+        append an entity, return its entity number
+        floats: self.floats of the position, default is from the types of x_pos and y_pos
+        """
+        number = len(self.number) + 1
+        self.number.append(number)
+        self.kind.append(kind)
+        self.x.append(x_pos)
+        self.y.append(y_pos)
+        if floats is None:
+            floats = int(isinstance(x_pos, float)) | 2 * int(isinstance(y_pos, float))
+        self.floats.append(floats)
+        self.direction.append(direction)
+        self.op.append(op)
+        self.sig_in.append(sig_in)
+        self.sig_out.append(sig_out)
+        self.sig_second.append(sig_second)
+        self.constant.append(constant)
+        self.offset.append(len(self.values))
+        self.cond_offset.append(len(self.conditions))
+        return number
+
+    def add_lamp(self, x_pos, y_pos, rgb_signal=None):
+        if rgb_signal is None:
+            return self.add(EntityStore.LAMP, x_pos, y_pos)
+        return self.add(EntityStore.LAMP, x_pos, y_pos, op=1, sig_in=self.signal_id(rgb_signal))
+
+    def add_arithmetic(self, x_pos, y_pos, sig_in, sig_out, op, constant_nu, direction=0):
+        return self.add(EntityStore.ARITHMETIC, x_pos, y_pos, direction, EntityStore.OPERATIONS.index(op),
+                        self.signal_id(sig_in), self.signal_id(sig_out), constant_nu)
+
+    def add_decider(self, x_pos, y_pos, sig_in, op, constant_nu, more_conditions=(),
+                    sig_out="signal-everything", copy_count=True, second_signal=None):
+        """
+        more_conditions: (compare_type, op, constant_nu) on the same signal, second_signal: compared instead of
+        constant_nu, see BluePrint.get_decider_combinator
+        """
+        number = self.add(EntityStore.DECIDER, x_pos, y_pos, int(not copy_count), EntityStore.OPERATIONS.index(op),
+                          self.signal_id(sig_in), self.signal_id(sig_out), constant_nu,
+                          -1 if second_signal is None else self.signal_id(second_signal))
+        for compare_type, op, constant_nu in more_conditions:
+            self.conditions.extend((int(compare_type == "and"), EntityStore.OPERATIONS.index(op), constant_nu))
+        return number
+
+    def add_constant(self, x_pos, y_pos, signals, sig_values, direction=0, is_on=True):
+        """signals: signal names, sig_values: list or int32 array with the same length"""
+        number = self.add(EntityStore.CONSTANT, x_pos, y_pos, direction, int(is_on))
+        self.values.frombytes(np.asarray(sig_values, dtype=np.int32).tobytes())
+        self.value_signals.extend([self.signal_id(name) for name in signals[:len(sig_values)]])
+        return number
+
+    def connect(self, entity_a, pole_a, entitiy_b, pole_b):
+        self.wires.extend((entity_a, pole_a, entitiy_b, pole_b))
+
+    def wire_table(self):
+        """wires as a (n, 4) int32 array view"""
+        return np.frombuffer(self.wires, dtype=np.int32).reshape(-1, 4)
+
+    def extend(self, other, x_offset=0.0, y_offset=0.0):
+        """
+        append the entities and wires of another store, they are renumbered after the entities of this store
+        x_offset, y_offset: added to the positions, a number or an array with 1 value per entity of other
+        """
+        base = len(self)
+        signal_ids = np.array([self.signal_id(name) for name in other.signals] or [0], dtype=np.int16)
+        self.number.extend(range(base + 1, base + len(other) + 1))
+        for name in ("kind", "floats", "direction", "op", "constant"):
+            getattr(self, name).extend(getattr(other, name))
+        self.x.frombytes((np.frombuffer(other.x, dtype=np.float64) + x_offset).tobytes())
+        self.y.frombytes((np.frombuffer(other.y, dtype=np.float64) + y_offset).tobytes())
+        for name in ("sig_in", "sig_out", "value_signals"):
+            getattr(self, name).frombytes(signal_ids[np.frombuffer(getattr(other, name), dtype=np.int16)].tobytes())
+        second = np.frombuffer(other.sig_second, dtype=np.int16)
+        second = np.where(second < 0, -1, signal_ids[np.maximum(second, 0)]).astype(np.int16)
+        self.sig_second.frombytes(second.tobytes())
+        self.offset.frombytes((np.frombuffer(other.offset, dtype=np.int64) + len(self.values)).tobytes())
+        self.cond_offset.frombytes((np.frombuffer(other.cond_offset, dtype=np.int64) + len(self.conditions)).tobytes())
+        self.values.extend(other.values)
+        self.conditions.extend(other.conditions)
+        self.wires.frombytes((other.wire_table() + np.array([base, 0, base, 0], dtype=np.int32)).tobytes())
+
+    def truncate(self, count):
+        """remove the entities after the first count entities and the wires connected to them"""
+        if count >= len(self):
+            return
+        wires = self.wire_table()
+        wires = wires[(wires[:, 0] <= count) & (wires[:, 2] <= count)]
+        self.wires = array.array("i", wires.tobytes())
+        del self.values[self.offset[count]:]
+        del self.value_signals[self.offset[count]:]
+        del self.conditions[self.cond_offset[count]:]
+        for name in ("number", "kind", "x", "y", "floats", "direction", "op", "sig_in", "sig_out", "sig_second",
+                     "constant", "offset", "cond_offset"):
+            del getattr(self, name)[count:]
+
+    def copy(self):
+        ret = EntityStore()
+        for name, value in vars(self).items():
+            setattr(ret, name, copy.copy(value))
+        return ret
+
+    def subset(self, indices, wires=()):
+        """
+        new store with the entities of indices (start from 0) renumbered from 1 in the order of indices,
+        wires: (n, 4) array of wires between these entities with the old entity numbers
+        the result is picklable, it is sent to the worker processes writing blueprint shards
+        """
+        ret = EntityStore()
+        ret.signals = self.signals
+        ret.signal_index = self.signal_index
+        for i in indices:
+            ret.add(self.kind[i], self.x[i], self.y[i], self.direction[i], self.op[i],
+                    self.sig_in[i], self.sig_out[i], self.constant[i], self.sig_second[i], self.floats[i])
+            if self.kind[i] == EntityStore.CONSTANT:
+                stop = self.offset[i + 1] if i + 1 < len(self.offset) else len(self.values)
+                ret.values.extend(self.values[self.offset[i]:stop])
+                ret.value_signals.extend(self.value_signals[self.offset[i]:stop])
+            elif self.kind[i] == EntityStore.DECIDER:
+                stop = self.cond_offset[i + 1] if i + 1 < len(self.cond_offset) else len(self.conditions)
+                ret.conditions.extend(self.conditions[self.cond_offset[i]:stop])
+        wires = np.array(wires, dtype=np.int32).reshape(-1, 4)
+        if len(wires):
+            numbers = np.zeros(len(self) + 1, dtype=np.int32)
+            numbers[np.asarray(indices) + 1] = np.arange(1, len(indices) + 1)
+            wires[:, 0] = numbers[wires[:, 0]]
+            wires[:, 2] = numbers[wires[:, 2]]
+            ret.wires.frombytes(wires.tobytes())
         return ret
 
+    def compact(self):
+        """
+        copy of the store in the order which compresses best, entities are grouped by kind and sorted by row,
+        so similar json follows each other, wires start from the lower entity number and are sorted
+        """
+        order = np.lexsort((np.frombuffer(self.x, dtype=np.float64), np.frombuffer(self.y, dtype=np.float64),
+                            np.frombuffer(self.kind, dtype=np.int8)))
+        ret = self.subset(order, self.wire_table())
+        wires = ret.wire_table().copy()
+        swap = wires[:, 0] > wires[:, 2]
+        wires[swap] = wires[swap][:, [2, 3, 0, 1]]
+        wires = wires[np.lexsort((wires[:, 3], wires[:, 1], wires[:, 2], wires[:, 0]))]
+        ret.wires = array.array("i", wires.tobytes())
+        return ret
+
+    def position(self, i):
+        """position of the i-th entity, coordinates added as int are int"""
+        floats = self.floats[i]
+        return (self.x[i] if floats & 1 else int(self.x[i])), (self.y[i] if floats & 2 else int(self.y[i]))
+
+    def entity(self, i, compact=False):
+        """json dict of the i-th entity, i starts from 0, compact: without default fields"""
+        if compact:
+            return BluePrint.strip_defaults(self.entity(i))
+        kind = self.kind[i]
+        x_pos, y_pos = self.position(i)
+        if kind == EntityStore.LAMP:
+            return BluePrint.get_lamp(self.number[i], x_pos, y_pos,
+                self.signals[self.sig_in[i]] if self.op[i] else None)
+        if kind == EntityStore.ARITHMETIC:
+            return BluePrint.get_arithmetic_combinator(self.number[i], x_pos, y_pos,
+                self.signals[self.sig_in[i]], self.signals[self.sig_out[i]],
+                EntityStore.OPERATIONS[self.op[i]], self.constant[i], self.direction[i])
+        if kind == EntityStore.DECIDER:
+            start = self.cond_offset[i]
+            stop = self.cond_offset[i + 1] if i + 1 < len(self.cond_offset) else len(self.conditions)
+            more = [("and" if self.conditions[k] else "or", EntityStore.OPERATIONS[self.conditions[k + 1]],
+                     self.conditions[k + 2]) for k in range(start, stop, 3)]
+            return BluePrint.get_decider_combinator(self.number[i], x_pos, y_pos,
+                self.signals[self.sig_in[i]], EntityStore.OPERATIONS[self.op[i]], self.constant[i], more,
+                self.signals[self.sig_out[i]], not self.direction[i],
+                self.signals[self.sig_second[i]] if self.sig_second[i] >= 0 else None)
+        start = self.offset[i]
+        stop = self.offset[i + 1] if i + 1 < len(self.offset) else len(self.values)
+        return BluePrint.get_constant_combinator(self.number[i], x_pos, y_pos,
+            [self.signals[idx] for idx in self.value_signals[start:stop]], self.values[start:stop].tolist(),
+            self.direction[i], bool(self.op[i]))
+
+
+class ChassisCache(object):
+    """
+    lamps and decoder of players, the chassis, they only depend on the display geometry and the decoder design
+    an entry has the EntityStore of the chassis and its entities, wires and lamp links serialized as json,
+    a build of the same geometry copies the store, and the writer splices the json into the blueprint string
+    entries are kept in memory, and on disk if path is set, so batch builds of many films share them
+    the clock is 3 entities numbered after the storage, it is built for every player
+    """
+
+    FORMAT = 3  # changes when the chassis, its EntityStore or its json changes, old entries are not used
+    MEMORY_ENTRIES = 4
+
+    def __init__(self, path=None):
+        self.path = path
+        self.entries = collections.OrderedDict()  # key -> entry, least recently used first
+        self.hits = 0
+        self.misses = 0
+        if self.path:
+            os.makedirs(self.path, exist_ok=True)
+
+    @staticmethod
+    def key(player):
+        geometry = [ChassisCache.FORMAT, player.WIDTH, player.HEIGHT, player.MODULE_DISTANCE,
+                    player.SIG_POOL[:player.get_signal_count()], player.DECODER, player.PALETTE_SIZE]
+        if player.PALETTE_SIZE:
+            geometry.append(np.asarray(player.palette).tolist())
+        return hashlib.sha1(json.dumps(geometry).encode()).hexdigest()
+
+    @staticmethod
+    def serialize(store, decoder_inputs, decoder_outputs, counters):
+        """entry of a store which has only the chassis, decoder_outputs are the lamp links added by link"""
+        return {
+            "store": store.copy(),
+            "decoder_inputs": list(decoder_inputs),
+            "decoder_outputs": list(decoder_outputs),
+            "counters": counters,
+            "entities": len(store),
+            "entities_json": ", ".join([json.dumps(store.entity(i)) for i in range(len(store))]),
+            "wires": len(store.wires) // 4,
+            "wires_json": ", ".join([json.dumps(wire) for wire in store.wire_table().tolist()]),
+            "links_json": ", ".join([json.dumps([lamp, 2, decoder, 4]) for lamp, decoder in decoder_outputs]),
+        }
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None and self.path:
+            try:
+                with open(os.path.join(self.path, key + ".pickle"), "rb") as f:
+                    entry = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                entry = None
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.remember(key, entry)
+        return entry
+
+    def put(self, key, entry):
+        self.remember(key, entry)
+        if self.path:
+            path = os.path.join(self.path, key + ".pickle")
+            temp = "{}.{}.tmp".format(path, os.getpid())  # jobs of the build command may write the same entry
+            with open(temp, "wb") as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(temp, path)
+
+    def remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > ChassisCache.MEMORY_ENTRIES:
+            self.entries.popitem(last=False)
+
+
+class ParallelDeflate(object):
+    """
+    zlib stream compressed by threads like pigz, it has the compress and flush methods of zlib.compressobj
+    the data is cut into BLOCK_SIZE blocks, every block is a raw deflate stream primed with the last 32 KB
+    of the previous block as dictionary and ended by a sync flush, so the blocks join into 1 deflate stream
+    zlib releases the GIL while it deflates, blocks are compressed in parallel, the output doesn't depend
+    on the number of threads
+    every block after the first makes the output larger than zlib.compress at the same level, by a few to a few
+    hundred bytes depending on the data, e.g. 0.04% to 0.4% on 9 MB of player json (9 blocks) at level 9
+    """
+
+    BLOCK_SIZE = 1 << 20  # player json compresses ~40x, smaller blocks lose more to the restarts
+    WINDOW = 1 << 15  # dictionary size, the deflate window
+
+    def __init__(self, level=9, threads=0):
+        """threads: 0 for 1 per cpu"""
+        self.level = level
+        self.threads = threads or os.cpu_count() or 1
+        self.pool = concurrent.futures.ThreadPoolExecutor(self.threads)
+        self.pending = collections.deque()  # futures of the compressed blocks in order
+        self.buffer = bytearray()  # data of the next block
+        self.dictionary = b""
+        self.adler = 1  # Adler-32 of the data, it ends the zlib stream
+        # zlib header of a 32 KB window at the level, the same bytes zlib.compress writes, level -1 is 6 in zlib
+        flags = (0 if 0 <= level < 2 else 1 if 2 <= level < 6 else 2 if level in (-1, 6) else 3) << 6
+        self.header = bytes([0x78, flags + 31 - (0x7800 + flags) % 31])
+
+    @staticmethod
+    def deflate_block(data, dictionary, level, last):
+        if dictionary:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=dictionary)
+        else:
+            compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_SYNC_FLUSH)
+
+    def submit(self, block, last=False):
+        self.adler = zlib.adler32(block, self.adler)
+        self.pending.append(self.pool.submit(ParallelDeflate.deflate_block, block, self.dictionary, self.level, last))
+        self.dictionary = (self.dictionary + block)[-ParallelDeflate.WINDOW:]
+
+    def compress(self, data):
+        """return the compressed blocks finished so far, like zlib compressobj it keeps the rest"""
+        self.buffer += data
+        size = ParallelDeflate.BLOCK_SIZE
+        while len(self.buffer) >= size:
+            self.submit(bytes(self.buffer[:size]))
+            del self.buffer[:size]
+        out = [self.header]
+        self.header = b""
+        # finished blocks are taken in order, wait only to keep the blocks in flight bounded
+        while self.pending and (self.pending[0].done() or len(self.pending) > self.threads * 2):
+            out.append(self.pending.popleft().result())
+        return b"".join(out)
+
+    def flush(self):
+        """compress the rest and end the stream with the Adler-32 of the data"""
+        self.submit(bytes(self.buffer), True)
+        self.buffer = bytearray()
+        out = [self.header] + [future.result() for future in self.pending]
+        out.append(self.adler.to_bytes(4, "big"))
+        self.header = b""
+        self.pending.clear()
+        self.pool.shutdown()
+        return b"".join(out)
+
+
+class BlueprintWriter(object):
+    """
+    stream a blueprint string into a file, the result is the same as BluePrint.encode(json.dumps(blueprint))
+    entities and wires are compressed as soon as they are added, all entities must be added before wires
+    """
+
+    CHUNK_SIZE = 1 << 16  # bytes of json collected before they are fed to the compressor
+    COMPACT_SEPARATORS = (",", ":")
+    WIRE_BATCH = 4096  # wires formatted at once
+
+    def __init__(self, sink, blueprint=None, timed=False, head=None, level=9, threads=1, compact=False):
+        """
+        sink: file path or text file object
+        blueprint: blueprint frame with empty entities and wires, default is BluePrint.BP_MAIN
+        timed: measure the time spent in compression and base64 encoding
+        head: json written first instead of the blueprint frame, the rest is written by write and close(tail)
+        level: zlib compression level
+        threads: threads of ParallelDeflate, 0 for 1 per cpu, 1 for a plain zlib stream
+        compact: compact separators, entities of write_store without default fields and in EntityStore.compact order
+        """
+        self.compact = compact
+        self.separators = BlueprintWriter.COMPACT_SEPARATORS if compact else None
+        self.comma = "," if compact else ", "
+        self.own_sink = isinstance(sink, str)
+        self.sink = open(sink, "w", encoding="utf8") if self.own_sink else sink
+        if head is None:
+            frame = copy.deepcopy(blueprint or BluePrint.BP_MAIN)
+            frame["blueprint"]["entities"] = ["@"]
+            frame["blueprint"]["wires"] = ["@"]
+            self.head, self.middle, self.tail = json.dumps(frame, separators=self.separators).split('"@"')
+        else:
+            self.head = head
+        self.compressor = ParallelDeflate(level, threads) if threads != 1 else zlib.compressobj(level)
+        self.pending = []  # json pieces not compressed yet
+        self.pending_size = 0
+        self.remain = b""  # compressed bytes not base64 encoded yet, less than 3 bytes
+        self.entity_count = 0
+        self.wire_count = 0
+        self.timed = timed
+        self.compress_seconds = 0.0
+        self.json_size = 0  # characters of json
+        self.output_size = 1  # characters of the blueprint string
+        self.sink.write("0")
+        self.write(self.head)
+
+    def add_entity(self, entity):
+        text = json.dumps(entity, separators=self.separators)
+        self.write(text if self.entity_count == 0 else self.comma + text)
+        self.entity_count += 1
+
+    def add_wire(self, wire):
+        if self.wire_count == 0:
+            self.write(self.middle)
+        text = json.dumps(wire, separators=self.separators)
+        self.write(text if self.wire_count == 0 else self.comma + text)
+        self.wire_count += 1
+
+    def add_entity_json(self, text, count=1):
+        """text: json of count entities joined by self.comma"""
+        if count:
+            self.write(text if self.entity_count == 0 else self.comma + text)
+            self.entity_count += count
+
+    def add_wire_json(self, text, count=1):
+        """text: json of count wires joined by self.comma"""
+        if count:
+            if self.wire_count == 0:
+                self.write(self.middle)
+            self.write(text if self.wire_count == 0 else self.comma + text)
+            self.wire_count += count
+
+    def write_store(self, store, entity_spans=(), wire_spans=()):
+        """
+        entity_spans, wire_spans: sorted (start, stop, json) of entities or wires serialized before,
+        json is the items from index start to stop joined by self.comma, see ChassisCache
+        spans are not used in compact mode, the entities are reordered
+        """
+        if self.compact:
+            store = store.compact()
+            entity_spans = wire_spans = ()
+        i = 0
+        for start, stop, text in list(entity_spans) + [(len(store), len(store), "")]:
+            for i in range(i, start):
+                self.add_entity(store.entity(i, self.compact))
+            self.add_entity_json(text, stop - start)
+            i = stop
+        # wires are formatted like json.dumps of 4 integers, in batches to keep the memory flat
+        wire_format = "[%d,%d,%d,%d]" if self.compact else "[%d, %d, %d, %d]"
+        wires = store.wire_table()
+        i = 0
+        for start, stop, text in list(wire_spans) + [(len(wires), len(wires), "")]:
+            for k in range(i, start, BlueprintWriter.WIRE_BATCH):
+                rows = wires[k:min(k + BlueprintWriter.WIRE_BATCH, start)].tolist()
+                self.add_wire_json(self.comma.join([wire_format % tuple(wire) for wire in rows]), len(rows))
+            self.add_wire_json(text, stop - start)
+            i = stop
+
+    def write(self, s):
+        self.pending.append(s)
+        self.pending_size += len(s)
+        if self.pending_size >= BlueprintWriter.CHUNK_SIZE:
+            self.flush()
+
+    def flush(self, finish=False):
+        if self.timed:
+            start = time.perf_counter()
+        self.json_size += self.pending_size
+        data = self.compressor.compress("".join(self.pending).encode())
+        if finish:
+            data += self.compressor.flush()
+        self.pending = []
+        self.pending_size = 0
+        data = self.remain + data
+        size = len(data) if finish else len(data) - len(data) % 3
+        self.remain = data[size:]
+        data = str(base64.b64encode(data[:size]), encoding="utf8")
+        self.output_size += len(data)
+        if self.timed:
+            self.compress_seconds += time.perf_counter() - start
+        self.sink.write(data)
+
+    def close(self, tail=None):
+        if tail is not None:
+            self.write(tail)
+        else:
+            if self.wire_count == 0:
+                self.write(self.middle)
+            self.write(self.tail)
+        self.flush(finish=True)
+        if self.own_sink:
+            self.sink.close()
+        else:
+            self.sink.flush()
+
+class Project(object):
+    """
+    rebuilds of a player which reuse the decoded frames and the chassis of the last build, the project directory keeps
+    project.json: manifest with the parameters, films and covers of the last build
+    frames/: FrameCache of the films, only films and frame ranges which are new or changed are decoded
+    chassis/: ChassisCache of the lamps and decoder
+    to replace a range of frames, play the film in segments with set_film_range and add_film
+    a FrameCache entry is keyed by the whole source file, a film whose file changed is decoded again in full,
+    the storage and the blueprint string are always built and compressed again in full
+    """
+
+    PARAMETERS = ("HEIGHT", "WIDTH", "SIG_POOL", "MODULE_DISTANCE", "DISK_LAYER_SIZE", "DISK_LAYER_DISTANCE",
+                  "STORAGE_LAYOUT", "ROM_SIGNALS", "DECODER", "PALETTE_SIZE", "FRAME_DELAY", "COMPACT",
+                  "ticks_per_frame", "clock_signal")
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        self.manifest_path = os.path.join(self.path, "project.json")
+        self.manifest = None
+        self.counters = None  # counters of the last build
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf8") as f:
+                self.manifest = json.load(f)
+
+    def build(self, player, output=None):
+        """
+        build the BluePrint player like get_player(output) and return what it returns, caches of the project are used
+        self.counters has the films, films new or changed since the last build and whether the parameters or
+        covers changed
+        """
+        if player.frame_cache is None:
+            player.frame_cache = FrameCache(os.path.join(self.path, "frames"))
+        if player.chassis_cache is None:
+            player.chassis_cache = ChassisCache(os.path.join(self.path, "chassis"))
+        ret = player.get_player(output)
+        manifest = {
+            "parameters": {key: getattr(player, key) for key in Project.PARAMETERS},
+            "films": [FrameCache.describe(film.film_path, player.WIDTH, player.HEIGHT, None, film.film_range)
+                      for film in [player] + player.segments],
+            "covers": [player.cover_frame_before_index, player.cover_frame_after_index,
+                       player.show_cover_before, player.show_cover_after],
+        }
+        old = self.manifest or {"parameters": None, "films": [], "covers": None}
+        changed = sum(1 for film in manifest["films"] if film not in old["films"])
+        with open(self.manifest_path + ".tmp", "w", encoding="utf8") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(self.manifest_path + ".tmp", self.manifest_path)
+        self.manifest = manifest
+        self.counters = {"films": len(manifest["films"]), "films_changed": changed,
+                         "parameters_changed": old["parameters"] != manifest["parameters"],
+                         "covers_changed": old["covers"] != manifest["covers"]}
+        print("films changed: {} of {}".format(changed, len(manifest["films"])))
+        return ret
+
+
+def build_tile(film_path, settings, crop):
+    """
+    worker of VideoWall.build_tiles, build the player of 1 tile with the BluePrint attributes in settings
+    return its EntityStore without the clock, and the entity number of its first storage combinator
+    """
+    x = BluePrint(film_path)
+    for key, value in settings.items():
+        setattr(x, key, value)
+    x.crop = crop
+    x.build()
+    x.store.truncate(x.clock_start - 1)
+    return x.store, x.storage_start
+
+
+class VideoWall(object):
+    """
+    a film played by rows x cols players, called tiles, every tile shows its part of the frames
+    the lamps of the tiles abut, the decoder and storage of every tile are placed below the wall in the same grid
+    tiles are built by self.WORKERS processes, 1 clock drives the storage of all tiles, so they are frame locked
+    self.player is the template of the tiles, set the options of the tiles on it, add_film is not supported
+    """
+
+    # attributes of the template copied to the tiles
+    TILE_SETTINGS = ("HEIGHT", "WIDTH", "SIG_POOL", "MODULE_DISTANCE", "DISK_LAYER_SIZE", "DISK_LAYER_DISTANCE",
+                     "STORAGE_LAYOUT", "ROM_SIGNALS", "DECODER", "PALETTE_SIZE", "FRAME_DELAY", "film_range",
+                     "frame_count", "ticks_per_frame", "clock_signal", "cover_frame_before_index", "cover_frame_after_index",
+                     "show_cover_before", "show_cover_after", "cover_frame_before", "cover_frame_after",
+                     "frame_cache")
+    TILE_DISTANCE = 5  # space between the decoder and storage of neighbouring tiles
+
+    def __init__(self, film_path, rows, cols, player=None):
+        """player: template BluePrint of the film, default is a new one"""
+        self.player = player or BluePrint(film_path)
+        self.rows = rows
+        self.cols = cols
+        self.WORKERS = min(rows * cols, os.cpu_count() or 1)  # processes building the tiles
+        self.assembly = None  # BluePrint with the entities of the whole wall, it writes the blueprint
+        self.tile_starts = []  # entity number of the first entity of every tile
+        self.storage_starts = []  # entity number of the first storage combinator of every tile
+        self.set_height(self.player.HEIGHT * rows)
+
+    @property
+    def frame_count(self):
+        return self.player.frame_count
+
+    @property
+    def monitor(self):
+        return self.player.monitor
+
+    @monitor.setter
+    def monitor(self, monitor):
+        self.player.monitor = monitor
+
+    def set_height(self, height):
+        """set the height of the wall, every tile is height // rows high, the width follows the film"""
+        self.player.HEIGHT = height // self.rows
+        self.player.WIDTH = int(self.player.HEIGHT * 1.0 / (self.player.film_height / self.rows)
+                                * (self.player.film_width / self.cols))
+
+    def get_memory_estimate(self):
+        return self.player.get_memory_estimate() * self.rows * self.cols
+
+    def build(self):
+        print("generate video wall")
+        self.assembly = copy.copy(self.player)
+        self.assembly.store = EntityStore()
+        self.assembly.run_stage("build_tiles", self.build_tiles)
+        # the clock is placed right of the wall, like the clock of a player
+        self.assembly.WIDTH = self.player.WIDTH * self.cols
+        self.assembly.HEIGHT = self.player.HEIGHT * self.rows
+        self.assembly.run_stage("build_clock", self.assembly.build_clock)
+        self.assembly.run_stage("link", self.link)
+
+    def build_tiles(self):
+        player = self.player
+        settings = {key: getattr(player, key) for key in VideoWall.TILE_SETTINGS}
+        settings.update(monitor=None, WORKERS=1)
+        if player.chassis_cache is not None:
+            settings["chassis_cache"] = ChassisCache(player.chassis_cache.path)
+        if player.PALETTE_SIZE:
+            # 1 palette for the whole wall, tiles with their own palettes show seams
+            sampler = copy.copy(player)
+            sampler.WIDTH = player.WIDTH * self.cols
+            sampler.HEIGHT = player.HEIGHT * self.rows
+            sampler.build_palette()
+            settings.update(palette=sampler.palette, palette_lut=sampler.palette_lut)
+            self.assembly.palette, self.assembly.palette_lut = sampler.palette, sampler.palette_lut
+        crops = [(col / self.cols, row / self.rows, (col + 1) / self.cols, (row + 1) / self.rows)
+                 for row in range(self.rows) for col in range(self.cols)]
+        count = len(crops)
+        if self.WORKERS > 1:
+            with concurrent.futures.ProcessPoolExecutor(self.WORKERS) as pool:
+                tiles = list(pool.map(build_tile, [player.film_path] * count, [settings] * count, crops))
+        else:
+            tiles = [build_tile(player.film_path, settings, crop) for crop in crops]
+        # space of the decoder and storage of a tile, positions are centers, combinators are up to 2 tiles high
+        machines = [np.frombuffer(tile.kind, dtype=np.int8) != EntityStore.LAMP for tile, _ in tiles]
+        xs = np.concatenate([np.frombuffer(tile.x, dtype=np.float64)[machine]
+                             for (tile, _), machine in zip(tiles, machines)])
+        ys = np.concatenate([np.frombuffer(tile.y, dtype=np.float64)[machine]
+                             for (tile, _), machine in zip(tiles, machines)])
+        left, top = math.floor(xs.min()), math.floor(ys.min())
+        width = math.ceil(xs.max() - left) + 1 + VideoWall.TILE_DISTANCE
+        height = math.ceil(ys.max() - top) + 2 + VideoWall.TILE_DISTANCE
+        store = self.assembly.store
+        self.tile_starts = []
+        self.storage_starts = []
+        for k, ((tile, storage_start), machine) in enumerate(zip(tiles, machines)):
+            row, col = divmod(k, self.cols)
+            x_offset = np.where(machine, col * width - left, col * player.WIDTH)
+            y_offset = np.where(machine, player.HEIGHT * self.rows + player.MODULE_DISTANCE + row * height - top,
+                                row * player.HEIGHT)
+            self.tile_starts.append(len(store) + 1)
+            self.storage_starts.append(len(store) + storage_start)
+            store.extend(tile, x_offset, y_offset)
+        return {"tiles": count}
+
+    def link(self):
+        for storage_start in self.storage_starts:
+            self.assembly.connect(storage_start, 2, self.assembly.clock_output, 4)
+
+    def split_shards(self):
+        """shard 0 is the clock, shard k is the tile k, row by row"""
+        shard = np.zeros(len(self.assembly.store), dtype=np.int64)
+        for k, (start, stop) in enumerate(zip(self.tile_starts, self.tile_starts[1:] + [self.assembly.clock_start])):
+            shard[start - 1:stop - 1] = k + 1
+        return shard
+
+    def get_player(self, output=None):
+        """build the wall, output and return value like BluePrint.get_player"""
+        self.build()
+        return self.assembly.write_output(output)
+
+    def get_book(self, output_dir, book=True):
+        """build the wall and write it like BluePrint.get_book, the clock and every tile are 1 shard"""
+        self.build()
+        print("write blueprint shards")
+        labels = ["clock"] + ["tile {} {}".format(*divmod(k, self.cols)) for k in range(self.rows * self.cols)]
+        shards = split_store(self.assembly.store, self.split_shards(), labels)
+        self.assembly.run_stage("write", self.assembly.write_shards, output_dir, book, shards)
+        print("blueprint shards have written to", output_dir)
+
+
+class FanOut(object):
+    """
+    players of 1 film at several display heights, e.g. for bases of different sizes
+    the film is decoded once, every frame is resized and packed for every height into its FrameCache entry,
+    then the players are built one after another from the mapped frames, so N heights cost 1 decode and
+    N resize and pack passes instead of N decodes
+    self.player is the template of the players like VideoWall, set the options of the players on it
+    the frames go to the FrameCache of the template, or to a temporary one which is removed after the build,
+    the entries of a player are pinned in the cache until it is built, so a full cache does not evict them
+    """
+
+    def __init__(self, film_path, heights, player=None):
+        """heights: display heights of the players, the width of every player follows the film"""
+        self.player = player or BluePrint(film_path)
+        self.heights = list(heights)
+        self.players = []  # BluePrint of every height, made by setup
+        self.pins = {}  # id of a player -> keys of its pinned cache entries
+
+    @property
+    def frame_count(self):
+        return self.player.frame_count
+
+    @property
+    def monitor(self):
+        return self.player.monitor
+
+    @monitor.setter
+    def monitor(self, monitor):
+        self.player.monitor = monitor
+
+    def get_memory_estimate(self):
+        """players are built one after another, the largest one counts"""
+        return max(player.get_memory_estimate() for player in self.setup())
+
+    def setup(self):
+        """make a copy of the template for every height, return the copies"""
+        self.players = []
+        for height in self.heights:
+            x = copy.copy(self.player)
+            x.set_height(height)
+            self.players.append(x)
+        return self.players
+
+    def decode(self):
+        """decode every film of the template once and save the frames of every player which are not cached"""
+        import cv2
+        start = time.perf_counter()
+        timings = dict.fromkeys(("decode_seconds", "resize_seconds", "pack_seconds"), 0.0)
+        total = 0
+        for k, film in enumerate([self.player] + self.player.segments):
+            crop = self.player.crop if k == 0 else film.crop
+            entries = []
+            for x in self.players:
+                if x.PALETTE_SIZE and x.palette is None:
+                    x.build_palette()
+                self.pins.setdefault(id(x), []).append(
+                    x.frame_cache.pin(film.film_path, x.WIDTH, x.HEIGHT, x.palette, film.film_range, crop))
+                if x.frame_cache.load(film.film_path, x.WIDTH, x.HEIGHT, x.palette, film.film_range, crop) is None:
+                    entries.append((x, x.frame_cache.create(film.film_path, x.WIDTH, x.HEIGHT, x.palette,
+                                                            film.film_range, crop)))
+            if not entries:
+                continue
+            first, stop, step = film.film_range or (0, None, 1)
+            cap = cv2.VideoCapture(film.film_path)
+            if first:
+                cap.set(cv2.CAP_PROP_POS_FRAMES, first)
+            try:
+                source = read_frames(cap, first, stop, step)
+                while True:
+                    tick = time.perf_counter()
+                    frame = next(source, None)
+                    tock = time.perf_counter()
+                    timings["decode_seconds"] += tock - tick
+                    if frame is None:
+                        break
+                    for x, entry in entries:
+                        tick = time.perf_counter()
+                        resized = fit_frame(frame, x.WIDTH, x.HEIGHT, crop)
+                        tock = time.perf_counter()
+                        entry.append(x.pack(resized))
+                        timings["resize_seconds"] += tock - tick
+                        timings["pack_seconds"] += time.perf_counter() - tock
+                    total += 1
+                    if self.monitor is not None:
+                        self.monitor.progress("decode", total, self.frame_count)
+                for x, entry in entries:
+                    entry.commit()
+            finally:
+                cap.release()
+                for _, entry in entries:
+                    entry.close()
+        if self.monitor is not None:
+            self.monitor.stage("decode", time.perf_counter() - start,
+                               dict(timings, frames=total, players=len(self.players)))
+
+    def build(self, write):
+        """
+        decode the films and call write(player, height) for every player, return the list of what write returns
+        players without a FrameCache use a temporary one
+        """
+        self.setup()
+        temporary = None
+        if self.player.frame_cache is None:
+            temporary = tempfile.mkdtemp(prefix="fan_out_")
+            cache = FrameCache(temporary, max_bytes=float("inf"))
+            for x in self.players:
+                x.frame_cache = cache
+        ret = []
+        try:
+            self.decode()
+            for x, height in zip(self.players, self.heights):
+                ret.append(write(x, height))
+                self.unpin(x)
+            return ret
+        finally:
+            for x in self.players:
+                self.unpin(x)
+            if temporary is not None:
+                shutil.rmtree(temporary, ignore_errors=True)
+
+    def unpin(self, x):
+        """release the cache entries of the player after it is built"""
+        for path in self.pins.pop(id(x), []):
+            x.frame_cache.unpin(path)
+
+    @staticmethod
+    def get_output(output, height):
+        """blueprint file of the player of the height, <name>_<height>.<extension>"""
+        root, extension = os.path.splitext(output)
+        return "{}_{}{}".format(root, height, extension)
+
+    def get_player(self, output):
+        """build every player like BluePrint.get_player into FanOut.get_output(output, height)"""
+        self.build(lambda x, height: x.get_player(FanOut.get_output(output, height)))
+
+    def get_book(self, output_dir, book=True):
+        """build every player like BluePrint.get_book into <output_dir>_<height>"""
+        self.build(lambda x, height: x.get_book("{}_{}".format(output_dir, height), book))
+
+
+class Planner(object):
+    """
+    predict the entities, wires and blueprint string size of a player before building it, and choose the display
+    height and frame step which fit a budget
+    entity and wire counts follow the build methods, they are exact for the frame and indexed layouts as far as the
+    frame count of the film metadata is, and upper bounds for run and column layouts which collapse identical frames
+    in palette mode the palette is quantized from the sampled frames unless the player has one
+    the string size is extrapolated from the lamps and decoder of a few columns and the storage of SAMPLE_GROUPS runs
+    of SAMPLE_RUN consecutive frames spread over the film
+    """
+
+    SAMPLE_GROUPS = 4  # places of the film where frames are sampled
+    SAMPLE_RUN = 4  # consecutive frames sampled at every place
+    SAMPLE_COLUMNS = 8  # the chassis is built with this many columns and twice as many
+
+    def __init__(self, player):
+        """player: BluePrint with the options of the build, its height and frame step are what the planner changes"""
+        self.player = player
+        self.samples = None  # runs of sampled source frames
+        self.geometries = {}  # height -> copy of the player with that height
+        self.models = {}  # height -> string size model, see get_model
+
+    def get_film_ranges(self):
+        """(first, stop, step) of the selected source frames of the player and its segments"""
+        player = self.player
+        own = player.frame_count - sum(segment.frame_count for segment in player.segments)
+        return [film.film_range or (0, count, 1)
+                for film, count in [(player, own)] + [(segment, segment.frame_count) for segment in player.segments]]
+
+    def get_frame_count(self, step=1):
+        """frames played when every step-th selected frame is kept"""
+        return sum(len(range(first, stop, base * step)) for first, stop, base in self.get_film_ranges())
+
+    def get_max_height(self):
+        """the film height, or less if the storage signals of SIG_POOL can't hold it"""
+        return min(self.player.film_height, len(self.player.SIG_POOL) * self.player.get_pixels_per_signal())
+
+    def read_samples(self):
+        """source frames of the runs sampled over the selected frames of the first film"""
+        import cv2
+        if self.samples is not None:
+            return self.samples
+        first, stop, base = self.get_film_ranges()[0]
+        count = len(range(first, stop, base))
+        run = min(Planner.SAMPLE_RUN, count)
+        groups = min(Planner.SAMPLE_GROUPS, count // max(1, run))
+        cap = cv2.VideoCapture(self.player.film_path)
+        self.samples = []
+        for group in range(groups):
+            start = first + group * count // groups * base
+            cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+            frames = list(read_frames(cap, start, start + run * base, base))
+            if frames:
+                self.samples.append(frames)
+        cap.release()
+        return self.samples
+
+    def get_geometry(self, height):
+        """copy of the player with the display height, and a palette from the sampled frames in palette mode"""
+        x = self.geometries.get(height)
+        if x is not None:
+            return x
+        x = copy.copy(self.player)
+        x.set_height(height)
+        x.segments = []
+        x.monitor = None
+        x.frame_cache = None
+        if x.PALETTE_SIZE and x.palette is None:
+            hist = np.zeros(1 << 15, dtype=np.int64)
+            for frames in self.read_samples():
+                for frame in frames:
+                    hist += np.bincount(x.to_rgb555(fit_frame(frame, x.WIDTH, x.HEIGHT, x.crop)).ravel(),
+                                        minlength=1 << 15)
+            x.palette, x.palette_lut = x.quantize_palette(hist, x.PALETTE_SIZE)
+        self.geometries[height] = x
+        return x
+
+    def count(self, height=None, step=1):
+        """
+        entities and wires of the player with the display height and every step-th selected frame
+        return a dict of the totals and (entities, wires) of every module, the links are counted in "link"
+        """
+        x = self.get_geometry(height or self.player.HEIGHT)
+        width, count = x.WIDTH, x.get_signal_count()
+        frames = self.get_frame_count(step)
+        covers = int(x.show_cover_before) + int(x.show_cover_after)
+        lamps = width * x.HEIGHT
+        if x.PALETTE_SIZE:
+            per = x.get_pixels_per_signal()
+            slots = min(per, x.HEIGHT)
+            colors = sum(1 for r, g, b in x.palette if (int(r) << 16) | (int(g) << 8) | int(b))
+            decoder = (width * slots * (2 + 2 * colors),
+                       width * sum(int(slot != 0) + 1 + max(3 * colors - 1, 0) for slot in range(slots)))
+            outputs = width * slots if colors else 0
+        elif x.DECODER == "packed":
+            per = 4
+            slots = min(4, x.HEIGHT)
+            decoder = 15 * slots * width, width * (17 * slots - 1)
+            outputs = width * slots
+        else:
+            per = slots = 0
+            decoder = 8 * lamps, width * (10 * x.HEIGHT - 1)
+            outputs = lamps
+        chains = width * sum(len(range(slot + 1, x.HEIGHT - per + 1, per)) for slot in range(slots))
+        ret = {"height": x.HEIGHT, "width": width, "step": step, "frames": frames,
+               "exact": x.STORAGE_LAYOUT not in ("run", "column")}
+        if x.STORAGE_LAYOUT == "indexed":
+            rom = len([signal for signal in x.ROM_SIGNALS if signal != x.clock_signal])
+            blocks = math.ceil(frames / rom)
+            storage = (2 + width * count + blocks * (2 + 2 * width * count) + 2 * width * covers,
+                       1 + width * (count - 1) + blocks * (2 + 3 * width * count) + 3 * width * covers)
+            ret["blocks"] = blocks
+        else:
+            columns = width * (frames + covers)  # every row or distinct column is a decider and constant pair
+            storage = 2 * columns, 3 * columns - width - 1
+        ret["rows"] = frames + covers
+        ret["modules"] = {"lamp": (lamps, 0), "decoder": (decoder[0], decoder[1] + chains), "storage": storage,
+                          "clock": (3, 3), "link": (0, outputs + width + 1)}
+        ret["entities"] = sum(entities for entities, _ in ret["modules"].values())
+        ret["wires"] = sum(wires for _, wires in ret["modules"].values())
+        return ret
+
+    def measure(self, store):
+        """characters of the blueprint string of the entities and wires of store"""
+        x = self.player
+        writer = BlueprintWriter(io.StringIO(), level=x.COMPRESS_LEVEL, compact=x.COMPACT)
+        writer.write_store(store)
+        writer.close()
+        return writer.output_size
+
+    def measure_chassis(self, x, width):
+        """string size of the lamps, decoder and lamp links of width columns"""
+        sample = copy.copy(x)
+        sample.WIDTH = width
+        sample.store = EntityStore()
+        sample.build_lamp()
+        sample.build_decoder()
+        for idx_lamp, idx_decoder in sample.decoder_outputs:
+            sample.connect(idx_lamp, 2, idx_decoder, 4)
+        return self.measure(sample.store)
+
+    def sample_storage(self, x, frames):
+        """copy of the geometry x with the storage of the packed frames and the covers built"""
+        sample = copy.copy(x)
+        sample.read_film = lambda: iter(frames)  # the sampled frames stand for the film
+        sample.frame_count = len(frames)
+        sample.cover_frame_before_index = min(x.cover_frame_before_index, len(frames))
+        sample.cover_frame_after_index = len(frames)
+        sample.store = EntityStore()
+        sample.build_storage()
+        return sample
+
+    def get_model(self, height):
+        """
+        string size model of the display height: "chassis" characters, and the storage characters
+        fixed + per_frame * frames, or in indexed layout fixed + the characters of its blocks, interpolated
+        between "blocks", the (frames, characters) of blocks filled by cycling the sampled frames
+        per_frame is measured with the first half and the whole of every sampled run, so it covers the whole film
+        """
+        model = self.models.get(height)
+        if model is not None:
+            return model
+        x = self.get_geometry(height)
+        columns = Planner.SAMPLE_COLUMNS
+        if x.WIDTH <= 2 * columns:
+            chassis = self.measure_chassis(x, x.WIDTH)
+        else:
+            small, large = self.measure_chassis(x, columns), self.measure_chassis(x, 2 * columns)
+            chassis = small + (large - small) * (x.WIDTH - columns) / columns
+        runs = [[x.pack(fit_frame(frame, x.WIDTH, x.HEIGHT, x.crop)) for frame in frames]
+                for frames in self.read_samples()]
+        frames = [arr for run in runs for arr in run]
+        model = {"chassis": chassis, "fixed": 0.0, "per_frame": 0.0, "block_frames": 0, "blocks": []}
+        if x.STORAGE_LAYOUT == "indexed":
+            # the string grows faster than the frames of a block, its later signals are items with longer names
+            rom = len([signal for signal in x.ROM_SIGNALS if signal != x.clock_signal])
+            used = min(rom, self.get_frame_count())
+            sizes = []
+            for count in sorted({max(1, used // 4), max(1, used // 2), used}):
+                sample = self.sample_storage(x, [frames[k % len(frames)] for k in range(count)])
+                sizes.append((count, self.measure(sample.store)))
+            # the delays, renamers and covers are built once, the rest is the block
+            store = sample.store
+            head = 2 + x.WIDTH * x.get_signal_count()
+            keep = np.r_[0:head, head + (sample.storage_stats["blocks"] * (2 + 2 * (head - 2))):len(store)]
+            inside = np.zeros(len(store) + 1, dtype=bool)
+            inside[keep + 1] = True
+            wires = store.wire_table()
+            fixed = self.measure(store.subset(keep, wires[inside[wires[:, 0]] & inside[wires[:, 2]]]))
+            model.update(fixed=fixed, block_frames=rom, blocks=[(0, 0.0)] + [(count, size - fixed)
+                                                                             for count, size in sizes])
+        else:
+            halves = [arr for run in runs for arr in run[:max(1, len(run) // 2)]]
+            whole = self.measure(self.sample_storage(x, frames).store)
+            if len(halves) < len(frames):
+                half = self.measure(self.sample_storage(x, halves).store)
+                per_frame = max(0.0, (whole - half) / (len(frames) - len(halves)))
+            else:
+                per_frame = whole / len(frames)
+            model.update(fixed=max(0.0, whole - per_frame * len(frames)), per_frame=per_frame)
+        self.models[height] = model
+        return model
+
+    def estimate(self, height=None, step=1):
+        """count(height, step) with "output_bytes", the estimated characters of the blueprint string"""
+        ret = self.count(height, step)
+        model = self.get_model(ret["height"])
+        storage = model["fixed"] + model["per_frame"] * ret["frames"]
+        if model["block_frames"]:
+            full, rest = divmod(ret["frames"], model["block_frames"])
+            counts, sizes = zip(*model["blocks"])
+            storage += full * sizes[-1] + float(np.interp(rest, counts, sizes))
+        ret["output_bytes"] = int(model["chassis"] + storage)
+        return ret
+
+    def fit(self, max_entities=0, max_bytes=0, max_step=4, min_height=8, max_height=0):
+        """
+        the largest display height, and at that height the smallest frame step up to max_step, whose player has
+        at most max_entities entities and a string of at most max_bytes estimated characters, 0 for no limit
+        max_height: 0 for get_max_height
+        return estimate(height, step) of the plan, None if min_height with max_step doesn't fit
+        """
+        def plan(height):
+            for step in range(1, max_step + 1):
+                if max_entities and self.count(height, step)["entities"] > max_entities:
+                    continue
+                ret = self.estimate(height, step) if max_bytes else self.count(height, step)
+                if not max_bytes or ret["output_bytes"] <= max_bytes:
+                    return ret
+            return None
+
+        low = max(min_height, math.ceil(self.player.film_height / self.player.film_width))  # 1 column at least
+        high = min(max_height or self.get_max_height(), self.get_max_height())
+        best = None
+        while low <= high:  # entities and string size grow with the height
+            middle = (low + high) // 2
+            ret = plan(middle)
+            if ret is None:
+                high = middle - 1
+            else:
+                best = ret
+                low = middle + 1
+        if best is None:
+            return None
+        return self.estimate(best["height"], best["step"])
+
+    def apply(self, plan):
+        """set the height and frame step of a plan on the player, frames are shown longer to keep the film speed"""
+        player = self.player
+        player.set_height(plan["height"])
+        step = plan["step"]
+        if step == 1:
+            return
+        for film, (first, stop, base) in zip([player] + player.segments, self.get_film_ranges()):
+            film.film_range = (first, stop, base * step)
+            film.frame_count = len(range(first, stop, base * step))
+        player.frame_count = self.get_frame_count()
+        player.ticks_per_frame *= step
+        # the last kept frame at or before the cover frames
+        player.cover_frame_before_index = (player.cover_frame_before_index - 1) // step + 1
+        player.cover_frame_after_index = (player.cover_frame_after_index - 1) // step + 1
+
+
+def setup_player(film_path, options):
+    """
+    BluePrint of a film with the options of the build command, options is the dict of the parsed arguments
+    a VideoWall with the BluePrint as its template if options["wall"] is set,
+    a FanOut with the BluePrint as its template if options["heights"] is set
+    """
+    x = BluePrint(film_path)
+    x.set_height(options["height"])
+    x.DISK_LAYER_SIZE = options["layer_size"]
+    x.STORAGE_LAYOUT = options["layout"]
+    x.DECODER = options["decoder"]
+    x.PALETTE_SIZE = options["palette"]
+    x.WORKERS = options["workers"]
+    x.COMPRESS_LEVEL = options["compress_level"]
+    x.COMPRESS_THREADS = options["compress_threads"]
+    x.COMPACT = options["compact"]
+    if options["fps"] or options["start"] or options["end"] or options["step"]:
+        x.set_film_range(options["fps"], options["start"], options["end"], options["step"])
+    x.set_film_cover(frame_before_index=options["cover_before_frame"],
+                     frame_after_index=options["cover_after_frame"],
+                     picture_before_path=options["cover_before"] or "",
+                     picture_after_path=options["cover_after"] or "",
+                     show_before=not options["no_cover_before"], show_after=not options["no_cover_after"])
+    if options["frame_cache"]:
+        x.frame_cache = FrameCache(options["frame_cache"])
+    if options["chassis_cache"]:
+        x.chassis_cache = ChassisCache(options["chassis_cache"])
+    if options.get("wall"):
+        rows, cols = (int(v) for v in options["wall"].lower().split("x"))
+        x = VideoWall(film_path, rows, cols, x)
+        x.set_height(options["height"])
+        if options["workers"] > 1:
+            x.WORKERS = options["workers"]
+            x.player.WORKERS = 1
+    elif options.get("heights"):
+        x = FanOut(film_path, [int(height) for height in options["heights"].split(",")], x)
+    return x
+
+
+def build_job(film_path, output, options):
+    """
+    worker of the build command, build the player of 1 film into output and return the summary of the job
+    output: blueprint file, shard directory with options["book"], None to copy the blueprint to clipboard
+    messages printed while building are kept in the summary, so concurrent jobs don't mix their output
+    """
+    start = time.perf_counter()
+    monitor = SummaryMonitor()
+    log = io.StringIO()
+    summary = {"film": film_path, "output": output, "frames": 0, "failed": False}
+    try:
+        with contextlib.redirect_stdout(log):
+            x = setup_player(film_path, options)
+            x.monitor = monitor
+            summary["frames"] = x.frame_count
+            if isinstance(x, FanOut):
+                summary["output"] = ", ".join("{}_{}".format(output, height) if options["book"]
+                                              else FanOut.get_output(output, height) for height in x.heights)
+            if options["book"]:
+                x.get_book(output)
+            else:
+                x.get_player(output)
+    except (Exception, SystemExit) as e:  # BluePrint exits when the film can't be read
+        summary["failed"] = True
+        if not isinstance(e, SystemExit):
+            print("ERROR, {}: {}".format(type(e).__name__, e), file=log)
+    summary["errors"] = [line for line in log.getvalue().splitlines() if line.startswith("ERROR")]
+    summary.update(monitor.counters)
+    summary["seconds"] = time.perf_counter() - start
+    return summary
+
+
+def print_summary(summary):
+    if summary["failed"]:
+        print("FAILED {}".format(summary["film"]))
+    else:
+        print("{} -> {}: {} frames, {} entities, {} wires, {} bytes, {:.1f}s".format(
+            summary["film"], summary["output"] or "clipboard", summary["frames"], summary.get("entities", 0),
+            summary.get("wires", 0), summary.get("output_bytes", 0), summary["seconds"]))
+    for line in summary["errors"]:
+        print("    " + line)
+
+
+def run_build(args):
+    """build every film of the build command, return the summaries of the jobs in the order of the films"""
+    options = vars(args)
+    names = set()
+    jobs = []
+    summaries = {}
+    for index, film_path in enumerate(args.films):
+        name = os.path.splitext(os.path.basename(film_path))[0]
+        while name in names:
+            name += "_"
+        names.add(name)
+        output = os.path.join(args.output_dir, name if args.book else name + ".txt")
+        if args.clipboard:
+            output = None
+        # the memory budget needs the frame count and display size, read them before scheduling
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                estimate = setup_player(film_path, options).get_memory_estimate()
+        except (Exception, SystemExit):
+            summaries[index] = build_job(film_path, output, options)
+            print_summary(summaries[index])
+            continue
+        jobs.append((index, film_path, output, estimate))
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    if args.jobs <= 1 or len(jobs) <= 1:
+        for index, film_path, output, estimate in jobs:
+            summaries[index] = build_job(film_path, output, options)
+            print_summary(summaries[index])
+        return [summaries[index] for index in range(len(args.films))]
+    budget = args.max_memory << 20 if args.max_memory > 0 else float("inf")
+    queue = collections.deque(jobs)
+    running = {}
+    used = 0
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+        while queue or running:
+            # a job larger than the budget runs alone
+            while queue and len(running) < args.jobs and (not running or used + queue[0][3] <= budget):
+                index, film_path, output, estimate = queue.popleft()
+                running[pool.submit(build_job, film_path, output, options)] = (index, estimate)
+                used += estimate
+            done, _ = concurrent.futures.wait(running, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                index, estimate = running.pop(future)
+                used -= estimate
+                summaries[index] = future.result()
+                print_summary(summaries[index])
+    return [summaries[index] for index in range(len(args.films))]
+
+
+def print_plan(film_path, plan, player):
+    """print a plan of Planner, player: the BluePrint it was made for, its frame step and fps are suggested"""
+    print("{}: height {}, width {}, {} frames, {} storage rows{}".format(
+        film_path, plan["height"], plan["width"], plan["frames"], plan["rows"],
+        "" if plan["exact"] else " at most"))
+    for name, (entities, wires) in plan["modules"].items():
+        print("    {:<8} {:>9} entities {:>9} wires".format(name, entities, wires))
+    print("    {:<8} {:>9} entities {:>9} wires, ~{} characters".format(
+        "total", plan["entities"], plan["wires"], plan.get("output_bytes", 0)))
+    options = "--height {}".format(plan["height"])
+    if plan["step"] > 1:
+        base = player.film_range[2] if player.film_range else 1
+        options += " --step {} --fps {:g}".format(base * plan["step"], 60 / (player.ticks_per_frame * plan["step"]))
+    print("    build options: " + options)
+
+
+def run_plan(args):
+    """print the plan of every film of the plan command, return the count of films which failed or don't fit"""
+    options = vars(args)
+    failed = 0
+    for film_path in args.films:
+        try:
+            x = setup_player(film_path, options)
+            planner = Planner(x)
+            if args.max_entities or args.max_bytes:
+                plan = planner.fit(args.max_entities, args.max_bytes, args.max_step, args.min_height)
+            else:
+                plan = planner.estimate()
+        except (Exception, SystemExit) as e:  # BluePrint exits when the film can't be read
+            if not isinstance(e, SystemExit):
+                print("ERROR, {}: {}".format(type(e).__name__, e))
+            print("FAILED {}".format(film_path))
+            failed += 1
+            continue
+        if plan is None:
+            print("ERROR, {} doesn't fit the budget with height {} and step {}".format(
+                film_path, args.min_height, args.max_step))
+            failed += 1
+        elif args.json:
+            print(json.dumps(dict(plan, film=film_path)))
+        else:
+            print_plan(film_path, plan, x)
+    return failed
+
+
+def decode_blueprint(args):
+    """print or write the json of a blueprint string"""
+    with open(args.blueprint, encoding="utf8") as f:
+        text = zlib.decompress(base64.b64decode(f.read().strip()[1:])).decode()
+    if args.indent:
+        text = json.dumps(json.loads(text), indent=args.indent, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf8") as f:
+            f.write(text)
+    else:
+        print(text)
+
+
 def main():
-    x = BluePrint("res/eva.mp4")
-    x.set_film_cover(picture_before_path="res/fireworks.jpeg",
-                    frame_after_index=-1, show_before=True, show_after=True)
-    x.get_player()
+    parser = argparse.ArgumentParser(description="factorio video player blueprints")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # options of the player, shared by the build and plan commands
+    player = argparse.ArgumentParser(add_help=False)
+    player.add_argument("--height", type=int, default=100, help="display height, the width follows the film")
+    player.add_argument("--layer-size", type=int, default=500, help="frames of each storage layer")
+    player.add_argument("--layout", choices=["frame", "run", "column", "indexed"], default="frame",
+                        help="storage layout")
+    player.add_argument("--decoder", choices=["component", "packed"], default="component")
+    player.add_argument("--palette", type=int, choices=[0, 16, 32], default=0, help="palette size, 0 for R3G3B2")
+    player.add_argument("--fps", type=float, default=0, help="playback frame rate")
+    player.add_argument("--start", type=float, default=0.0, help="start of the film in seconds")
+    player.add_argument("--end", type=float, default=0.0, help="end of the film in seconds, 0 for the end")
+    player.add_argument("--step", type=int, default=0, help="play every n-th frame")
+    player.add_argument("--cover-before", help="picture shown before the film")
+    player.add_argument("--cover-after", help="picture shown after the film")
+    player.add_argument("--cover-before-frame", type=int, default=-1, help="frame shown before the film")
+    player.add_argument("--cover-after-frame", type=int, default=-1, help="frame shown after the film")
+    player.add_argument("--no-cover-before", action="store_true")
+    player.add_argument("--no-cover-after", action="store_true")
+    player.add_argument("--frame-cache", help="FrameCache directory")
+    player.add_argument("--chassis-cache", help="ChassisCache directory, lamps and decoder shared by the films")
+    player.add_argument("--workers", type=int, default=1,
+                        help="decoding processes of each film, or processes building the tiles of a wall")
+    player.add_argument("--compact", action="store_true",
+                        help="strip default fields and reorder entities for a smaller blueprint string")
+    player.add_argument("--compress-level", type=int, default=9, choices=range(1, 10), metavar="1-9",
+                        help="zlib level, lower is faster and larger")
+    player.add_argument("--compress-threads", type=int, default=1,
+                        help="threads compressing each blueprint, 1 for plain zlib, 0 for 1 per cpu")
+
+    build = commands.add_parser("build", parents=[player], help="build the player blueprints of films")
+    build.add_argument("films", nargs="+", help="video files, 1 blueprint is built for each")
+    build.add_argument("-o", "--output-dir", default=".", help="directory of the blueprints, <film name>.txt")
+    build.add_argument("--book", action="store_true", help="write blueprint shards and a book into <film name>/")
+    build.add_argument("--clipboard", action="store_true", help="copy the blueprint to clipboard, 1 film only")
+    build.add_argument("-j", "--jobs", type=int, default=min(4, os.cpu_count() or 1), help="films built at once")
+    build.add_argument("--wall", help="ROWSxCOLS, play the film on a video wall of tiles, --height is the wall height")
+    build.add_argument("--heights", help="comma separated display heights, the film is decoded once for all of them, "
+                                         "<film name>_<height>.txt is built for each")
+    build.add_argument("--max-memory", type=int, default=0,
+                       help="MB of the estimated memory of the jobs running at once, 0 for no limit")
+
+    plan = commands.add_parser("plan", parents=[player],
+                               help="predict entities, wires and string size of players, or fit them to a budget")
+    plan.add_argument("films", nargs="+", help="video files")
+    plan.add_argument("--max-entities", type=int, default=0, help="entity budget, 0 for no limit")
+    plan.add_argument("--max-bytes", type=int, default=0, help="blueprint string budget in characters, 0 for no limit")
+    plan.add_argument("--max-step", type=int, default=4, help="largest frame step a budget may choose")
+    plan.add_argument("--min-height", type=int, default=8, help="smallest display height a budget may choose")
+    plan.add_argument("--json", action="store_true", help="print the plans as json")
+
+    decode = commands.add_parser("decode", help="print the json of a blueprint string")
+    decode.add_argument("blueprint", help="file with the blueprint string")
+    decode.add_argument("-o", "--output", help="json file, default is stdout")
+    decode.add_argument("--indent", type=int, default=0)
+
+    inspect = commands.add_parser("inspect", help="statistics of blueprint strings without loading the json")
+    inspect.add_argument("blueprints", nargs="+", help="files with a blueprint string")
+    inspect.add_argument("--json", action="store_true", help="print the statistics as json")
+
+    args = parser.parse_args()
+    if args.command == "decode":
+        decode_blueprint(args)
+        return 0
+    if args.command == "inspect":
+        import inspector
+        return 1 if inspector.inspect_files(args.blueprints, args.json) else 0
+    if args.command == "plan":
+        return 1 if run_plan(args) else 0
+    if args.clipboard and (len(args.films) > 1 or args.book):
+        parser.error("--clipboard takes 1 film and no --book")
+    if args.heights and (args.wall or args.clipboard):
+        parser.error("--heights takes no --wall or --clipboard")
+    summaries = run_build(args)
+    failed = sum(summary["failed"] for summary in summaries)
+    print("{} built, {} failed".format(len(summaries) - failed, failed))
+    return 1 if failed else 0
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
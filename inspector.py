@@ -0,0 +1,331 @@
+# Streaming blueprint inspector
+#
+# read a blueprint string through base64 decoding, incremental zlib decompression and an incremental
+# json tokenizer, entities and wires are parsed one at a time, the decompressed json is never held in memory:
+#   python inspector.py blueprint.txt
+# reports entity counts by name, wire counts, the position bounding box, wire endpoints without entity
+# and the share of json bytes of each entity name, for each blueprint of a book and in total
+
+import argparse
+import base64
+import codecs
+import collections
+import json
+import re
+import sys
+import zlib
+
+READ_SIZE = 1 << 16  # characters of the blueprint string decoded at once, a multiple of 4
+OUTPUT_SIZE = 1 << 20  # bytes of json decompressed at once
+
+# whitespace, then a string, a number, a literal or a structural character
+TOKEN = re.compile(r'\s*(?:("(?:[^"\\]|\\.)*")|(-?[0-9][0-9.eE+-]*)|(true|false|null)|([{}\[\]:,]))')
+SPACE = re.compile(r'\s*')
+
+
+def read_json(path):
+    """yield the decompressed json of the blueprint string in path, in chunks of bytes"""
+    decompressor = zlib.decompressobj()
+    with open(path, "rb") as f:
+        if f.read(1) != b"0":
+            raise ValueError("not a version 0 blueprint string")
+        remain = b""
+        while True:
+            text = f.read(READ_SIZE)
+            data = remain + b"".join(text.split())
+            if not text:
+                break
+            size = len(data) - len(data) % 4
+            remain = data[size:]
+            data = base64.b64decode(data[:size])
+            while data:
+                yield decompressor.decompress(data, OUTPUT_SIZE)
+                data = decompressor.unconsumed_tail
+        if data:
+            data = base64.b64decode(data)
+            yield decompressor.decompress(data)
+        yield decompressor.flush()
+        if not decompressor.eof:
+            raise ValueError("the blueprint string is truncated")
+
+
+class JsonStream(object):
+    """
+    json text from chunks of bytes, read as tokens or as whole values
+    only the part of the text after the current token is kept, entities and wires are read as values by
+    the json module, so the memory is bounded by the largest entity
+    """
+
+    MAX_VALUE = 1 << 26  # characters of a value, a longer value is an error
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf8")()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.done = False
+        self.size = 0  # bytes of json read
+
+    def fill(self):
+        """append the next chunk to the buffer, return False at the end of the json"""
+        if self.done:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.done = True
+            text = self.decoder.decode(b"", True)
+        else:
+            self.size += len(chunk)
+            text = self.decoder.decode(chunk)
+        self.buffer = self.buffer[self.pos:] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """the next character after whitespace, "" at the end"""
+        while True:
+            self.pos = SPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos:self.pos + 1]
+
+    def token(self):
+        """(kind, text) of the next token, kind is 1 string, 2 number, 3 literal, 4 structure, None at the end"""
+        while True:
+            match = TOKEN.match(self.buffer, self.pos)
+            # a token ending at the buffer end may continue in the next chunk
+            if match is not None and match.end() < len(self.buffer) or not self.fill():
+                break
+        if match is None:
+            if self.buffer[self.pos:].strip():
+                raise ValueError("invalid json near {!r}".format(self.buffer[self.pos:self.pos + 40]))
+            return None, ""
+        self.pos = match.end()
+        return match.lastindex, match.group(match.lastindex)
+
+    def offset(self):
+        """bytes of json before the current position, characters after it are counted as 1 byte"""
+        return self.size - len(self.buffer) + self.pos
+
+    def value(self):
+        """(value, bytes of its json) of the next value"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer, self.pos)
+                if end < len(self.buffer) or self.done:
+                    break  # a number at the buffer end may continue
+            except json.JSONDecodeError as e:
+                if len(self.buffer) - self.pos > JsonStream.MAX_VALUE or not self.fill():
+                    raise ValueError("invalid json: {}".format(e))
+                continue
+            self.fill()
+        text = self.buffer[self.pos:end]
+        self.pos = end
+        return value, len(text) if text.isascii() else len(text.encode())
+
+
+class BlueprintStats(object):
+    """statistics of 1 blueprint"""
+
+    def __init__(self, label=""):
+        self.label = label
+        self.entities = collections.Counter()  # name -> count
+        self.entity_bytes = collections.Counter()  # name -> json bytes of the entities
+        self.wires = 0
+        self.wire_bytes = 0
+        self.connectors = collections.Counter()  # (connector a, connector b) -> count
+        self.min_x = self.min_y = float("inf")
+        self.max_x = self.max_y = float("-inf")
+        self.numbers = bytearray()  # bit set of the entity numbers
+        self.duplicates = 0
+        self.dangling = 0  # wire endpoints without entity
+        self.pending = []  # endpoints of wires before the entities, checked at the end
+        self.json_bytes = 0
+
+    def add_entity(self, name, number, x, y, size):
+        self.entities[name] += 1
+        self.entity_bytes[name] += size
+        if x is not None and y is not None:
+            self.min_x = min(self.min_x, x)
+            self.max_x = max(self.max_x, x)
+            self.min_y = min(self.min_y, y)
+            self.max_y = max(self.max_y, y)
+        if isinstance(number, int) and number >= 0:
+            if number >> 3 >= len(self.numbers):
+                self.numbers.extend(bytes(max((number >> 3) + 1 - len(self.numbers), len(self.numbers))))
+            if self.numbers[number >> 3] & 1 << (number & 7):
+                self.duplicates += 1
+            self.numbers[number >> 3] |= 1 << (number & 7)
+
+    def has_entity(self, number):
+        return isinstance(number, int) and 0 <= number and number >> 3 < len(self.numbers) and \
+            self.numbers[number >> 3] & 1 << (number & 7)
+
+    def add_wire(self, wire, size):
+        self.wires += 1
+        self.wire_bytes += size
+        if len(wire) != 4:
+            self.dangling += 2
+            return
+        self.connectors[(wire[1], wire[3])] += 1
+        for number in (wire[0], wire[2]):
+            if not self.has_entity(number):
+                self.pending.append(number)  # empty when the entities come first like in the game
+
+    def check_pending(self):
+        """endpoints seen before their entity are counted as dangling at the end of the blueprint"""
+        self.dangling += sum(1 for number in self.pending if not self.has_entity(number))
+        self.pending = []
+
+    def merge(self, other):
+        self.entities.update(other.entities)
+        self.entity_bytes.update(other.entity_bytes)
+        self.wires += other.wires
+        self.wire_bytes += other.wire_bytes
+        self.connectors.update(other.connectors)
+        self.min_x = min(self.min_x, other.min_x)
+        self.max_x = max(self.max_x, other.max_x)
+        self.min_y = min(self.min_y, other.min_y)
+        self.max_y = max(self.max_y, other.max_y)
+        self.duplicates += other.duplicates
+        self.dangling += other.dangling
+        self.json_bytes += other.json_bytes
+
+    def report(self):
+        """dict of the statistics, for json output"""
+        count = sum(self.entities.values())
+        return {
+            "label": self.label,
+            "entities": count,
+            "entity_names": dict(self.entities.most_common()),
+            "wires": self.wires,
+            "wire_connectors": {"{}-{}".format(*key): value for key, value in sorted(self.connectors.items())},
+            "bounding_box": [[self.min_x, self.min_y], [self.max_x, self.max_y]] if count else None,
+            "duplicate_entity_numbers": self.duplicates,
+            "dangling_wire_endpoints": self.dangling,
+            "json_bytes": self.json_bytes,
+            "entity_bytes": dict(self.entity_bytes.most_common()),
+            "wire_bytes": self.wire_bytes,
+        }
+
+    def print_report(self, title):
+        count = sum(self.entities.values())
+        print("{}: {} entities, {} wires, {:,} json bytes".format(title, count, self.wires, self.json_bytes))
+        if count:
+            print("  bounding box: x {} .. {}, y {} .. {} ({} x {})".format(
+                self.min_x, self.max_x, self.min_y, self.max_y,
+                self.max_x - self.min_x + 1, self.max_y - self.min_y + 1))
+        total = max(self.json_bytes, 1)
+        for name, number in self.entities.most_common():
+            size = self.entity_bytes[name]
+            print("  {:<24} {:>9} {:>14,} bytes {:6.1%} {:8.1f} bytes/entity".format(
+                name, number, size, size / total, size / number))
+        if self.wires:
+            print("  {:<24} {:>9} {:>14,} bytes {:6.1%} {:8.1f} bytes/wire".format(
+                "wires", self.wires, self.wire_bytes, self.wire_bytes / total, self.wire_bytes / self.wires))
+            print("  wire connectors: " + ", ".join("{}-{} {}".format(a, b, value) for (a, b), value in
+                                                   sorted(self.connectors.items())))
+        if self.duplicates or self.dangling:
+            print("  ERROR, {} duplicate entity numbers, {} dangling wire endpoints".format(
+                self.duplicates, self.dangling))
+
+
+def inspect(path):
+    """statistics of the blueprint string in path, return (list of BlueprintStats, total BlueprintStats)"""
+    stream = JsonStream(read_json(path))
+    blueprints = []
+    stack = []  # (bracket, key of the container in its parent object, "value" before an item of an array)
+    key = None  # last key in the current object
+    expect_key = False
+    blueprint = None  # BlueprintStats of the open blueprint
+    blueprint_depth = blueprint_start = 0
+    while True:
+        # entities and wires of the open blueprint are read as whole values
+        if blueprint is not None and len(stack) == blueprint_depth + 1 and stack[-1][0] == "[" and \
+                stack[-1][1] in ("entities", "wires") and stack[-1][2] == "value" and stream.peek() not in "]":
+            value, size = stream.value()
+            stack[-1] = stack[-1][:2] + ("",)
+            if stack[-1][1] == "wires":
+                blueprint.add_wire(value if isinstance(value, list) else [], size)
+            elif isinstance(value, dict):
+                position = value.get("position") or {}
+                blueprint.add_entity(value.get("name"), value.get("entity_number"), position.get("x"),
+                                     position.get("y"), size)
+            continue
+        kind, token = stream.token()
+        if kind is None:
+            break
+        depth = len(stack)
+        if kind == 4:
+            if token == "{" or token == "[":
+                parent_key = key if stack and stack[-1][0] == "{" else None
+                if token == "{" and key == "blueprint" and stack and stack[-1][0] == "{":
+                    blueprint = BlueprintStats()
+                    blueprint_depth, blueprint_start = depth + 1, stream.offset()
+                stack.append((token, parent_key, "value"))
+                key = None
+                expect_key = token == "{"
+            elif token == "}" or token == "]":
+                if not stack:
+                    raise ValueError("invalid json, {} without {}".format(token, "{" if token == "}" else "["))
+                stack.pop()
+                if blueprint is not None and depth == blueprint_depth:
+                    blueprint.check_pending()
+                    blueprint.json_bytes = stream.offset() - blueprint_start
+                    blueprints.append(blueprint)
+                    blueprint = None
+                expect_key = False
+            elif token == ",":
+                expect_key = stack[-1][0] == "{"
+                stack[-1] = stack[-1][:2] + ("value",)
+            continue
+        if expect_key:
+            key = json.loads(token)
+            expect_key = False
+        elif blueprint is not None and depth == blueprint_depth and key == "label" and kind == 1:
+            blueprint.label = json.loads(token)
+    if stack:
+        raise ValueError("the json ends inside a {}".format(stack[-1][0]))
+    total = BlueprintStats()
+    for blueprint in blueprints:
+        total.merge(blueprint)
+    total.json_bytes = stream.size
+    return blueprints, total
+
+
+def inspect_files(paths, as_json=False):
+    """print the statistics of blueprint strings, return the number of files with errors"""
+    failed = 0
+    reports = {}
+    for path in paths:
+        try:
+            blueprints, total = inspect(path)
+        except (ValueError, zlib.error) as e:
+            print("ERROR, {}: {}".format(path, e))
+            failed += 1
+            continue
+        failed += 1 if total.dangling or total.duplicates else 0
+        if as_json:
+            reports[path] = {"blueprints": [blueprint.report() for blueprint in blueprints],
+                             "total": total.report()}
+            continue
+        for index, blueprint in enumerate(blueprints):
+            if len(blueprints) > 1:
+                blueprint.print_report("{} blueprint {} {}".format(path, index, blueprint.label).rstrip())
+        total.print_report(path + (" total" if len(blueprints) > 1 else ""))
+    if as_json:
+        print(json.dumps(reports, indent=2, ensure_ascii=False))
+    return failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="statistics of blueprint strings, in constant memory")
+    parser.add_argument("blueprints", nargs="+", help="files with a blueprint string")
+    parser.add_argument("--json", action="store_true", help="print the statistics as json")
+    args = parser.parse_args()
+    return 1 if inspect_files(args.blueprints, args.json) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,725 @@
+# Offline circuit network simulator for generated players
+#
+# load a player from BluePrint.store or from a blueprint string, simulate the red and green
+# networks tick by tick and render the lamps into numpy frames:
+#   python simulator.py blueprint.txt --ticks 1000 --switch-on --video out.avi
+
+import argparse
+import base64
+import json
+import sys
+import zlib
+
+import numpy as np
+
+# connector id -> wire color, combinators have input 1 2 and output 3 4, others have 1 2 only
+RED = 0
+GREEN = 1
+COMBINATORS = ("arithmetic-combinator", "decider-combinator")
+SPECIAL_SIGNALS = ("signal-each", "signal-everything", "signal-anything")
+EACH = -1
+EVERYTHING = -2
+ANYTHING = -3
+
+COMPARATORS = {
+    "=": np.equal, "!=": np.not_equal, "≠": np.not_equal,
+    "<": np.less, ">": np.greater,
+    "<=": np.less_equal, "≤": np.less_equal, ">=": np.greater_equal, "≥": np.greater_equal,
+}
+OPERATIONS = ["*", "/", "+", "-", "%", "^", "<<", ">>", "AND", "OR", "XOR"]
+ZERO_KEEPING = ("*", "/", "%", "<<", ">>", "AND")  # 0 op x is 0
+PACKED_SHIFTS = np.array([0, 8, 16], dtype=np.int32)  # blue, green, red bytes of a packed rgb signal
+
+
+def decode(bp_string):
+    """blueprint string -> json dict, same as the decoding in test.py"""
+    return json.loads(zlib.decompress(base64.b64decode(bp_string[1:])))
+
+
+def wrap(values):
+    """wrap integer values to signed 32 bit like the game does, the cast keeps the low 32 bits"""
+    return values.astype(np.int32)
+
+
+def calculate(op, a, b):
+    """arithmetic combinator operation on int32 arrays, overflow wraps around like in the game"""
+    if op == "*":
+        return a * b
+    if op == "/" or op == "%":
+        if b.size and (b == b.flat[0]).all():
+            b = b.flat[0]  # the decoder divides by a constant, numpy divides by a scalar much faster
+        safe = np.where(b == 0, 1, b)[()]
+        with np.errstate(over="ignore"):  # -2^31 / -1 wraps around to -2^31
+            quotient = a // safe
+        # floor division rounds toward -inf, the game truncates toward zero
+        quotient = quotient + ((quotient * safe != a) & ((a < 0) != (safe < 0)))
+        ret = quotient if op == "/" else a - safe * quotient
+        return np.where(b == 0, 0, ret)
+    if op == "+":
+        return a + b
+    if op == "-":
+        return a - b
+    if op == "^":
+        return np.power(a, np.maximum(b, 0))
+    if op == "<<":
+        return a << (b & 31)
+    if op == ">>":
+        return a >> (b & 31)  # arithmetic shift keeps the sign like the game
+    if op == "AND":
+        return a & b
+    if op == "OR":
+        return a | b
+    if op == "XOR":
+        return a ^ b
+    raise ValueError("unsupported operation " + op)
+
+
+def lerp(frame):
+    """the color mapping of the decoder, value * 0xFF / 0xE0, see the readme"""
+    return (frame.astype(np.int32) * 0xFF // 0xE0).astype(np.uint8)
+
+
+def expected_display(packed, height=None, palette=None):
+    """BGR frames the decoder should show for packed frames in frame_to_array layout, palette of palette mode"""
+    from blueprint import BluePrint
+    if palette is not None:
+        return BluePrint.unpack_palette_array(packed, palette, height)
+    return lerp(BluePrint.unpack_array(packed, height))
+
+
+def match_frames(rendered, expected):
+    """
+    compare rendered frames with expected frames
+    return (index of the nearest expected frame, mean absolute error) for every rendered frame
+    """
+    expected = expected.reshape(len(expected), -1).astype(np.int32)
+    ret = []
+    for frame in rendered:
+        error = np.abs(expected - frame.reshape(1, -1).astype(np.int32)).mean(axis=1)
+        idx = int(error.argmin())
+        ret.append((idx, float(error[idx])))
+    return ret
+
+
+class Scatter(object):
+    """
+    precomputed scatter add of entity outputs into the cells of the networks, np.add.at without its cost every tick
+    cells is (2, n) or (2, n, k): the cells n entities add their scalar or k column output to,
+    through their red and their green output, the outputs to the always empty cell `zero` are dropped
+    """
+
+    def __init__(self, cells, zero):
+        keep = cells != zero
+        # cells of every entity, for adding the outputs of some entities only
+        self.entity_cells = cells
+        self.entity_keep = keep
+        count = cells[0].size
+        source = np.broadcast_to(np.arange(count).reshape(cells.shape[1:]), cells.shape)[keep]
+        cells = cells[keep]
+        self.unique = len(np.unique(cells)) == len(cells)
+        self.starts = None
+        if not self.unique:
+            # outputs to the same cell are summed first, the fancy index add below sees every cell once
+            order = np.argsort(cells, kind="stable")
+            cells = cells[order]
+            source = source[order]
+            self.starts = np.flatnonzero(np.diff(cells, prepend=-1))  # first output of every cell
+            cells = cells[self.starts]
+        self.cells = cells
+        # most entities send to 1 network only, their values don't need to be reordered
+        self.source = None if np.array_equal(source, np.arange(count)) else source
+
+    def add(self, new, values, entities=None):
+        """add values of the entities to new, or values of only the entities given by index"""
+        if entities is not None:
+            keep = self.entity_keep[:, entities]
+            np.add.at(new, self.entity_cells[:, entities][keep], np.stack([values, values])[keep])
+            return
+        values = values.reshape(-1)
+        if self.source is not None:
+            values = values[self.source]
+        if not self.unique:
+            values = np.add.reduceat(values, self.starts, dtype=new.dtype)
+        new[self.cells] += values
+
+
+class Simulator(object):
+    """
+    tick based simulation of the circuit networks of a blueprint
+    every combinator reads the networks of the current tick, its output is seen by the networks in the next tick
+    supported: lamps in components or packed rgb color mode, constant combinators,
+    arithmetic combinators with specific or each signals,
+    decider combinators with and/or conditions on specific signals, or a single condition on each signal
+    network values are int32 which wrap around like the game, kept only for the signals which can reach a network
+    """
+
+    def __init__(self, entities, wires):
+        self.issues = []  # wiring problems found while loading, see check_wiring
+        self.signal_index = {}
+        self.signals = []
+        self.parse_entities(entities)
+        self.parse_wires(wires)
+        self.build_arrays()
+        self.tick = 0
+        self.net_values = self.const_values.copy()
+
+    @staticmethod
+    def from_string(bp_string):
+        bp = decode(bp_string)["blueprint"]
+        return Simulator(bp.get("entities", []), bp.get("wires", []))
+
+    @staticmethod
+    def from_player(player):
+        """player is a BluePrint after its entities are built"""
+        store = player.store
+        return Simulator((store.entity(i) for i in range(len(store))), store.wire_table().tolist())
+
+    def signal_id(self, signal):
+        name = signal["name"] if isinstance(signal, dict) else signal
+        if name == "signal-each":
+            return EACH
+        if name == "signal-everything":
+            return EVERYTHING
+        if name == "signal-anything":
+            return ANYTHING
+        idx = self.signal_index.get(name)
+        if idx is None:
+            idx = len(self.signals)
+            self.signals.append(name)
+            self.signal_index[name] = idx
+        return idx
+
+    @staticmethod
+    def networks(spec):
+        spec = spec or {}
+        return int(spec.get("red", True)), int(spec.get("green", True))
+
+    def parse_entities(self, entities):
+        self.numbers = {}  # entity number -> index
+        self.entity_numbers = []
+        self.names = []
+        self.lamps = []
+        self.constants = []
+        self.arithmetics = []
+        self.deciders = []
+        for entity in entities:
+            idx = len(self.names)
+            self.numbers[entity["entity_number"]] = idx
+            self.entity_numbers.append(entity["entity_number"])
+            self.names.append(entity["name"])
+            behavior = entity.get("control_behavior", {})
+            if entity["name"] == "small-lamp":
+                color = entity.get("color", {"r": 1, "g": 1, "b": 1})
+                scale = 255 if max(color.get("r", 0), color.get("g", 0), color.get("b", 0)) <= 1 else 1
+                self.lamps.append({
+                    "idx": idx, "x": entity["position"]["x"], "y": entity["position"]["y"],
+                    "mode": behavior.get("color_mode", 0) if behavior.get("use_colors") else -1,
+                    "rgb": self.signal_id(behavior.get("rgb_signal", "signal-white")),
+                    "components": [self.signal_id(behavior.get(key, default)) for key, default in
+                                   (("red_signal", "signal-red"), ("green_signal", "signal-green"),
+                                    ("blue_signal", "signal-blue"))],
+                    "color": [int(color.get(c, 0) * scale) for c in "bgr"],
+                })
+            elif entity["name"] == "constant-combinator":
+                filters = []
+                for section in behavior.get("sections", {}).get("sections", []):
+                    if section.get("active", True):
+                        filters += [(self.signal_id(f["name"]), f.get("count", 0)) for f in section.get("filters", [])]
+                self.constants.append({"idx": idx, "on": behavior.get("is_on", True), "filters": filters})
+            elif entity["name"] == "arithmetic-combinator":
+                cond = behavior.get("arithmetic_conditions", {})
+                self.arithmetics.append({
+                    "idx": idx,
+                    "first": self.signal_id(cond["first_signal"]) if "first_signal" in cond else None,
+                    "first_constant": cond.get("first_constant", 0),
+                    "first_networks": self.networks(cond.get("first_signal_networks")),
+                    "second": self.signal_id(cond["second_signal"]) if "second_signal" in cond else None,
+                    "second_constant": cond.get("second_constant", 0),
+                    "second_networks": self.networks(cond.get("second_signal_networks")),
+                    "op": cond.get("operation", "*"),
+                    "output": self.signal_id(cond["output_signal"]) if "output_signal" in cond else None,
+                })
+            elif entity["name"] == "decider-combinator":
+                cond = behavior.get("decider_conditions", {})
+                conditions = [{
+                    "first": self.signal_id(c["first_signal"]) if "first_signal" in c else None,
+                    "first_networks": self.networks(c.get("first_signal_networks")),
+                    "second": self.signal_id(c["second_signal"]) if "second_signal" in c else None,
+                    "second_networks": self.networks(c.get("second_signal_networks")),
+                    "constant": c.get("constant", 0),
+                    "comparator": c.get("comparator", "<"),
+                    "and": c.get("compare_type", "or") == "and",
+                } for c in cond.get("conditions", [])]
+                outputs = [{
+                    "signal": self.signal_id(o["signal"]) if "signal" in o else None,
+                    "copy": o.get("copy_count_from_input", True),
+                    "constant": o.get("constant", 1),
+                    "networks": self.networks(o.get("networks")),
+                } for o in cond.get("outputs", [])]
+                self.deciders.append({"idx": idx, "conditions": conditions, "outputs": outputs})
+        for key in ("signal-red", "signal-green", "signal-blue"):
+            self.signal_id(key)
+
+    def parse_wires(self, wires):
+        count = len(self.names)
+        parent = list(range(count * 4))
+
+        def find(node):
+            while parent[node] != node:
+                parent[node] = parent[parent[node]]
+                node = parent[node]
+            return node
+
+        wired = set()
+        for wire in wires:
+            a, pa, b, pb = wire[:4]
+            if a not in self.numbers or b not in self.numbers:
+                self.issues.append("wire {} references a missing entity".format(wire))
+                continue
+            ia, ib = self.numbers[a], self.numbers[b]
+            bad = [e for e, p in ((ia, pa), (ib, pb)) if p < 1 or p > (4 if self.names[e] in COMBINATORS else 2)]
+            if bad:
+                self.issues.append("wire {} uses an invalid connector".format(wire))
+                continue
+            if (pa - 1) % 2 != (pb - 1) % 2:
+                self.issues.append("wire {} connects red to green".format(wire))
+                continue
+            na, nb = ia * 4 + pa - 1, ib * 4 + pb - 1
+            wired.add(na)
+            wired.add(nb)
+            ra, rb = find(na), find(nb)
+            if ra != rb:
+                parent[ra] = rb
+        roots = {}
+        self.node_net = np.full(count * 4, -1, dtype=np.int64)
+        for node in wired:
+            self.node_net[node] = roots.setdefault(find(node), len(roots))
+        self.net_count = len(roots)
+        self.dummy = self.net_count  # index of an always empty network for unconnected connectors
+        self.node_net[self.node_net < 0] = self.dummy
+
+    def net(self, idx, connector):
+        return int(self.node_net[idx * 4 + connector - 1])
+
+    def build_arrays(self):
+        # the values of the networks are kept for the (network, signal) cells which can be non zero only,
+        # all other cells read the always empty cell at the end
+        self.width = len(self.signals)
+        self.reachable = self.reachable_signals()
+        self.zero = int(self.reachable.sum())
+        self.cell_map = np.full(self.reachable.size, self.zero, dtype=np.int64)
+        self.cell_map[self.reachable.reshape(-1)] = np.arange(self.zero)
+        self.build_const_values()
+
+        # arithmetic combinators grouped by operation and by the kind of their input and output:
+        # specific input, each input with each output, each input summed into a specific output
+        self.arithmetic_groups = []
+        for op in OPERATIONS:
+            group = [a for a in self.arithmetics if a["op"] == op]
+            for kind, members in (
+                    ("scalar", [a for a in group if a["first"] != EACH]),
+                    ("rows", [a for a in group if a["first"] == EACH and a["output"] == EACH]),
+                    ("sum", [a for a in group if a["first"] == EACH and a["output"] != EACH])):
+                if members:
+                    self.arithmetic_groups.append(self.arithmetic_arrays(op, kind, members))
+
+        # decider combinators, conditions on specific signals are evaluated together,
+        # a single condition on the each signal is evaluated per signal
+        plain = []
+        each = []
+        for decider in self.deciders:
+            firsts = [c["first"] for c in decider["conditions"]]
+            if not firsts:
+                continue
+            if any(first in (EVERYTHING, ANYTHING) or first is None for first in firsts) or \
+                    (EACH in firsts and len(firsts) > 1):
+                raise ValueError("unsupported decider conditions of entity {}".format(decider["idx"]))
+            (each if firsts[0] == EACH else plain).append(decider)
+        self.plain_deciders = self.decider_arrays(plain, flatten=True)
+        self.each_deciders = self.decider_arrays(each, flatten=False)
+
+        if self.lamps:
+            xs = np.array([lamp["x"] for lamp in self.lamps])
+            ys = np.array([lamp["y"] for lamp in self.lamps])
+            self.lamp_col = np.round(xs - xs.min()).astype(np.int64)
+            self.lamp_row = np.round(ys - ys.min()).astype(np.int64)
+            lamp_in = np.array([[self.net(lamp["idx"], 1), self.net(lamp["idx"], 2)] for lamp in self.lamps])
+            self.lamp_mode = np.array([lamp["mode"] for lamp in self.lamps])
+            self.lamp_packed = self.lamp_mode == 2
+            self.image_shape = (self.lamp_row.max() + 1, self.lamp_col.max() + 1, 3)
+            self.lamp_pixel = self.lamp_row * self.image_shape[1] + self.lamp_col
+            # the signals a lamp reads: rgb, blue, green, red, from its red and green network
+            read = np.array([[lamp["rgb"]] + lamp["components"][::-1] for lamp in self.lamps])
+            self.lamp_cells = (self.cell(lamp_in[:, :1], read), self.cell(lamp_in[:, 1:], read))
+            self.lamp_color = np.array([lamp["color"] for lamp in self.lamps], dtype=np.uint8)
+
+    def arithmetic_arrays(self, op, kind, group):
+        arrays = {key: np.array([self.net(a["idx"], connector) for a in group], dtype=np.int64)
+                  for key, connector in (("in_red", 1), ("in_green", 2), ("out_red", 3), ("out_green", 4))}
+        arrays["op"] = op
+        arrays["kind"] = kind
+        first = np.array([a["first"] if a["first"] is not None else -9 for a in group])
+        first_networks = np.array([a["first_networks"] for a in group])
+        if kind == "scalar":
+            arrays["first"] = self.operand_cells(arrays["in_red"], arrays["in_green"], first, first_networks,
+                                                 [a["first_constant"] for a in group])
+        else:
+            arrays["columns"] = self.columns(arrays["in_red"], arrays["in_green"])
+            arrays["first"] = self.input_cells(arrays["in_red"], arrays["in_green"], first_networks, arrays["columns"])
+        second = np.array([a["second"] if a["second"] is not None else -9 for a in group])
+        arrays["second"] = self.operand_cells(arrays["in_red"], arrays["in_green"], second,
+                                              np.array([a["second_networks"] for a in group]),
+                                              [a["second_constant"] for a in group])
+        output = np.array([a["output"] if a["output"] is not None else -9 for a in group])
+        if kind == "rows":
+            arrays["scatter"] = self.scatter(arrays["out_red"], arrays["out_green"], columns=arrays["columns"])
+        else:
+            arrays["scatter"] = self.scatter(arrays["out_red"], arrays["out_green"], output)
+        return arrays
+
+    def reachable_signals(self):
+        """
+        (networks, signals) flags of the signals which can ever be on a network,
+        the combinators passing whole rows only need to look at these columns
+        """
+        reachable = np.zeros((self.net_count + 1, self.width), dtype=bool)
+        copies = []  # (input, output) networks of combinators passing whole rows
+        for constant in self.constants:
+            for sig, _ in constant["filters"]:
+                if sig >= 0:
+                    reachable[[self.net(constant["idx"], 1), self.net(constant["idx"], 2)], sig] = True
+        outputs = [(a["idx"], a["output"], a["first"] == EACH) for a in self.arithmetics]
+        outputs += [(d["idx"], o["signal"], True) for d in self.deciders for o in d["outputs"]]
+        for idx, sig, each in outputs:
+            if sig is not None and sig >= 0:
+                reachable[[self.net(idx, 3), self.net(idx, 4)], sig] = True
+            elif each:
+                copies += [(self.net(idx, i), self.net(idx, o)) for i in (1, 2) for o in (3, 4)]
+        copies = np.array(copies, dtype=np.int64).reshape(-1, 2)
+        copies = copies[(copies != self.dummy).all(axis=1)]
+        reachable[self.dummy] = False  # unconnected outputs were marked on it
+        # follow the rows until nothing new arrives
+        count = -1
+        while count != reachable.sum():
+            count = reachable.sum()
+            np.logical_or.at(reachable, copies[:, 1], reachable[copies[:, 0]])
+        return reachable
+
+    def cell(self, nets, signals):
+        """index of (network, signal) cells in the network values"""
+        return self.cell_map[nets * self.width + signals]
+
+    def columns(self, red, green):
+        """signals which can be on any of the networks"""
+        return np.flatnonzero((self.reachable[red] | self.reachable[green]).any(axis=0))
+
+    def input_cells(self, red, green, networks, columns):
+        """
+        (n, columns) cells of the red and green input of entities reading whole rows, see inputs
+        networks is (n, 2) flags of red and green, networks which are not read are the always empty one
+        """
+        red = np.where(networks[:, 0] != 0, red, self.dummy)
+        green = np.where(networks[:, 1] != 0, green, self.dummy)
+        return self.cell(red[:, None], columns), self.cell(green[:, None], columns)
+
+    def operand_cells(self, red, green, signal, networks, constant):
+        """
+        cells of the red and green network an operand reads, and its constant, see operand
+        networks which are not read and operands which are a constant read the always empty network
+        """
+        used = signal >= 0
+        safe = np.maximum(signal, 0)
+        return (self.cell(np.where(used & (networks[:, 0] != 0), red, self.dummy), safe),
+                self.cell(np.where(used & (networks[:, 1] != 0), green, self.dummy), safe),
+                np.where(used, 0, wrap(np.array(constant, dtype=np.int64))).astype(np.int32))
+
+    def scatter(self, out_red, out_green, signal=None, columns=None):
+        """Scatter of outputs to 1 signal each, or to the columns of their rows when signal is None"""
+        nets = np.stack([out_red, out_green])
+        if signal is None:
+            return Scatter(self.cell(nets[..., None], columns), self.zero)
+        # no output signal, nothing is sent
+        return Scatter(self.cell(np.where(signal >= 0, nets, self.dummy), np.maximum(signal, 0)), self.zero)
+
+    def decider_arrays(self, deciders, flatten):
+        ret = {"count": len(deciders)}
+        if not deciders:
+            return ret
+        for key, connector in (("in_red", 1), ("in_green", 2), ("out_red", 3), ("out_green", 4)):
+            ret[key] = np.array([self.net(d["idx"], connector) for d in deciders], dtype=np.int64)
+        columns = self.columns(ret["in_red"], ret["in_green"])  # of each conditions and row outputs
+        conditions = [(k, c) for k, d in enumerate(deciders) for c in d["conditions"]]
+        ret["cond_decider"] = np.array([k for k, _ in conditions], dtype=np.int64)
+        red, green = ret["in_red"][ret["cond_decider"]], ret["in_green"][ret["cond_decider"]]
+        first = np.array([c["first"] for _, c in conditions], dtype=np.int64)
+        first_networks = np.array([c["first_networks"] for _, c in conditions])
+        if flatten:
+            ret["cond_first"] = self.operand_cells(red, green, first, first_networks, [0] * len(conditions))
+        else:
+            ret["cond_first"] = self.input_cells(red, green, first_networks, columns)
+        ret["cond_second"] = self.operand_cells(
+            red, green, np.array([-9 if c["second"] is None else c["second"] for _, c in conditions]),
+            np.array([c["second_networks"] for _, c in conditions]), [c["constant"] for _, c in conditions])
+        ret["cond_comparator"] = [c["comparator"] for _, c in conditions]
+        if flatten:
+            # a new "or" group starts at the first condition of a decider and at every "or" condition
+            first_of_decider = np.ones(len(conditions), dtype=bool)
+            first_of_decider[1:] = ret["cond_decider"][1:] != ret["cond_decider"][:-1]
+            starts_group = first_of_decider | ~np.array([c["and"] for _, c in conditions])
+            ret["group_starts"] = np.flatnonzero(starts_group)
+            ret["group_decider"] = ret["cond_decider"][ret["group_starts"]]
+            ret["decider_group_starts"] = np.flatnonzero(first_of_decider[ret["group_starts"]])
+            ret["comparator_masks"] = {comparator: np.array([c == comparator for c in ret["cond_comparator"]])
+                                       for comparator in set(ret["cond_comparator"])}
+        # outputs of everything or each copy whole rows, the others a single signal
+        outputs = [(k, o) for k, d in enumerate(deciders) for o in d["outputs"]]
+        is_row = [o["signal"] is None or o["signal"] < 0 for _, o in outputs]
+        for key, rows in (("row_outputs", True), ("single_outputs", False)):
+            part = [(k, o) for (k, o), row in zip(outputs, is_row) if row == rows]
+            if not part:
+                ret[key] = None
+                continue
+            dec = np.array([k for k, _ in part], dtype=np.int64)
+            red, green = ret["in_red"][dec], ret["in_green"][dec]
+            signal = np.array([-9 if o["signal"] is None else o["signal"] for _, o in part])
+            networks = np.array([o["networks"] for _, o in part])
+            ret[key] = {
+                "decider": dec,
+                "copy": np.array([o["copy"] for _, o in part], dtype=bool),
+                "constant": wrap(np.array([o["constant"] for _, o in part], dtype=np.int64)),
+                "input": self.input_cells(red, green, networks, columns) if rows else
+                self.operand_cells(red, green, signal, networks, [0] * len(part)),
+                "scatter": self.scatter(ret["out_red"][dec], ret["out_green"][dec], columns=columns) if rows else
+                self.scatter(ret["out_red"][dec], ret["out_green"][dec], signal),
+            }
+        return ret
+
+    @staticmethod
+    def inputs(values, cells):
+        """input matrix of entities, cells of their red and green input from input_cells"""
+        return values[cells[0]] + values[cells[1]]
+
+    @staticmethod
+    def operand(values, cells):
+        """value of an operand, cells are the red and green cells and the constant from operand_cells"""
+        return values[cells[0]] + values[cells[1]] + cells[2]
+
+    def step_arithmetic(self, values, new):
+        for g in self.arithmetic_groups:
+            b = self.operand(values, g["second"])
+            if g["kind"] == "scalar":
+                g["scatter"].add(new, calculate(g["op"], self.operand(values, g["first"]), b))
+                continue
+            matrix = self.inputs(values, g["first"])
+            result = calculate(g["op"], matrix, b[:, None])
+            if g["op"] not in ZERO_KEEPING:
+                result = np.where(matrix != 0, result, 0)  # each skips the signals which are not present
+            g["scatter"].add(new, result if g["kind"] == "rows" else result.sum(axis=1, dtype=np.int32))
+
+    def step_plain_deciders(self, values, new):
+        d = self.plain_deciders
+        if not d["count"]:
+            return
+        first = self.operand(values, d["cond_first"])
+        second = self.operand(values, d["cond_second"])
+        result = np.zeros(len(first), dtype=bool)
+        for comparator, mask in d["comparator_masks"].items():
+            result[mask] = COMPARATORS[comparator](first[mask], second[mask])
+        # "and" is evaluated before "or"
+        groups = np.logical_and.reduceat(result, d["group_starts"])
+        passed = np.logical_or.reduceat(groups, d["decider_group_starts"])
+        self.emit_outputs(values, new, d, passed, None)
+
+    def step_each_deciders(self, values, new):
+        d = self.each_deciders
+        if not d["count"]:
+            return
+        first = self.inputs(values, d["cond_first"])
+        second = self.operand(values, d["cond_second"])
+        result = np.zeros(first.shape, dtype=bool)
+        for comparator in set(d["cond_comparator"]):
+            rows = np.array([c == comparator for c in d["cond_comparator"]])
+            result[rows] = COMPARATORS[comparator](first[rows], second[rows][:, None])
+        result &= first != 0
+        self.emit_outputs(values, new, d, result.any(axis=1), result)
+
+    @staticmethod
+    def senders(live):
+        """indices of the outputs which send this tick, None when sending zeros from the others is cheaper"""
+        some = np.flatnonzero(live)
+        return some if len(some) * 8 < len(live) else None
+
+    def emit_outputs(self, values, new, d, passed, per_signal):
+        """outputs of the deciders which passed, per_signal is the each condition result matrix"""
+        if not passed.any():
+            return
+        rows = d["row_outputs"]
+        if rows is not None:
+            some = self.senders(passed[rows["decider"]])
+            pick = slice(None) if some is None else some
+            matrix = self.inputs(values, (rows["input"][0][pick], rows["input"][1][pick]))
+            if per_signal is not None:
+                matrix = matrix * per_signal[rows["decider"][pick]]
+            matrix = np.where(rows["copy"][pick, None], matrix, matrix != 0)
+            if some is None:
+                matrix = matrix * passed[rows["decider"]][:, None]
+            rows["scatter"].add(new, matrix, some)
+        single = d["single_outputs"]
+        if single is not None:
+            some = self.senders(passed[single["decider"]])
+            pick = slice(None) if some is None else some
+            value = self.operand(values, tuple(cells[pick] for cells in single["input"]))
+            value = np.where(single["copy"][pick], value, single["constant"][pick])
+            if some is None:
+                value = value * passed[single["decider"]]
+            single["scatter"].add(new, value, some)
+
+    def step(self):
+        """simulate 1 tick, combinator outputs of this tick are seen by the networks of the next tick"""
+        values = self.net_values
+        new = self.const_values.copy()  # int32, the sums wrap around like the game
+        self.step_arithmetic(values, new)
+        self.step_plain_deciders(values, new)
+        self.step_each_deciders(values, new)
+        self.net_values = new
+        self.tick += 1
+
+    def switch_on(self, entity_number=None):
+        """switch on a disabled constant combinator, all of them if entity number is None"""
+        for constant in self.constants:
+            if entity_number is None or self.numbers.get(entity_number) == constant["idx"]:
+                constant["on"] = True
+        self.build_const_values()
+
+    def build_const_values(self):
+        values = np.zeros(self.zero + 1, dtype=np.int64)
+        for constant in self.constants:
+            if constant["on"]:
+                for sig, count in ((sig, count) for sig, count in constant["filters"] if sig >= 0):
+                    for connector in (1, 2):
+                        values[self.cell(self.net(constant["idx"], connector), sig)] += count
+        values[self.zero] = 0
+        self.const_values = wrap(values)
+
+    def signal(self, entity_number, connector, name):
+        """value of a signal on the network of a connector at the current tick"""
+        sig = self.signal_id(name)
+        if not 0 <= sig < self.width:
+            return 0  # no entity of the blueprint uses it
+        return int(self.net_values[self.cell(self.net(self.numbers[entity_number], connector), sig)])
+
+    def frame(self):
+        """BGR lamp colors of the current tick, shape (rows, cols, 3)"""
+        if not self.lamps:
+            return np.zeros((0, 0, 3), dtype=np.uint8)
+        values = self.net_values[self.lamp_cells[0]] + self.net_values[self.lamp_cells[1]]
+        color = np.clip(values[:, 1:], 0, 255)
+        if self.lamp_packed.any():
+            color[self.lamp_packed] = (values[self.lamp_packed, :1] >> PACKED_SHIFTS) & 0xFF
+        color = color.astype(np.uint8)
+        unlit = (self.lamp_mode < 1) | ~color.any(axis=1)
+        color[unlit] = self.lamp_color[unlit]
+        image = np.zeros(self.image_shape, dtype=np.uint8)
+        image.reshape(-1, 3)[self.lamp_pixel] = color
+        return image
+
+    def run(self, ticks, every=1):
+        """simulate ticks, return the frames rendered every `every` ticks with shape (n, rows, cols, 3)"""
+        frames = []
+        for i in range(ticks):
+            if i % every == 0:
+                frames.append(self.frame())
+            self.step()
+        return np.stack(frames) if frames else np.zeros((0, 0, 0, 3), dtype=np.uint8)
+
+    def graph(self):
+        """entity index -> indices of entities whose inputs are on its output networks"""
+        readers = {}
+        for idx, name in enumerate(self.names):
+            connectors = (1, 2) if name in COMBINATORS or name == "small-lamp" else ()
+            for connector in connectors:
+                net = self.net(idx, connector)
+                if net != self.dummy:
+                    readers.setdefault(net, set()).add(idx)
+        ret = []
+        for idx, name in enumerate(self.names):
+            connectors = (3, 4) if name in COMBINATORS else (1, 2) if name == "constant-combinator" else ()
+            targets = set()
+            for connector in connectors:
+                targets |= readers.get(self.net(idx, connector), set())
+            targets.discard(idx)
+            ret.append(targets)
+        return ret
+
+    def latency(self):
+        """
+        ticks from the constant combinators to the lamps, 1 tick per combinator on the path
+        return (min, max) of the shortest path of every lit lamp, None if no lamp is reachable
+        """
+        graph = self.graph()
+        depth = {c["idx"]: 0 for c in self.constants}
+        frontier = list(depth)
+        while frontier:
+            nxt = []
+            for idx in frontier:
+                for target in graph[idx]:
+                    if target not in depth:
+                        depth[target] = depth[idx] + (self.names[target] in COMBINATORS)
+                        nxt.append(target)
+            frontier = nxt
+        ticks = [depth[lamp["idx"]] for lamp in self.lamps if lamp["idx"] in depth]
+        return (min(ticks), max(ticks)) if ticks else None
+
+    def check_wiring(self):
+        """list of wiring problems: bad wires, unconnected lamps and combinators"""
+        issues = list(self.issues)
+        graph = self.graph()
+        driven = set()
+        for targets in graph:
+            driven |= targets
+        for lamp in self.lamps:
+            if lamp["idx"] not in driven and lamp["mode"] >= 1:
+                issues.append("lamp at ({}, {}) is not driven by any combinator".format(lamp["x"], lamp["y"]))
+        for idx, name in enumerate(self.names):
+            if name not in COMBINATORS:
+                continue
+            number = self.entity_numbers[idx]
+            if self.net(idx, 1) == self.dummy and self.net(idx, 2) == self.dummy:
+                issues.append("{} {} has no input".format(name, number))
+            if self.net(idx, 3) == self.dummy and self.net(idx, 4) == self.dummy:
+                issues.append("{} {} has no output".format(name, number))
+        return issues
+
+
+def main():
+    parser = argparse.ArgumentParser(description="simulate a player blueprint")
+    parser.add_argument("blueprint", help="file with the blueprint string")
+    parser.add_argument("--ticks", type=int, default=0, help="ticks to simulate")
+    parser.add_argument("--every", type=int, default=1, help="render every n ticks")
+    parser.add_argument("--switch-on", action="store_true", help="switch on the disabled constant combinators")
+    parser.add_argument("--video", help="write rendered frames to a video file")
+    args = parser.parse_args()
+    with open(args.blueprint, encoding="utf8") as f:
+        sim = Simulator.from_string(f.read().strip())
+    issues = sim.check_wiring()
+    for issue in issues[:50]:
+        print(issue)
+    print("{} wiring issue(s)".format(len(issues)))
+    print("latency (ticks):", sim.latency())
+    if args.switch_on:
+        sim.switch_on()
+    if args.ticks:
+        frames = sim.run(args.ticks, args.every)
+        print("simulated {} ticks".format(args.ticks))
+        if args.video:
+            import cv2
+            writer = cv2.VideoWriter(args.video, cv2.VideoWriter_fourcc(*"MJPG"), 60 // args.every,
+                                     (frames.shape[2], frames.shape[1]))
+            for frame in frames:
+                writer.write(frame)
+            writer.release()
+    return 1 if issues else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,14 +1,104 @@
 # This script show how to decode and encode blueprint
+#
+# round trip of the blueprint string below:
+#   python test.py
+# check 2 blueprint strings are the same blueprint, e.g. a player written with and without BluePrint.COMPACT:
+#   python test.py a.txt b.txt
+# entities are matched by name and position, so their order and entity numbers may differ,
+# fields the game fills with defaults on import are filled before comparing
 
 import base64
+import json
+import sys
 import zlib
 
 # encoded blueprint string
 bp_str = "0eNqVU9FuwjAM/Bc/TikahcCotC9BqEqLB5bapEtdNoTy73OCoNLGQDQv6dk++y7JCapmwM6TZShOQLWzPRTrE/S0s6aJmDUtQgHGE+9bZKqz2rUVWcPOQ1BAdovfUEyDulEV+dhYvl2Th40CtExMeG6bfo6lHdoKvZCq++0VdK6XamdjT2HMZsvpRCs4yvYtX0ormYC9a8oK9+ZAUiOJI1kp4W0i6GPgg3zP5aiCj11sfiDPgyDXac4ZGZp6H+X0GGnKi1gRpmUG16E359ngRWrdwN3wNLt86o8vubpn8ANX9ET/44vouFox7uVYLmesxKGG0f9GHyjxuBXsU0IiQmDrfJvSZOjO+DR0Ae8JGKJ/86j5ckke0u88on2uwSJsZIV4/77Ip8u3nqo8ro1gxNhKwfg2FBxEdXJUL/LVfLXS8+Usf53pEH4AuTMavg=="
-# decode blueprint string
-decode_str = zlib.decompress(base64.b64decode(bp_str[1:]))
-print(decode_str)
-# encode
-encode_str = bp_str[0] + str(base64.b64encode(zlib.compress(decode_str, 9)), encoding='utf8')
-print(encode_str==bp_str)
 
+
+def decode(bp_str):
+    """blueprint string -> json bytes"""
+    return zlib.decompress(base64.b64decode(bp_str[1:]))
+
+
+def encode(decode_str):
+    """json bytes -> blueprint string"""
+    return "0" + str(base64.b64encode(zlib.compress(decode_str, 9)), encoding='utf8')
+
+
+def fill_defaults(value):
+    """fill the fields a compact blueprint leaves to the game: filter quality and comparator, color alpha, item type"""
+    if isinstance(value, list):
+        for item in value:
+            fill_defaults(item)
+    elif isinstance(value, dict):
+        if "name" in value and "count" in value and "index" in value:  # constant combinator filter
+            value.setdefault("quality", "normal")
+            value.setdefault("comparator", "=")
+            value.setdefault("type", "item")
+        if set(value) >= {"r", "g", "b"}:
+            value.setdefault("a", 1)
+        for item in value.values():
+            fill_defaults(item)
+
+
+def normalize(blueprint):
+    """entities keyed by (name, x, y) without entity numbers, and a sorted list of wires with these keys"""
+    keys = {}
+    entities = {}
+    for entity in blueprint.get("entities", []):
+        entity = dict(entity)
+        key = (entity["name"], entity["position"]["x"], entity["position"]["y"])
+        keys[entity.pop("entity_number")] = key
+        fill_defaults(entity)
+        if key in entities:
+            raise ValueError("2 entities at {}".format(key))
+        entities[key] = entity
+    wires = sorted(tuple(sorted([(keys[a], pole_a), (keys[b], pole_b)])) for a, pole_a, b, pole_b in
+                   blueprint.get("wires", []))
+    rest = {key: value for key, value in blueprint.items() if key not in ("entities", "wires")}
+    return entities, wires, rest
+
+
+def compare(path_a, path_b):
+    """print the differences of 2 blueprint strings, return the number of differences"""
+    with open(path_a, encoding="utf8") as f:
+        a = json.loads(decode(f.read().strip()))
+    with open(path_b, encoding="utf8") as f:
+        b = json.loads(decode(f.read().strip()))
+    if "blueprint_book" in a or "blueprint_book" in b:
+        pairs = [(x["blueprint"], y["blueprint"]) for x, y in zip(a["blueprint_book"]["blueprints"],
+                                                                  b["blueprint_book"]["blueprints"])]
+        diffs = abs(len(a["blueprint_book"]["blueprints"]) - len(b["blueprint_book"]["blueprints"]))
+    else:
+        pairs = [(a["blueprint"], b["blueprint"])]
+        diffs = 0
+    for index, (x, y) in enumerate(pairs):
+        entities_a, wires_a, rest_a = normalize(x)
+        entities_b, wires_b, rest_b = normalize(y)
+        for key in sorted(set(entities_a) | set(entities_b)):
+            if entities_a.get(key) != entities_b.get(key):
+                diffs += 1
+                if diffs <= 10:
+                    print("blueprint {} entity {}:\n  {}\n  {}".format(index, key, entities_a.get(key),
+                                                                      entities_b.get(key)))
+        if wires_a != wires_b:
+            diffs += 1
+            print("blueprint {}: wires differ, {} and {}".format(index, len(wires_a), len(wires_b)))
+        if rest_a != rest_b:
+            diffs += 1
+            print("blueprint {}: fields differ".format(index))
+        print("blueprint {}: {} entities, {} wires".format(index, len(entities_a), len(wires_a)))
+    print("same blueprint" if diffs == 0 else "{} difference(s)".format(diffs))
+    return diffs
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        sys.exit(1 if compare(sys.argv[1], sys.argv[2]) else 0)
+    # decode blueprint string
+    decode_str = decode(bp_str)
+    print(decode_str)
+    # encode
+    encode_str = encode(decode_str)
+    print(encode_str == bp_str)